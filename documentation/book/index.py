@@ -152,6 +152,190 @@ summary_table
 summary_table = get_table_summary(df, strata='group', show_overall=False, show_n=False)
 summary_table
 
+# %% [markdown]
+# ### Stratifying by more than one column
+
+# strata can also be a list of columns. In that case there is one column for each combination of values,
+# grouped under the values of the first column, and an overall column for each value of the first column.
+# Strata columns may not have missing values, so here we drop the last row of our sample data.
+
+# %%
+summary_table = get_table_summary(df.dropna(), strata=['group', 'gender'])
+summary_table
+
+# %% [markdown]
+# ### Stratifying by bins of a numerical column
+
+# A numerical column can be binned on the fly, without creating a new column in the dataframe, passing to strata a dictionary
+# with the column name as key and the bin edges as value. Bins are closed on the left, and the last one also on the right.
+
+# %%
+summary_table = get_table_summary(df.dropna(), strata={'age': [20, 40, 60, 80]})
+summary_table
+
+# %% [markdown]
+# ### Summarizing a subset of rows
+
+# Instead of slicing the dataframe (which makes a copy of it) you can select the rows to summarize with the where parameter.
+# It accepts a boolean mask, a string with a boolean expression as in pandas.DataFrame.eval or an array of row positions.
+
+# %%
+summary_table = get_table_summary(df, strata='group', where='age > 40')
+summary_table
+
+# %% [markdown]
+# ### Pooling strata
+
+# Additional columns summarizing several strata together can be added with the pooled_columns parameter. Those columns
+# are calculated combining the statistics already calculated for each stratum, without going through the data again.
+
+# %%
+df2 = df.copy()
+df2['arm'] = ['A', 'B', 'C', 'D'] * 25 + ['A']
+summary_table = get_table_summary(df2, strata='arm', pooled_columns={'All active': ['B', 'C', 'D']})
+summary_table
+
+# %% [markdown]
+# ### One table for each group
+
+# With by, one table is calculated for each value of a column, for example one table per study site, and a dictionary
+# with the values of the column as keys and the tables as values is returned. The dataframe is split only once and 
+# the column types are detected only once for all the tables. With n_jobs the tables are calculated in parallel threads.
+# As for strata, the by column may not have missing values.
+
+# %%
+tables = get_table_summary(df.dropna(subset=['region']), strata='group', by='region')
+tables['North']
+
+# %% [markdown]
+# ### Data larger than memory
+
+# Besides pandas dataframes, the data can be a numpy structured array or memmap, a pyarrow Table or the path to an 
+# Arrow IPC/Feather file, which is memory-mapped. Numerical columns are then summarized without copying them into memory
+# (for Arrow files, if they are written without compression and the columns have no missing values), so the 
+# operating system reads them from disk as they are needed. Arrow string columns stay in their Arrow buffers as pyarrow 
+# backed columns instead of being converted to python objects.
+
+# %%
+df.to_feather('sample_data.feather', compression='uncompressed')
+summary_table = get_table_summary('sample_data.feather', strata='group')
+summary_table
+
+# %% [markdown]
+# The memory needed for the calculation can be bounded with memory_limit. If the estimate from the dtypes and the
+# number of rows is over the limit, the columns are summarized going through the rows in chunks, and quantiles are 
+# approximated for columns of the table with more than 10000 observations. Chunks have at least 1000 rows, and a limit
+# smaller than the 16 bytes per row needed for the cell codes and the sketches of the cells raises an exception.
+
+# %%
+summary_table = get_table_summary('sample_data.feather', strata='group', memory_limit='4GB')
+summary_table
+
+# %% [markdown]
+# ### Categorical variables with many levels
+
+# For variables with a long tail of levels, such as diagnosis codes, categorical_top_k shows only the most frequent levels
+# and an Other level counting the rest. The most frequent levels are found with a Misra-Gries summary going through the
+# column in chunks and only those levels are counted and formatted. Identifier or free text columns left in the data by 
+# mistake can be caught with max_levels: by default a column with more distinct values raises an exception, with 
+# high_cardinality='skip' it is left out and with high_cardinality='other' it is collapsed as with categorical_top_k.
+
+# %%
+summary_table = get_table_summary(df, strata='group', categorical_top_k=2)
+summary_table
+
+# %% [markdown]
+# ### Previewing a table on a sample
+
+# For very large data, preview=True first calculates the table on a random sample of preview_size rows, showing
+# percentages and means with 95% confidence intervals, so the shape of the table can be checked in a moment. The
+# refine method then calculates the exact table on all the rows.
+
+# %%
+preview = get_table_summary(df, strata='group', preview=True, preview_size=50, random_state=0)
+preview
+
+# %%
+summary_table = preview.refine()
+summary_table
+
+# %% [markdown]
+# ### Confidence intervals
+
+# ci='bootstrap' adds 95% percentile bootstrap confidence intervals: after the count and percentage of each categorical 
+# level, and as the rows "Mean [95% CI]" and "Median [95% CI]" for numerical variables. n_bootstrap sets the number of 
+# resamples (1000 by default) and random_state makes the intervals reproducible, also when the resamples are calculated 
+# in parallel threads with n_jobs. Intervals cannot be combined with memory_limit.
+
+# %%
+summary_table = get_table_summary(df, strata='group', ci='bootstrap', random_state=42)
+summary_table
+
+# %% [markdown]
+# ### Many numerical columns
+
+# For data with thousands of numerical columns (for example biomarker panels) engine='wide' summarizes all the
+# float columns at once as one 2D array instead of one column at a time. The result is the same, but it only applies
+# when all the numerical functions are the ones included in the package.
+
+# %%
+summary_table = get_table_summary(df, strata='group', engine='wide')
+summary_table
+
+# %% [markdown]
+# For large numerical panels, precision='float32' keeps the numerical columns in the narrowest dtype holding their values
+# exactly (small integer widths, float32 for float values that do not change), halving the memory that is read and sorted.
+# Statistics are still calculated in float64, so the table is the same.
+
+# %%
+summary_table = get_table_summary(df, strata='group', precision='float32')
+summary_table
+
+# %% [markdown]
+# By default engine is 'auto', which chooses the wide engine from the number of float columns, strata cells and rows (but not
+# for memory-mapped or Arrow data, which would be copied into one array) and calculates large by groups in parallel threads. Columns are only summarized in chunks with memory_limit, so the table does not depend on the 
+# memory of the machine. engine='loop' or 'wide' and n_jobs override the choice, and the engine used is reported in the attrs 
+# of the table summary dataframe.
+
+# %%
+from pysummaries import calculate_table_summary
+
+summary_df, strat_numbers = calculate_table_summary(df, strata='group')
+summary_df.attrs
+
+# %% [markdown]
+# ### Many summaries of the same dataframe
+
+# When many tables are needed for different strata or subsets of the same dataframe, a SummaryIndex can be built once
+# and passed instead of the dataframe. The index keeps a compressed bitmap of the rows for every level of the categorical
+# columns, so subsets and categorical counts are calculated from the bitmaps without going through the columns again. 
+# With an index, strata must be categorical columns and where a dictionary of columns and values.
+
+# %%
+from pysummaries import SummaryIndex
+
+index = SummaryIndex(df)
+summary_table = get_table_summary(index, strata='group', where={'region': ['North', 'South']})
+summary_table
+
+# %% [markdown]
+# ### Precomputed summary cubes
+
+# For exploration over a few dimension columns, a SummaryCube precomputes the counts, moments and a quantile sketch of every
+# variable for each combination of the dimensions. Any stratification or filter over those dimensions is then calculated 
+# rolling up the cells of the cube, without going through the rows. The cube can be saved to a file and loaded later, and 
+# memory_usage reports its size in bytes. Sketches have at most sketch_size points (10000 by default) per cell, so quantiles 
+# are exact up to that number of observations and approximate for larger columns; exact_quantiles=True keeps all the sorted 
+# values instead, at the cost of a cube as large as the numerical columns.
+
+# %%
+from pysummaries import SummaryCube
+
+cube = SummaryCube(df.dropna(subset=['gender', 'region']), dimensions=['group', 'gender', 'region'])
+print(cube.memory_usage())
+summary_table = get_table_summary(cube, strata='gender', where={'group': 'Control'})
+summary_table
+
 # %% [markdown]
 # ## Changing or hiding the categorical missing level
 
@@ -116,6 +116,82 @@ summary_gt = (GT(summary_df.reset_index(), rowname_col="level_1", groupname_col=
 summary_gt
 # %%
 
+# %% [markdown]
+# ## Counting individuals with id_column
+#
+# For the particular case of counting individuals instead of observations, calculate_table_summary (and get_table_summary)
+# have the option id_column. When set to the column identifying the individuals, the categorical counts, the percentages
+# and the Ns in the column headers are calculated on the number of distinct individuals, so the manual
+# steps above are not needed.
+
+# %%
+summary_df, strat_nums = calculate_table_summary(df, strata="group", columns_include=['medication'], id_column='id')
+pandas_to_report_html(summary_df, strat_numbers=strat_nums)
+
+# %% [markdown]
+# ## Data in long format
+#
+# Laboratory values or vital signs usually come in long format, with one row per subject, parameter and value.
+# summarize_long summarizes them without pivoting to wide format: variable_col is the column with the names of
+# the variables and value_col the column with the values. Each variable is summarized as numerical or categorical
+# depending on its values, and the result has the same layout as calculate_table_summary.
+
+# %%
+from pysummaries import summarize_long
+
+long_df = pd.DataFrame({'id': [1, 1, 2, 2, 3, 3, 4],
+                        'group': ['Control', 'Control', 'Experimental', 'Experimental', 'Experimental', 'Experimental', 'Control'],
+                        'parameter': ['weight', 'smoker', 'weight', 'smoker', 'weight', 'smoker', 'weight'],
+                        'value': [70.5, 'yes', 82.0, 'no', 65.2, 'no', 90.1]})
+summary_df, strat_nums = summarize_long(long_df, variable_col='parameter', value_col='value', strata='group', id_column='id')
+pandas_to_report_html(summary_df, strat_numbers=strat_nums)
+
+# %% [markdown]
+# ## Aggregated data
+#
+# If the data are already aggregated, for example by a GROUP BY query in a database, from_aggregates calculates the same
+# table summary without the individual records. Categorical aggregates have one row per stratum, variable and level with the
+# count, numerical aggregates one row per stratum and variable with count, nmissing, sum, sum_squares, min, max and optionally
+# q1, median and q3. Quantiles cannot be combined across strata, so for the Overall column they are taken from a roll-up row
+# where the strata are missing.
+
+# %%
+from pysummaries import from_aggregates
+
+counts = pd.DataFrame({'group': ['Control', 'Control', 'Experimental', 'Experimental'],
+                       'variable': ['smoker'] * 4,
+                       'level': ['yes', 'no', 'yes', 'no'],
+                       'count': [10, 40, 12, 39]})
+moments = pd.DataFrame({'group': ['Control', 'Experimental', None],
+                        'variable': ['weight'] * 3,
+                        'count': [50, 51, 101], 'nmissing': [0, 0, 0],
+                        'sum': [3510.0, 3620.0, 7130.0], 'sum_squares': [252000.0, 263000.0, 515000.0],
+                        'min': [50.0, 52.0, 50.0], 'max': [98.0, 101.0, 101.0],
+                        'q1': [62.0, 63.0, 62.5], 'median': [70.0, 71.0, 70.5], 'q3': [78.0, 79.0, 78.5]})
+summary_df, strat_nums = from_aggregates(counts, moments, strata='group')
+pandas_to_report_html(summary_df, strat_numbers=strat_nums)
+
+# %% [markdown]
+# ## Data in a database
+#
+# summarize_sql calculates the aggregates inside a database through a DB-API connection (for example sqlite3) and
+# only the aggregates are fetched to build the table summary. Quantiles are calculated with PERCENTILE_CONT, with
+# QUANTILE_CONT for DuckDB, or with window functions for SQLite, which has no percentile functions.
+
+# %%
+import sqlite3
+from pysummaries import summarize_sql, get_sample_data
+
+connection = sqlite3.connect(':memory:')
+get_sample_data().to_sql('patients', connection, index=False)
+summary_df, strat_nums = summarize_sql(connection, 'patients', strata='group', where="age > 18")
+pandas_to_report_html(summary_df, strat_numbers=strat_nums)
+
+# %% [markdown]
+# For Parquet or CSV files, summarize_duckdb does the same with DuckDB (install it with pip install pysummaries[duckdb]),
+# which reads the files in parallel and, for Parquet, only the columns needed. The path can be a glob, for example
+# `summarize_duckdb('data/*.parquet', strata='group')`.
+
 # %% [markdown]
 # ## Other options
 # 
@@ -13,18 +13,20 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 # #############################################################################
-from .table_summary import (calculate_table_summary, 
-        categorical_n, categorical_n_percent, categorical_percent, 
-        numerical_mean_sd, numerical_median_iqr, numerical_median_q1q3, numerical_min_max, 
+from .table_summary import (calculate_table_summary, SummaryIndex, SummaryCube,
+        summarize_long, from_aggregates, summarize_sql, summarize_duckdb,
+        categorical_n, categorical_n_percent, categorical_percent, categorical_percent_ci,
+        numerical_mean_sd, numerical_mean_ci, numerical_median_iqr, numerical_median_q1q3, numerical_min_max, 
         numerical_missing)
 from .sample_data import get_sample_data
 from .reportable import pandas_to_report_html, get_styles, Pandas2HTMLSummaryTable
-from .pysummaries import get_table_summary
+from .pysummaries import get_table_summary, TableSummaryPreview
 
-__all__ = ['get_table_summary',
-        'calculate_table_summary',
-        'categorical_n', 'categorical_n_percent', 'categorical_percent',
-        'numerical_mean_sd', 'numerical_median_iqr', 'numerical_median_q1q3', 'numerical_min_max', 
+__all__ = ['get_table_summary', 'TableSummaryPreview',
+        'calculate_table_summary', 'SummaryIndex', 'SummaryCube',
+        'summarize_long', 'from_aggregates', 'summarize_sql', 'summarize_duckdb',
+        'categorical_n', 'categorical_n_percent', 'categorical_percent', 'categorical_percent_ci',
+        'numerical_mean_sd', 'numerical_mean_ci', 'numerical_median_iqr', 'numerical_median_q1q3', 'numerical_min_max', 
         'numerical_missing', 'get_sample_data', 'pandas_to_report_html', 'get_styles', 'Pandas2HTMLSummaryTable']
 
 __version__ = '0.0.1b1'
@@ -13,9 +13,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 # #############################################################################
+from functools import partial
+
+import pandas as pd
 from great_tables import GT, html
 
-from .table_summary import calculate_table_summary
+from .table_summary import calculate_table_summary, SummaryIndex, SummaryCube
+from .table_summary.table_summary import get_functions
+from .table_summary.strata import sample_rows
+from .table_summary.utils import as_dataframe
+from .table_summary import summary_fun as sf
 from .reportable import pandas_to_report_html
 
 # TODO:
@@ -23,14 +30,21 @@ from .reportable import pandas_to_report_html
 def get_table_summary(df, strata=None, backend='native', show_n=True, show_overall=True, columns_labels=None, overall_name="Overall",
         columns_include=None, columns_exclude=None,
         rounding=1, categorical_functions=None, numerical_functions=None,
-        categorical_missing_level='Missing', **kwargs):
+        categorical_missing_level='Missing', id_column=None, pooled_columns=None, where=None, engine='auto', by=None, n_jobs=None,
+        max_levels=None, high_cardinality='raise', categorical_top_k=None, preview=False, preview_size=10000, random_state=None, 
+        memory_limit=None, precision='float64', ci=None, n_bootstrap=1000, **kwargs):
     """
     Calculates a summary table for the pandas dataframe df and returns an object for nice display.
 
-    :param df: pandas dataframe from which to calculate the table one
-    :type df: pandas dataframe, mandatory
-    :param strata: the name of a column in the dataframe to stratify the table one (columns)
-    :type strata: str, optional
+    :param df: pandas dataframe from which to calculate the table one, or a SummaryIndex or SummaryCube built on it. In the latter cases 
+        categorical_missing_level is the one of the index or cube and id_column is not supported. It can also be a numpy structured array 
+        or memmap, a pyarrow Table or the path to an Arrow IPC/Feather file, see calculate_table_summary.
+    :type df: pandas dataframe, SummaryIndex, SummaryCube, numpy array, pyarrow Table or str, mandatory
+    :param strata: the name of a column in the dataframe to stratify the table one (columns). If a list of column names, there will be one 
+        column for each combination of values of those columns, grouped under the values of the outer columns. A numerical column can 
+        be binned on the fly passing a dictionary with the column name as key and a list of increasing bin edges as value, 
+        for example {'age': [18, 40, 65, 120]}.
+    :type strata: str, list or dict, optional
     :param backend: the backend used to display the summary, either 'native' or 'gt' (great_tables)
     :type backend: str, optional
     :param show_n: Show the number of observations on the column header
@@ -59,9 +73,59 @@ def get_table_summary(df, strata=None, backend='native', show_n=True, show_overa
     :param categorical_missing_level: if a categorical column has NAs, they will be replaced by the string indicated here, by default 'Missing'. That will create a new level 
         in the category. If set to None, the NAs will not be replaced.
     :type categorical_missing_level: str, optional
+    :param id_column: the name of a column in the dataframe identifying subjects, for data where one subject may have multiple records.
+        If set, categorical counts, percentages and the number of observations in the column headers count distinct subjects instead of records.
+    :type id_column: str, optional
+    :param pooled_columns: a dictionary to add columns summarizing several strata together, for example {'All active': ['B', 'C', 'D']}. Keys 
+        are the names of the new columns and values lists of strata values. The pooled columns are placed before the Overall column.
+    :type pooled_columns: dict, optional
+    :param where: rows to summarize, either a boolean mask with the same length as the dataframe, a string with a boolean expression 
+        that will be evaluated with pandas.DataFrame.eval, a dictionary with column names as keys and a value or list of values to keep, 
+        or an array with the integer positions of the rows. The dataframe is not copied.
+    :type where: boolean array, str, dict or integer array, optional
+    :param engine: 'loop' to summarize numerical columns one by one, 'wide' to summarize all float columns at once
+        as one 2D array, which is much faster for thousands of numerical columns, or 'auto' (default) to choose from the shape of 
+        the data, see calculate_table_summary. Ignored for a SummaryIndex or SummaryCube.
+    :type engine: str, optional
+    :param by: the name of a column in the dataframe to get one table for each of its values (for example one table per study site). 
+        The dataframe is split only once and column types are detected only once for all the tables. Not supported for a SummaryIndex
+        or SummaryCube.
+    :type by: str, optional
+    :param n_jobs: number of threads to calculate the by groups in parallel, by default 1 or chosen by engine 'auto'
+    :type n_jobs: int, optional
+    :param max_levels: maximum number of levels for categorical columns, estimated with HyperLogLog. By default there is no maximum.
+        Not supported for a SummaryIndex or SummaryCube.
+    :type max_levels: int, optional
+    :param high_cardinality: what to do with categorical columns with more than max_levels levels: 'raise' (default), 'skip' to leave
+        them out or 'other' to show only the max_levels most frequent levels and an 'Other' level, see calculate_table_summary.
+    :type high_cardinality: str, optional
+    :param categorical_top_k: show only the categorical_top_k most frequent levels of categorical columns and an 'Other' level, 
+        see calculate_table_summary. Not supported for a SummaryIndex or SummaryCube.
+    :type categorical_top_k: int, optional
+    :param preview: if True, the table is first calculated on a simple random sample of preview_size of the rows selected by where, 
+        and a TableSummaryPreview is returned. It is displayed as the table for the sample, with percentages and 95% confidence 
+        intervals for categorical columns and a "Mean [95% CI]" row before the numerical functions, and its refine method calculates 
+        the exact table on all rows. Not supported for a SummaryIndex or SummaryCube or with by.
+    :type preview: bool, optional
+    :param preview_size: number of rows in the sample for preview, by default 10000
+    :type preview_size: int, optional
+    :param random_state: seed or numpy random Generator to draw the sample for preview and the bootstrap resamples
+    :type random_state: int or numpy.random.Generator, optional
+    :param memory_limit: memory available for the calculation, as a number of bytes or a string such as '4GB'. Over the limit
+        columns are summarized in chunks of rows, see calculate_table_summary. Not supported for a SummaryIndex or SummaryCube.
+    :type memory_limit: int or str, optional
+    :param precision: 'float64' (default) or 'float32' to keep numerical columns in the narrowest dtype holding their values exactly,
+        with the same results, see calculate_table_summary. Not supported for a SummaryIndex or SummaryCube.
+    :type precision: str, optional
+    :param ci: 'bootstrap' to add 95% bootstrap confidence intervals for percentages, means and medians, see calculate_table_summary. 
+        Not supported for a SummaryIndex or SummaryCube or with memory_limit.
+    :type ci: str, optional
+    :param n_bootstrap: number of bootstrap resamples, by default 1000
+    :type n_bootstrap: int, optional
     :param kwargs: keyword arguemnts to pass to the pandas_to_report_html function or the great_tables.GT constructor. See the documentation for those for further details.
     :return: An object with the html representation of the table
-    :rtype: Pandas2HTMLSummaryTable if backend is native or great_tables.GT if backend is gt
+    :rtype: Pandas2HTMLSummaryTable if backend is native or great_tables.GT if backend is gt. If by is set, a dictionary with the 
+        values of the by column as keys and those objects as values. If preview is True, a TableSummaryPreview.
         
     :Example:
     
@@ -72,20 +136,109 @@ def get_table_summary(df, strata=None, backend='native', show_n=True, show_overa
     if backend not in ('native', 'gt'):
         raise Exception(f"Available backends are 'native' or 'gt', got {backend}")
 
-    tone, strat_numbers = calculate_table_summary(df, strata=strata, show_overall=show_overall, columns_labels=columns_labels, overall_name=overall_name, rounding=rounding, 
-            columns_include=columns_include, columns_exclude=columns_exclude,
-            categorical_functions=categorical_functions, numerical_functions=numerical_functions,
-            categorical_missing_level=categorical_missing_level)  
+    if preview:
+        if isinstance(df, (SummaryIndex, SummaryCube)) or by is not None:
+            raise Exception("preview is not supported for a SummaryIndex, a SummaryCube or with by")
+        df = as_dataframe(df)
+        summary = partial(get_table_summary, df, strata=strata, backend=backend, show_n=show_n, show_overall=show_overall, 
+                columns_labels=columns_labels, overall_name=overall_name, columns_include=columns_include, 
+                columns_exclude=columns_exclude, rounding=rounding, categorical_functions=categorical_functions, 
+                numerical_functions=numerical_functions, categorical_missing_level=categorical_missing_level, id_column=id_column,
+                pooled_columns=pooled_columns, where=where, engine=engine, n_jobs=n_jobs, max_levels=max_levels, 
+                high_cardinality=high_cardinality, categorical_top_k=categorical_top_k, memory_limit=memory_limit, 
+                precision=precision, ci=ci, n_bootstrap=n_bootstrap, random_state=random_state, **kwargs)
+        sample, nrows = sample_rows(df, where, preview_size, random_state=random_state)
+        categorical_functions, numerical_functions = get_functions(categorical_functions, numerical_functions)
+        table = summary(where=sample, categorical_functions=(sf.categorical_percent_ci, '0.0 %'),
+                numerical_functions={"Mean [95% CI]": sf.numerical_mean_ci, **numerical_functions})
+        return TableSummaryPreview(table, len(sample), nrows, summary)
+
+    if isinstance(df, (SummaryIndex, SummaryCube)):
+        if id_column is not None or by is not None or ci is not None:
+            raise Exception(f"id_column, by and ci are not supported for a {type(df).__name__}")
+        tone, strat_numbers = df.calculate_table_summary(strata=strata, where=where, show_overall=show_overall, columns_labels=columns_labels, 
+            overall_name=overall_name, rounding=rounding, columns_include=columns_include, columns_exclude=columns_exclude,
+            categorical_functions=categorical_functions, numerical_functions=numerical_functions, pooled_columns=pooled_columns)
+    else:
+        result = calculate_table_summary(df, strata=strata, show_overall=show_overall, columns_labels=columns_labels, overall_name=overall_name, rounding=rounding, 
+                columns_include=columns_include, columns_exclude=columns_exclude,
+                categorical_functions=categorical_functions, numerical_functions=numerical_functions,
+                categorical_missing_level=categorical_missing_level, id_column=id_column,
+                pooled_columns=pooled_columns, where=where, engine=engine, by=by, n_jobs=n_jobs, max_levels=max_levels,
+                high_cardinality=high_cardinality, categorical_top_k=categorical_top_k, memory_limit=memory_limit,
+                precision=precision, ci=ci, n_bootstrap=n_bootstrap, random_state=random_state)
+        if by is not None:
+            return {group: render_table_summary(group_tone, group_strat_numbers, backend=backend, show_n=show_n, **kwargs) 
+                    for group, (group_tone, group_strat_numbers) in result.items()}
+        tone, strat_numbers = result
+    return render_table_summary(tone, strat_numbers, backend=backend, show_n=show_n, **kwargs)
+
+class TableSummaryPreview:
+    """
+    Table summary calculated on a random sample of the rows, as returned by get_table_summary with preview=True. 
+    It is displayed as the table for the sample and refine calculates the exact table.
+    """
+    def __init__(self, table, sample_size, nrows, summary):
+        """
+        :param table: the object with the html representation of the table for the sample
+        :param sample_size: number of rows in the sample
+        :param nrows: number of rows the sample was drawn from
+        :param summary: function without arguments returning the exact table
+        """
+        self.table = table
+        self.sample_size = sample_size
+        self.nrows = nrows
+        self.summary = summary
+        self.refined = None
+
+    def _repr_html_(self):
+        return self.table._repr_html_()
+
+    def refine(self):
+        """
+        Calculates the table on all the rows, only the first time it is called.
+
+        :return: the exact table, as returned by get_table_summary without preview
+        """
+        if self.refined is None:
+            self.refined = self.summary()
+        return self.refined
+
+def render_table_summary(tone, strat_numbers, backend='native', show_n=True, **kwargs):
+    """
+    Gets the table summary and number of observations as returned by calculate_table_summary and 
+    returns an object for nice display. See get_table_summary for the parameters.
+    """
     if backend == 'native':
         if show_n:
             tone_html = pandas_to_report_html(tone, strat_numbers=strat_numbers, **kwargs) 
         else:
             tone_html = pandas_to_report_html(tone, strat_numbers=None, **kwargs) 
     elif backend == 'gt':
+        spanners = dict()
+        col_labels = {k: str(k) for k in tone.columns}
+        if type(tone.columns) == pd.MultiIndex:
+            # great_tables needs flat column names, the outermost level goes to spanners
+            # the numbers are copied as the same strat_numbers may be rendered again
+            strat_numbers = dict(strat_numbers)
+            flat_columns = list()
+            for col in tone.columns:
+                flatcol = " / ".join([str(x) for x in col if x != ''])
+                flat_columns.append(flatcol)
+                if col[0] != '':
+                    spanners.setdefault(str(col[0]), list()).append(flatcol)
+                col_labels[flatcol] = " / ".join([str(x) for x in col[1:] if x != ''])
+                strat_numbers[flatcol] = strat_numbers[col]
+            tone = tone.copy()
+            tone.columns = flat_columns
         tone_html = GT(tone.reset_index(), rowname_col="level_1", groupname_col="level_0", **kwargs)
+        for spanner, spanner_columns in spanners.items():
+            tone_html = tone_html.tab_spanner(spanner, columns=spanner_columns)
         # Ns 
         if show_n:
-            col_ns = {k:html(k+f"<br>(N={v})") for k,v in strat_numbers.items()}
+            col_ns = {k:html(col_labels[k]+f"<br>(N={strat_numbers[k]})") for k in tone.columns}
             tone_html = tone_html.cols_label(**col_ns)
+        elif spanners:
+            tone_html = tone_html.cols_label(**{k: col_labels[k] for k in tone.columns})
     return tone_html
 
@@ -14,11 +14,17 @@
 # limitations under the License.
 # #############################################################################
 from .table_summary import calculate_table_summary
-from .summary_fun import (categorical_n, categorical_n_percent, categorical_percent, 
-        numerical_mean_sd, numerical_median_iqr, numerical_median_q1q3, numerical_min_max, 
+from .summary_index import SummaryIndex
+from .summary_cube import SummaryCube
+from .long_format import summarize_long
+from .aggregates import from_aggregates
+from .sql import summarize_sql, summarize_duckdb
+from .summary_fun import (categorical_n, categorical_n_percent, categorical_percent, categorical_percent_ci,
+        numerical_mean_sd, numerical_mean_ci, numerical_median_iqr, numerical_median_q1q3, numerical_min_max, 
         numerical_missing)
 
-__all__ = ['calculate_table_summary',
-        'categorical_n', 'categorical_n_percent', 'categorical_percent',
-        'numerical_mean_sd', 'numerical_median_iqr', 'numerical_median_q1q3', 'numerical_min_max', 
+__all__ = ['calculate_table_summary', 'SummaryIndex', 'SummaryCube',
+        'summarize_long', 'from_aggregates', 'summarize_sql', 'summarize_duckdb',
+        'categorical_n', 'categorical_n_percent', 'categorical_percent', 'categorical_percent_ci',
+        'numerical_mean_sd', 'numerical_mean_ci', 'numerical_median_iqr', 'numerical_median_q1q3', 'numerical_min_max', 
         'numerical_missing', ]
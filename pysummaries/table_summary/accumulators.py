@@ -0,0 +1,726 @@
+# #############################################################################
+# Copyright 2024 F. Hoffmann-La Roche
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# #############################################################################
+"""
+Mergeable accumulators holding the state needed to summarise a variable.
+
+An accumulator is calculated once for a subset of rows (for example one stratum) and
+accumulators for different subsets can be merged to get the summary for the union
+of those subsets (for example the Overall column) without going through the data again.
+"""
+import math
+
+import numpy as np
+import pandas as pd
+
+from .utils import get_masked_numerical_values, narrow_values
+from . import summary_fun as sf
+
+
+class CategoricalAccumulator:
+    """
+    Counts for each level of a categorical variable and number of observations.
+    """
+    def __init__(self, counts, n, categories=None):
+        """
+        :param counts: pandas series with levels as index and counts as values
+        :param n: number of observations, including those not counted in any level
+        :param categories: list of levels if the variable is a pandas category, None otherwise
+        """
+        self.counts = counts
+        self.n = n
+        self.categories = categories
+
+    @classmethod
+    def from_series(cls, curseries):
+        """
+        Creates the accumulator from a pandas series
+        """
+        categories = None
+        dosort = True
+        if curseries.dtype.name == 'category':
+            categories = curseries.cat.categories.to_list()
+            dosort = False
+        counts = curseries.value_counts(sort=dosort)
+        return cls(counts, len(curseries), categories=categories)
+
+    def merge(self, other):
+        """
+        Returns a new accumulator with the sum of the counts in self and other
+        """
+        levels = self.counts.index.append(other.counts.index).unique()
+        counts = self.counts.reindex(levels, fill_value=0) + other.counts.reindex(levels, fill_value=0)
+        if self.categories is not None:
+            counts = counts.reindex(self.categories, fill_value=0)
+        else:
+            counts = counts.sort_values(ascending=False, kind='stable')
+        return CategoricalAccumulator(counts, self.n + other.n, categories=self.categories)
+
+    def to_series(self):
+        """
+        Rebuilds a series with the same counts as the accumulated data,
+        to apply functions for which there is no formatter
+        """
+        values = np.repeat(self.counts.index.to_numpy(dtype=object), self.counts.to_numpy())
+        nmissing = self.n - len(values)
+        values = np.concatenate([values, np.full(nmissing, np.nan, dtype=object)])
+        if self.categories is not None:
+            return pd.Series(pd.Categorical(values, categories=self.categories))
+        return pd.Series(values)
+
+    def apply(self, fun, rounding):
+        """
+        Applies the summary function fun
+        """
+        formatter = categorical_formatters.get(fun)
+        if formatter is not None:
+            return formatter(self, rounding)
+        return fun(self.to_series(), rounding)
+
+
+class NumericalAccumulator:
+    """
+    Number of observations, moments, minimum, maximum and sorted values
+    (for exact quantiles) for a numerical variable.
+    """
+    def __init__(self, count, nmissing, total, m2, minimum, maximum, values, quantiles=None, fill_value=None, nfill=0, sketch=None):
+        """
+        :param count: number of non missing observations
+        :param nmissing: number of missing observations
+        :param total: sum of the non missing observations
+        :param m2: sum of squared differences to the mean
+        :param minimum: minimum, nan if count is 0
+        :param maximum: maximum, nan if count is 0
+        :param values: sorted numpy array with the non missing observations, None if only aggregates are known
+        :param quantiles: dictionary with quantiles (as fractions) as keys and their values, used when values is None
+        :param fill_value: for sparse data, value of the observations not stored in values
+        :param nfill: number of observations equal to fill_value, not stored in values but included in count and the moments
+        :param sketch: QuantileSketch with the non missing observations, used for quantiles when values is None
+        """
+        self.count = count
+        self.nmissing = nmissing
+        self.total = total
+        self.m2 = m2
+        self.minimum = minimum
+        self.maximum = maximum
+        self.values = values
+        self.quantiles = quantiles
+        self.fill_value = fill_value
+        self.nfill = nfill
+        self.sketch = sketch
+
+    @classmethod
+    def from_series(cls, curseries):
+        """
+        Creates the accumulator from a pandas series
+        """
+        values = curseries.dropna().to_numpy()
+        return cls.from_values(values, len(curseries) - len(values))
+
+    @classmethod
+    def from_values(cls, values, nmissing=0):
+        """
+        Creates the accumulator from a numpy array of non missing values
+        """
+        values = np.sort(values)
+        count = len(values)
+        if not count:
+            return cls(0, nmissing, 0.0, 0.0, np.nan, np.nan, values)
+        total = values.sum(dtype=np.float64)
+        m2 = ((values - total/count)**2).sum()
+        return cls(count, nmissing, total, m2, values[0], values[-1], values)
+
+    @classmethod
+    def from_narrow_values(cls, values, nmissing=0, block_size=65536):
+        """
+        Creates the accumulator from a numpy array of non missing values in a narrow dtype (float32 or small integers),
+        keeping them in that dtype. The sum is compensated and the squared differences are added in float64 block by
+        block, without a float64 copy of the values.
+        """
+        values = np.sort(values)
+        count = len(values)
+        if not count:
+            return cls(0, nmissing, 0.0, 0.0, np.nan, np.nan, values)
+        blocks = range(0, count, block_size)
+        total = math.fsum([values[x:x+block_size].sum(dtype=np.float64) for x in blocks])
+        mean = total/count
+        m2 = 0.0
+        for start in blocks:
+            differences = values[start:start+block_size].astype(np.float64) - mean
+            m2 += np.dot(differences, differences)
+        minimum, maximum = values[0], values[-1]
+        if values.dtype.kind == 'f':
+            minimum, maximum = np.float64(minimum), np.float64(maximum)
+        return cls(count, nmissing, total, m2, minimum, maximum, values)
+
+    @classmethod
+    def from_sparse(cls, values, nfill, fill_value, nmissing=0):
+        """
+        Creates the accumulator from the non missing stored values of sparse data and the number of
+        observations equal to the fill value, without materializing them
+        """
+        if not nfill:
+            return cls.from_values(values, nmissing)
+        values = np.sort(values)
+        count = len(values) + nfill
+        total = values.sum(dtype=np.float64) + fill_value*nfill
+        mean = total/count
+        m2 = ((values - mean)**2).sum() + nfill*(fill_value - mean)**2
+        minimum = min(values[0], fill_value) if len(values) else fill_value
+        maximum = max(values[-1], fill_value) if len(values) else fill_value
+        return cls(count, nmissing, total, m2, minimum, maximum, values, fill_value=fill_value, nfill=nfill)
+
+    def sketched(self, size):
+        """
+        Returns the accumulator with a QuantileSketch of at most size points instead of the sorted values,
+        to be merged in bounded memory
+        """
+        if self.sketch is not None:
+            return self
+        if self.values is None:
+            raise Exception("quantiles of aggregated data cannot be sketched")
+        sketch = QuantileSketch.from_values(self.dense_values(), size)
+        return NumericalAccumulator(self.count, self.nmissing, self.total, self.m2, self.minimum, self.maximum, None, sketch=sketch)
+
+    def dense_values(self):
+        """
+        Returns the sorted non missing observations, including those equal to the fill value
+        """
+        if not self.nfill:
+            return self.values
+        position = np.searchsorted(self.values, self.fill_value)
+        return np.concatenate([self.values[:position], np.full(self.nfill, self.fill_value, dtype=self.values.dtype),
+                               self.values[position:]])
+
+    def value_at(self, rank):
+        """
+        Returns the observation at position rank in sorted order, taking into account the fill values
+        """
+        if not self.nfill:
+            return self.values[rank]
+        nless = np.searchsorted(self.values, self.fill_value)
+        if rank < nless:
+            return self.values[rank]
+        if rank < nless + self.nfill:
+            return self.fill_value
+        return self.values[rank - self.nfill]
+
+    def merge(self, other):
+        """
+        Returns a new accumulator for the union of the data in self and other
+        """
+        if not other.count:
+            return NumericalAccumulator(self.count, self.nmissing + other.nmissing, self.total, self.m2,
+                    self.minimum, self.maximum, self.values, quantiles=self.quantiles, fill_value=self.fill_value, nfill=self.nfill,
+                    sketch=self.sketch)
+        if not self.count:
+            return other.merge(self)
+        count = self.count + other.count
+        delta = other.total/other.count - self.total/self.count
+        m2 = self.m2 + other.m2 + delta**2 * self.count * other.count / count
+        # quantiles of aggregates cannot be merged
+        values = None
+        fill_value = None
+        nfill = 0
+        sketch = None
+        if self.sketch is not None or other.sketch is not None:
+            size = self.sketch.size if self.sketch is not None else other.sketch.size
+            sketch = self.sketched(size).sketch.merge(other.sketched(size).sketch)
+        elif self.values is not None and other.values is not None:
+            if not self.nfill or not other.nfill or self.fill_value == other.fill_value:
+                # sparse data keeps only the stored values
+                fill_value = self.fill_value if self.nfill else other.fill_value
+                nfill = self.nfill + other.nfill
+                values = np.sort(np.concatenate([self.values, other.values]), kind='stable')
+            else:
+                values = np.sort(np.concatenate([self.dense_values(), other.dense_values()]), kind='stable')
+        return NumericalAccumulator(count, self.nmissing + other.nmissing, self.total + other.total, m2,
+                min(self.minimum, other.minimum), max(self.maximum, other.maximum), values, fill_value=fill_value, nfill=nfill,
+                sketch=sketch)
+
+    def mean(self):
+        return self.total/self.count if self.count else np.nan
+
+    def std(self):
+        return np.sqrt(self.m2/(self.count - 1)) if self.count > 1 else np.nan
+
+    def median(self):
+        if self.values is None:
+            return self.interpolated_quantile(0.5)
+        if not self.count:
+            return np.nan
+        if self.nfill or self.values.dtype.itemsize < 8:
+            # middle observation or mean of the two middle ones, as np.median does, in float64
+            middle = self.count // 2
+            if self.count % 2:
+                return np.float64(self.value_at(middle))
+            return np.mean(np.array([self.value_at(middle - 1), self.value_at(middle)], dtype=np.float64))
+        return np.median(self.values)
+
+    def quantile(self, q):
+        value = self.interpolated_quantile(q)
+        if self.nmissing and isinstance(self.minimum, np.integer) and value == np.floor(value):
+            # as pandas for nullable integers with missing values, integral quantiles are integers
+            return np.int64(value)
+        return value
+
+    def interpolated_quantile(self, q):
+        if not self.count:
+            return np.nan
+        if self.sketch is not None:
+            return self.sketch.quantile(q)
+        if self.values is None:
+            if not self.quantiles or q not in self.quantiles:
+                raise Exception(f"quantile {q} is not available for aggregated data")
+            return self.quantiles[q]
+        if not self.nfill and self.values.dtype.itemsize == 8:
+            return np.percentile(self.values, q*100)
+        # linear interpolation between the two closest ranks in float64, as np.percentile does, also
+        # for narrow dtypes where np.percentile would interpolate in float32 or overflow
+        index = self.count*q + (1 - q) - 1
+        previous = int(np.floor(index))
+        gamma = index - previous
+        a = self.value_at(previous)
+        b = self.value_at(min(previous + 1, self.count - 1))
+        difference = np.float64(b) - np.float64(a)
+        if gamma >= 0.5:
+            return b - difference*(1 - gamma)
+        return a + difference*gamma
+
+    def to_series(self):
+        """
+        Rebuilds a series with the accumulated data, to apply functions for which there is
+        no formatter
+        """
+        if self.values is None:
+            raise Exception("only the functions included in the package can be applied to aggregated or sketched data")
+        values = self.dense_values()
+        if not self.nmissing:
+            return pd.Series(values)
+        return pd.Series(np.concatenate([values, np.full(self.nmissing, np.nan)]))
+
+    def apply(self, fun, rounding):
+        """
+        Applies the summary function fun
+        """
+        formatter = numerical_formatters.get(fun)
+        if formatter is not None:
+            return formatter(self, rounding)
+        return fun(self.to_series(), rounding)
+
+
+class QuantileSketch:
+    """
+    Mergeable summary of the distribution of a numerical variable for approximate quantiles in bounded memory:
+    at most size points, each one the mean of a run of consecutive observations in sorted order and its number 
+    of observations. As long as there are no more than size observations every point is one observation and 
+    quantiles are exact. Otherwise runs have about count/size observations and the rank error of a quantile is 
+    of that order, growing slowly with the number of merges.
+    """
+    def __init__(self, points, weights, size):
+        """
+        :param points: sorted numpy array with the means of the runs
+        :param weights: numpy array with the number of observations of each run
+        :param size: maximum number of points
+        """
+        self.points = points
+        self.weights = weights
+        self.size = size
+
+    @classmethod
+    def from_values(cls, values, size):
+        """
+        Creates the sketch from a sorted numpy array of non missing values
+        """
+        return cls.compress(np.asarray(values, dtype=np.float64), np.ones(len(values), dtype=np.int64), size)
+
+    @classmethod
+    def compress(cls, points, weights, size):
+        """
+        Creates the sketch from sorted points and weights, averaging runs of consecutive points of about the same total weight
+        if there are more than size points
+        """
+        if len(points) <= size:
+            return cls(points, weights, size)
+        total = weights.sum()
+        runs = np.minimum((np.cumsum(weights) - weights) * size // total, size - 1)
+        run_weights = np.bincount(runs, weights=weights, minlength=size)
+        kept = run_weights > 0
+        run_points = np.bincount(runs, weights=points * weights, minlength=size)[kept] / run_weights[kept]
+        return cls(run_points, run_weights[kept].astype(np.int64), size)
+
+    def merge(self, other):
+        """
+        Returns a new sketch for the observations in self and other
+        """
+        points = np.concatenate([self.points, other.points])
+        order = np.argsort(points, kind='stable')
+        return self.compress(points[order], np.concatenate([self.weights, other.weights])[order], self.size)
+
+    def quantile(self, q):
+        """
+        Quantile q (a fraction) with linear interpolation between the ranks of the points, exact as np.percentile
+        if every point is one observation
+        """
+        if not len(self.points):
+            return np.nan
+        if (self.weights == 1).all():
+            return np.percentile(self.points, q*100)
+        # rank in the middle of the run of every point
+        ranks = np.cumsum(self.weights) - (self.weights + 1) / 2
+        return np.interp(q * (self.weights.sum() - 1), ranks, self.points)
+
+
+class HeavyHitters:
+    """
+    Mergeable Misra-Gries summary of the most frequent levels of a categorical variable with at most size counters.
+    Every level with more than n/(size+1) of the n counted observations is kept, with a count that is lower than
+    the true one by at most that amount. Summaries of different chunks or partitions are merged by adding their
+    counters and pruning again, with the same guarantee for the union.
+    """
+    def __init__(self, size, counts=None, n=0):
+        """
+        :param size: maximum number of counters
+        :param counts: pandas series with levels as index and counters as values
+        :param n: number of observations counted, including missing values
+        """
+        self.size = size
+        self.counts = pd.Series(dtype=np.int64) if counts is None else counts
+        self.n = n
+
+    @classmethod
+    def from_series(cls, curseries, size):
+        """
+        Creates the summary from a pandas series, missing values are not counted in any level
+        """
+        return cls(size, cls.prune(curseries.value_counts(), size), len(curseries))
+
+    @staticmethod
+    def prune(counts, size):
+        """
+        Keeps at most size counters, subtracting the count of the first dropped counter from all of them
+        """
+        if len(counts) <= size:
+            return counts
+        counts = counts.sort_values(ascending=False, kind='stable')
+        counts = counts.iloc[:size] - counts.iloc[size]
+        return counts[counts > 0]
+
+    def merge(self, other):
+        """
+        Returns a new summary for the observations counted in self and other
+        """
+        counts = self.counts.add(other.counts, fill_value=0).astype(np.int64)
+        return HeavyHitters(self.size, self.prune(counts, self.size), self.n + other.n)
+
+    def levels(self):
+        """
+        :return: the levels with a counter, by decreasing counter
+        """
+        return self.counts.sort_values(ascending=False, kind='stable').index
+
+
+def accumulate(curseries, coltype):
+    """
+    Creates the accumulator for the series according to the coltype
+    """
+    if coltype == "categorical":
+        return CategoricalAccumulator.from_series(curseries)
+    return NumericalAccumulator.from_series(curseries)
+
+def get_missing_code(levels, categorical_missing_level):
+    """
+    Gets the code of the level for missing values, appending it to levels if it is not there.
+
+    :return: the levels and the code for missing values, -1 if categorical_missing_level is not set
+    """
+    if not categorical_missing_level:
+        return levels, -1
+    if categorical_missing_level in levels:
+        return levels, levels.get_loc(categorical_missing_level)
+    return levels.append(pd.Index([categorical_missing_level])), len(levels)
+
+def ordered_level_accumulators(levels, keys, counts, first, cell_numbers):
+    """
+    Creates one accumulator per cell from the counts of the (cell, level) keys, with levels
+    ordered by count and first appearance (first row of the key in the cell) as value_counts does.
+    Keys are cell * number of levels + level code.
+    """
+    nlevels = len(levels)
+    ncells = len(cell_numbers)
+    cells = keys // nlevels
+    order = np.lexsort((first, -counts, cells))
+    keys, counts, cells = keys[order], counts[order], cells[order]
+    bounds = np.searchsorted(cells, np.arange(ncells + 1))
+    accumulators = list()
+    for cellindx in range(ncells):
+        cell_slice = slice(bounds[cellindx], bounds[cellindx+1])
+        cell_counts = pd.Series(counts[cell_slice], index=levels[keys[cell_slice] % nlevels])
+        accumulators.append(CategoricalAccumulator(cell_counts, int(cell_numbers[cellindx])))
+    return accumulators
+
+def categorical_accumulators(curseries, cell_codes, ncells, categorical_missing_level=None):
+    """
+    Creates the accumulators of a categorical series for every cell in one pass over the level codes,
+    without copying the series. Missing values (code -1) are counted as the level categorical_missing_level
+    if set, with the same counts and order of levels as filling them in before calling value_counts.
+
+    :param curseries: pandas series with the values of the variable for all rows
+    :param cell_codes: integer numpy array with the cell of each row, rows with negative codes are not in any cell
+    :param ncells: number of cells
+    :param categorical_missing_level: level for missing values, if None they are only counted in the number of observations
+    :return: list with one CategoricalAccumulator per cell
+    """
+    if isinstance(curseries.dtype, pd.SparseDtype):
+        return sparse_categorical_accumulators(curseries, cell_codes, ncells, categorical_missing_level=categorical_missing_level)
+    categories = None
+    if curseries.dtype.name == 'category':
+        codes = curseries.cat.codes.to_numpy()
+        levels = curseries.cat.categories
+    else:
+        codes, levels = pd.factorize(curseries)
+        levels = pd.Index(levels)
+    levels, missing_code = get_missing_code(levels, categorical_missing_level)
+    if missing_code >= 0:
+        codes = np.where(codes < 0, missing_code, codes)
+    if curseries.dtype.name == 'category':
+        categories = levels.to_list()
+    nlevels = len(levels)
+    cell_numbers = np.bincount(cell_codes[cell_codes >= 0], minlength=ncells)
+    counted = np.flatnonzero((cell_codes >= 0) & (codes >= 0))
+    keys = cell_codes[counted].astype(np.int64) * nlevels + codes[counted]
+
+    if categories is not None:
+        # all categories in their order, as value_counts does for categorical series
+        accumulators = list()
+        counts = np.bincount(keys, minlength=ncells * nlevels).reshape(ncells, nlevels)
+        for cellindx in range(ncells):
+            accumulators.append(CategoricalAccumulator(pd.Series(counts[cellindx], index=levels), int(cell_numbers[cellindx]),
+                    categories=categories))
+        return accumulators
+
+    # factorize gives the keys in order of first appearance
+    key_codes, keys = pd.factorize(keys)
+    counts = np.bincount(key_codes, minlength=len(keys))
+    return ordered_level_accumulators(levels, keys, counts, np.arange(len(keys)), cell_numbers)
+
+def sparse_categorical_accumulators(curseries, cell_codes, ncells, categorical_missing_level=None):
+    """
+    As categorical_accumulators for a series with a pandas SparseDtype, counting the stored values and
+    the number of rows with the fill value in each cell, without densifying the series.
+    """
+    sparse = curseries.array
+    positions = sparse.sp_index.indices
+    codes, levels = pd.factorize(sparse.sp_values)
+    levels = pd.Index(levels)
+    fill_code = -1
+    if not pd.isna(sparse.fill_value):
+        if sparse.fill_value in levels:
+            fill_code = levels.get_loc(sparse.fill_value)
+        else:
+            fill_code = len(levels)
+            levels = levels.append(pd.Index([sparse.fill_value]))
+    levels, missing_code = get_missing_code(levels, categorical_missing_level)
+    if missing_code >= 0:
+        codes = np.where(codes < 0, missing_code, codes)
+        fill_code = missing_code if fill_code < 0 else fill_code
+    nlevels = len(levels)
+    cell_numbers = np.bincount(cell_codes[cell_codes >= 0], minlength=ncells)
+
+    # stored values
+    stored_cells = cell_codes[positions]
+    counted = np.flatnonzero((stored_cells >= 0) & (codes >= 0))
+    stored_keys = stored_cells[counted].astype(np.int64) * nlevels + codes[counted]
+    key_codes, keys = pd.factorize(stored_keys)
+    counts = np.bincount(key_codes, minlength=len(keys))
+    first = positions[counted][np.flatnonzero(~pd.Index(stored_keys).duplicated())]
+
+    if fill_code >= 0:
+        # rows with the fill value in each cell, and the first of them
+        nfill = cell_numbers - np.bincount(stored_cells[stored_cells >= 0], minlength=ncells)
+        filled = np.ones(len(cell_codes), dtype=bool)
+        filled[positions] = False
+        filled_rows = np.flatnonzero(filled & (cell_codes >= 0))
+        fill_cells, fill_first = np.unique(cell_codes[filled_rows], return_index=True)
+        keys = np.concatenate([keys, fill_cells.astype(np.int64) * nlevels + fill_code])
+        counts = np.concatenate([counts, nfill[fill_cells]])
+        first = np.concatenate([first, filled_rows[fill_first]])
+        # stored values may have the same level as the fill value, for example missing values
+        order = np.lexsort((first, keys))
+        keys, counts, first = keys[order], counts[order], first[order]
+        starts = np.flatnonzero(np.diff(keys, prepend=-1))
+        if len(keys):
+            counts = np.add.reduceat(counts, starts)
+        keys, first = keys[starts], first[starts]
+    return ordered_level_accumulators(levels, keys, counts, first, cell_numbers)
+
+def sparse_numerical_accumulators(curseries, cell_codes, ncells):
+    """
+    Creates the accumulators of a numerical series with a pandas SparseDtype for every cell from the stored values
+    and the number of rows with the fill value, without densifying the series. The memory used is proportional
+    to the number of stored values.
+
+    :param curseries: pandas series with the values of the variable for all rows
+    :param cell_codes: integer numpy array with the cell of each row, rows with negative codes are not in any cell
+    :param ncells: number of cells
+    :return: list with one NumericalAccumulator per cell
+    """
+    sparse = curseries.array
+    positions = sparse.sp_index.indices
+    values = sparse.sp_values
+    stored_cells = cell_codes[positions]
+    cell_numbers = np.bincount(cell_codes[cell_codes >= 0], minlength=ncells)
+    nfill = cell_numbers - np.bincount(stored_cells[stored_cells >= 0], minlength=ncells)
+    missing = pd.isna(values)
+    nmissing = np.bincount(stored_cells[missing & (stored_cells >= 0)], minlength=ncells)
+    kept = np.flatnonzero(~missing & (stored_cells >= 0))
+    values, stored_cells = values[kept], stored_cells[kept]
+    order = np.lexsort((values, stored_cells))
+    values, stored_cells = values[order], stored_cells[order]
+    bounds = np.searchsorted(stored_cells, np.arange(ncells + 1))
+    fill_missing = pd.isna(sparse.fill_value)
+    accumulators = list()
+    for cellindx in range(ncells):
+        cell_values = values[bounds[cellindx]:bounds[cellindx+1]]
+        if fill_missing:
+            accumulators.append(NumericalAccumulator.from_values(cell_values, int(nmissing[cellindx] + nfill[cellindx])))
+        else:
+            accumulators.append(NumericalAccumulator.from_sparse(cell_values, int(nfill[cellindx]), sparse.fill_value,
+                    int(nmissing[cellindx])))
+    return accumulators
+
+def narrow_numerical_accumulators(curseries, cell_rows):
+    """
+    Creates the accumulators of a numerical series for every cell keeping the values in the narrowest dtype
+    that holds them exactly (see narrow_values), with the statistics calculated in float64.
+
+    :param curseries: pandas series with the values of the variable for all rows
+    :param cell_rows: list of numpy arrays with the positions of the rows in each cell
+    :return: list with one NumericalAccumulator per cell
+    """
+    values, missing = get_masked_numerical_values(curseries)
+    values = narrow_values(values)
+    accumulators = list()
+    for rows in cell_rows:
+        cell_values = values[rows]
+        cell_missing = missing[rows]
+        nmissing = int(cell_missing.sum())
+        if nmissing:
+            cell_values = cell_values[~cell_missing]
+        accumulators.append(NumericalAccumulator.from_narrow_values(cell_values, nmissing))
+    return accumulators
+
+def chunked_accumulators(curseries, coltype, cell_codes, ncells, chunk_size, categorical_missing_level=None, sketch_size=10000):
+    """
+    Creates the accumulators of a series for every cell going through the rows in chunks of chunk_size rows and
+    merging the accumulators of the chunks, so the memory used does not grow with the number of rows. Numerical 
+    accumulators keep a QuantileSketch of at most sketch_size points instead of the sorted values, so their
+    quantiles are approximate if a cell has more than sketch_size observations.
+
+    :param curseries: pandas series with the values of the variable for all rows
+    :param coltype: 'categorical' or 'numerical'
+    :param cell_codes: integer numpy array with the cell of each row, rows with negative codes are not in any cell
+    :param ncells: number of cells
+    :param chunk_size: number of rows in each chunk
+    :return: list with one accumulator per cell
+    """
+    accumulators = None
+    for start in range(0, len(curseries), chunk_size):
+        chunk = curseries.iloc[start:start+chunk_size]
+        chunk_codes = cell_codes[start:start+chunk_size]
+        if coltype == "categorical":
+            chunk_accumulators = categorical_accumulators(chunk, chunk_codes, ncells, categorical_missing_level=categorical_missing_level)
+        else:
+            values, missing = get_masked_numerical_values(chunk)
+            nmissing = np.bincount(chunk_codes[missing & (chunk_codes >= 0)], minlength=ncells)
+            kept = np.flatnonzero(~missing & (chunk_codes >= 0))
+            values, codes = values[kept], chunk_codes[kept]
+            order = np.lexsort((values, codes))
+            values, codes = values[order], codes[order]
+            bounds = np.searchsorted(codes, np.arange(ncells + 1))
+            chunk_accumulators = [NumericalAccumulator.from_values(values[bounds[x]:bounds[x+1]], int(nmissing[x])).sketched(sketch_size)
+                                  for x in range(ncells)]
+        if accumulators is None:
+            accumulators = chunk_accumulators
+        else:
+            accumulators = [acc.merge(chunk_acc) for acc, chunk_acc in zip(accumulators, chunk_accumulators)]
+    if accumulators is None:
+        accumulators = [empty_accumulator(coltype) for x in range(ncells)]
+    return accumulators
+
+def empty_accumulator(coltype):
+    """
+    Creates the accumulator for no rows, for columns without any cell
+    """
+    if coltype == "categorical":
+        return CategoricalAccumulator(pd.Series(dtype=np.int64), 0)
+    return NumericalAccumulator.from_values(np.array([], dtype=np.float64))
+
+def merge_accumulators(accumulators):
+    """
+    Merges a non empty list of accumulators into one
+    """
+    merged = accumulators[0]
+    for acc in accumulators[1:]:
+        merged = merged.merge(acc)
+    return merged
+
+# formatters calculating the summary functions from accumulators
+
+def categorical_n(acc, rounding):
+    return acc.counts.copy()
+
+def categorical_n_percent(acc, rounding):
+    return sf.format_n_percent(acc.counts, acc.n, rounding)
+
+def categorical_percent(acc, rounding):
+    return sf.format_percent(acc.counts.sort_values(ascending=False, kind='stable'), acc.n, rounding)
+
+def categorical_percent_ci(acc, rounding):
+    return sf.format_percent_ci(acc.counts, acc.n, rounding)
+
+def numerical_mean_ci(acc, rounding):
+    return sf.format_mean_ci(acc.mean(), acc.std(), acc.count, rounding)
+
+def numerical_mean_sd(acc, rounding):
+    return sf.format_mean_sd(acc.mean(), acc.std(), rounding)
+
+def numerical_median_iqr(acc, rounding):
+    return sf.format_median_iqr(acc.median(), acc.quantile(0.25), acc.quantile(0.75), rounding)
+
+def numerical_median_q1q3(acc, rounding):
+    return sf.format_median_q1q3(acc.median(), acc.quantile(0.25), acc.quantile(0.75), rounding)
+
+def numerical_min_max(acc, rounding):
+    return sf.format_min_max(acc.minimum, acc.maximum, rounding)
+
+def numerical_missing(acc, rounding):
+    return sf.format_missing(acc.nmissing, acc.count + acc.nmissing, rounding)
+
+categorical_formatters = {
+        sf.categorical_n: categorical_n,
+        sf.categorical_n_percent: categorical_n_percent,
+        sf.categorical_percent: categorical_percent,
+        sf.categorical_percent_ci: categorical_percent_ci,
+}
+
+numerical_formatters = {
+        sf.numerical_mean_sd: numerical_mean_sd,
+        sf.numerical_mean_ci: numerical_mean_ci,
+        sf.numerical_median_iqr: numerical_median_iqr,
+        sf.numerical_median_q1q3: numerical_median_q1q3,
+        sf.numerical_min_max: numerical_min_max,
+        sf.numerical_missing: numerical_missing,
+}
@@ -0,0 +1,225 @@
+# #############################################################################
+# Copyright 2024 F. Hoffmann-La Roche
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# #############################################################################
+"""
+Table summaries from data already aggregated per stratum, for example the result of
+GROUP BY queries in a database.
+"""
+import numpy as np
+import pandas as pd
+
+from .strata import get_strata_columns, factorize_strata, get_table_columns
+from .accumulators import CategoricalAccumulator, NumericalAccumulator
+from .table_summary import (calculate_stats, get_functions, get_column_functions,
+        summarize_accumulators, SummaryFrameBuilder)
+from . import summary_fun as sf
+
+# columns with quantiles in the numerical aggregates and the quantile they hold
+aggregate_quantiles = {'q1': 0.25, 'median': 0.5, 'q3': 0.75}
+
+# numerical functions that need quantiles
+quantile_functions = {sf.numerical_median_iqr, sf.numerical_median_q1q3}
+
+
+def get_rollup_label(prefix, nlevels, overall_name):
+    """
+    Label of the table column summarizing all strata starting with prefix
+    """
+    if nlevels == 1:
+        return overall_name
+    return tuple(prefix) + ('',)*(nlevels-1-len(prefix)) + (overall_name,)
+
+def split_aggregates(aggregates, strata_names):
+    """
+    Splits aggregated rows in rows for cells (all strata set) and roll-up rows, where the last strata are missing.
+
+    :return: dataframe with the rows for cells and list of tuples of strata prefix and row for the roll-up rows
+    """
+    if not strata_names:
+        return aggregates, list()
+    missing = pd.isna(aggregates[strata_names]).to_numpy()
+    nmissing = missing.sum(axis=1)
+    # missing strata must be the last ones
+    trailing = np.array([row[len(row)-n:].all() for row, n in zip(missing, nmissing)], dtype=bool)
+    if not trailing.all():
+        raise Exception("in roll-up rows of aggregates only the last strata can be missing")
+    rollups = list()
+    for indx in np.flatnonzero(nmissing):
+        row = aggregates.iloc[indx]
+        prefix = tuple(row[strata_names[:len(strata_names)-nmissing[indx]]])
+        rollups.append((prefix, row))
+    return aggregates.iloc[np.flatnonzero(nmissing == 0)], rollups
+
+def numerical_accumulator_from_row(row):
+    """
+    Creates a numerical accumulator from a row of numerical aggregates
+    """
+    count = int(row['count'])
+    nmissing = int(row['nmissing']) if 'nmissing' in row.index else 0
+    if not count:
+        return NumericalAccumulator(0, nmissing, 0.0, 0.0, np.nan, np.nan, None)
+    total = row['sum']
+    m2 = max(row['sum_squares'] - total**2/count, 0.0)
+    quantiles = {q: row[col] for col, q in aggregate_quantiles.items() if col in row.index and not pd.isna(row[col])}
+    return NumericalAccumulator(count, nmissing, total, m2, row['min'], row['max'], None, quantiles=quantiles)
+
+def from_aggregates(categorical=None, numerical=None, strata=None, variable_col='variable', level_col='level', count_col='count',
+        show_overall=True, columns_labels=None, overall_name='Overall', columns_include=None, columns_exclude=None,
+        categorical_functions=None, numerical_functions=None, rounding=1, categorical_missing_level='Missing'):
+    """
+    Calculates a table summary from aggregated data instead of one row per observation, giving the same table summary and
+    number of observations calculate_table_summary would give on the original data.
+
+    Categorical aggregates have one row per stratum, variable and level with the count of observations. Numerical aggregates
+    have one row per stratum and variable with the columns count (non missing observations), nmissing (optional), sum, sum_squares, min, max
+    and optionally q1, median and q3, which are needed for the default numerical functions. Overall columns are calculated merging the strata, except for the quantiles, which cannot be
+    merged: they are taken from roll-up rows where the strata are missing (as given by GROUP BY ROLLUP), the last strata being missing
+    for the overall columns of outer strata.
+
+    The number of observations in each stratum is taken from the first categorical variable, or the count plus nmissing of the
+    first numerical variable if there are no categorical ones, therefore missing values must be included in those.
+
+    :param categorical: categorical aggregates with columns for strata, variable_col, level_col and count_col
+    :type categorical: pandas dataframe, optional
+    :param numerical: numerical aggregates with columns for strata, variable_col, count, sum, sum_squares, min, max and optionally
+        nmissing, q1, median and q3
+    :type numerical: pandas dataframe, optional
+    :param strata: name or list of names of the strata columns in the aggregates
+    :type strata: str or list, optional
+    :param variable_col: name of the column with the variable names, by default 'variable'
+    :type variable_col: str, optional
+    :param level_col: name of the column with the categorical levels, by default 'level'. Missing levels are reported
+        as categorical_missing_level.
+    :type level_col: str, optional
+    :param count_col: name of the column with the categorical counts, by default 'count'
+    :type count_col: str, optional
+    :param show_overall, columns_labels, overall_name, categorical_functions, numerical_functions, rounding, categorical_missing_level:
+        as in calculate_table_summary. Only the functions included in the package can be used for numerical variables.
+    :param columns_include: variables to include in the report, also determines the order of variables in the report
+    :type columns_include: list, optional
+    :param columns_exclude: variables to exclude from the report
+    :type columns_exclude: list, optional
+    :return: the table summary as a pandas dataframe
+    :rtype: pandas dataframe
+    :return: the number of observations for each column in the table summary as a dictionary
+    :rtype: dictionary
+
+    :Example:
+
+    >>> from pysummaries import from_aggregates
+    >>> tone, strat_numbers = from_aggregates(categorical=counts, numerical=moments, strata="arm")
+    """
+    categorical_functions, numerical_functions = get_functions(categorical_functions, numerical_functions)
+    if categorical is None and numerical is None:
+        raise Exception("at least one of categorical or numerical aggregates is needed")
+    if numerical is not None and any([fun in quantile_functions for fun in numerical_functions.values()]):
+        missing_columns = [x for x in aggregate_quantiles if x not in numerical.columns]
+        if missing_columns:
+            raise Exception(f"the numerical functions need quantiles, but the numerical aggregates have no columns "
+                            f"{', '.join(missing_columns)}. Add them or set numerical_functions to functions without quantiles, "
+                            "for example {'Mean (SD)': numerical_mean_sd, 'Min ; Max': numerical_min_max}")
+    strata_names = [x for x, bins in get_strata_columns(strata)]
+    nlevels = len(strata_names)
+
+    tables = dict()
+    rollups = dict()
+    for coltype, aggregates in (("categorical", categorical), ("numerical", numerical)):
+        if aggregates is None:
+            continue
+        for column in strata_names + [variable_col]:
+            if column not in aggregates.columns:
+                raise Exception(f"column {column} not found in {coltype} aggregates")
+        tables[coltype], rollups[coltype] = split_aggregates(aggregates, strata_names)
+
+    # cells in order of appearance, as for the strata of calculate_table_summary
+    cell_frame = pd.concat([x[strata_names] for x in tables.values()], ignore_index=True)
+    cell_codes, cell_labels = factorize_strata(cell_frame, [(x, None) for x in strata_names])
+    if nlevels == 1:
+        cell_labels = [(x,) for x in cell_labels]
+    cell_positions = {label: indx for indx, label in enumerate(cell_labels)}
+    ncells = len(cell_labels)
+    display_labels = [x[0] for x in cell_labels] if nlevels == 1 else cell_labels
+    table_columns = get_table_columns(display_labels, nlevels, show_overall=show_overall, overall_name=overall_name)
+
+    def get_cells(table):
+        if not nlevels:
+            return np.zeros(len(table), dtype=np.int64)
+        return np.array([cell_positions[tuple(x)] for x in table[strata_names].itertuples(index=False)], dtype=np.int64).reshape(-1)
+
+    variables = list()
+    for coltype, table in tables.items():
+        for variable in table[variable_col].unique():
+            variables.append((variable, coltype))
+
+    # number of observations per cell from the first variable
+    first_variable, first_coltype = variables[0]
+    table = tables[first_coltype]
+    table = table[table[variable_col] == first_variable]
+    if first_coltype == "categorical":
+        weights = table[count_col].to_numpy(dtype=np.float64)
+    else:
+        weights = table['count'].to_numpy(dtype=np.float64)
+        if 'nmissing' in table.columns:
+            weights = weights + table['nmissing'].to_numpy(dtype=np.float64)
+    cell_numbers = np.bincount(get_cells(table), weights=weights, minlength=ncells).astype(np.int64)
+    strat_numbers = {column_label: int(cell_numbers[cells].sum()) for column_label, cells in table_columns}
+
+    varnames = [x for x, coltype in variables]
+    if columns_include:
+        variables = [(x, dict(variables)[x]) for x in columns_include if x in varnames]
+    if columns_exclude:
+        variables = [(x, coltype) for x, coltype in variables if x not in columns_exclude]
+    if not variables:
+        raise Exception("No variables left after filtering for columns_include and columns_exclude")
+
+    builder = SummaryFrameBuilder([column_label for column_label, cells in table_columns])
+    for variable, coltype in variables:
+        curfuns, catna = get_column_functions(coltype, categorical_functions, numerical_functions)
+        col_label = None
+        if columns_labels:
+            col_label = columns_labels.get(variable)
+        table = tables[coltype]
+        table = table[table[variable_col] == variable]
+        var_cells = get_cells(table)
+        var_dict = dict()
+        if coltype == "categorical":
+            levels = table[level_col]
+            if categorical_missing_level:
+                levels = levels.astype(object).fillna(categorical_missing_level)
+            counts = pd.Series(table[count_col].to_numpy(), index=pd.Index(levels.to_numpy(), dtype=object))
+            accumulators = list()
+            for cellindx in range(ncells):
+                cell_counts = counts[var_cells == cellindx]
+                cell_counts = cell_counts[cell_counts.index.notna()].groupby(level=0, sort=False).sum()
+                cell_counts = cell_counts.sort_values(ascending=False, kind='stable')
+                accumulators.append(CategoricalAccumulator(cell_counts, int(cell_numbers[cellindx])))
+        else:
+            accumulators = [NumericalAccumulator(0, 0, 0.0, 0.0, np.nan, np.nan, None) for x in range(ncells)]
+            for cellindx, (rowindx, row) in zip(var_cells, table.iterrows()):
+                accumulators[cellindx] = numerical_accumulator_from_row(row)
+            # quantiles of overall columns come from the roll-up rows
+            for prefix, row in rollups.get(coltype, list()):
+                if row[variable_col] == variable:
+                    var_dict[get_rollup_label(prefix, nlevels, overall_name)] = calculate_stats(numerical_accumulator_from_row(row),
+                            variable, curfuns, coltype, rounding=rounding, var_label=col_label)
+        for cellindx in range(ncells if nlevels else 0):
+            var_dict[display_labels[cellindx]] = calculate_stats(accumulators[cellindx], variable, curfuns, coltype,
+                    rounding=rounding, var_label=col_label)
+        var_dict = {k: v for k, v in var_dict.items() if k in strat_numbers}
+        builder.add_variable(summarize_accumulators(var_dict, accumulators, table_columns, variable, curfuns, coltype,
+                var_label=col_label, rounding=rounding), catna=catna)
+
+    tonedf = builder.build()
+    return tonedf, strat_numbers
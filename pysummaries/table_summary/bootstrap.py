@@ -0,0 +1,161 @@
+# #############################################################################
+# Copyright 2024 F. Hoffmann-La Roche
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# #############################################################################
+"""
+Percentile bootstrap confidence intervals calculated from the accumulators of the table columns.
+
+Resamples are drawn as positions of the observations and counted into a matrix of weights, so all the
+resamples of a batch are one matrix and the statistics of the batch are calculated with matrix operations.
+Every table column and batch has its own random generator spawned from one seed, so the intervals do not
+depend on the number of threads.
+"""
+import numpy as np
+import pandas as pd
+
+from .accumulators import merge_accumulators, empty_accumulator
+from . import summary_fun as sf
+
+# maximum number of weights (resamples x observations) in one batch
+batch_weights = 10**7
+
+# categorical functions showing a percentage without an interval, the ones the interval of the percentage is added to
+percentage_functions = {sf.categorical_n_percent, sf.categorical_percent}
+
+
+def format_interval(lower, upper, rounding):
+    """
+    Formats "[lower ; upper]"
+    """
+    if rounding is not None:
+        lower = round(lower, rounding)
+        upper = round(upper, rounding)
+    return "[" + str(lower) + " ; " + str(upper) + "]"
+
+def submit(executor, fun, *args):
+    """
+    Runs fun with args in the executor, or right away if executor is None.
+
+    :return: function without arguments returning the result of fun
+    """
+    if executor is None:
+        result = fun(*args)
+        return lambda: result
+    return executor.submit(fun, *args).result
+
+def bootstrap_proportions(counts, n, n_bootstrap, rng):
+    """
+    Bootstraps the percentages of the levels of a categorical variable. Resampling n observations with replacement
+    gives multinomial counts, so the resampled counts are drawn directly.
+
+    :param counts: numpy array with the counts of the levels
+    :param n: number of observations, including those not counted in any level
+    :return: numpy arrays with the lower and upper limits of the 95% intervals of the percentages of the levels
+    """
+    if not n:
+        return np.full(len(counts), np.nan), np.full(len(counts), np.nan)
+    probabilities = np.append(counts, n - counts.sum()) / n
+    resampled = rng.multinomial(n, probabilities, size=n_bootstrap)[:, :len(counts)] * (100 / n)
+    lower, upper = np.percentile(resampled, [2.5, 97.5], axis=0)
+    return lower, upper
+
+def bootstrap_batch(values, size, rng):
+    """
+    Means and medians of size resamples of the sorted values, as a matrix of weights counting the
+    positions drawn for each resample
+    """
+    count = len(values)
+    positions = rng.integers(count, size=(size, count))
+    positions += np.arange(size)[:, None] * count
+    weights = np.bincount(positions.ravel(), minlength=size * count).reshape(size, count)
+    means = weights @ values / count
+    # the k-th observation of a resample is the first value where the cumulative weight goes over k
+    cumulative = np.cumsum(weights, axis=1)
+    middle = count // 2
+    upper = values[(cumulative <= middle).sum(axis=1)]
+    if count % 2:
+        return means, upper
+    lower = values[(cumulative <= middle - 1).sum(axis=1)]
+    return means, (lower + upper) / 2
+
+def bootstrap_mean_median(values, n_bootstrap, seed, executor=None):
+    """
+    Bootstraps the mean and the median of numerical values, in batches of resamples submitted to executor if set.
+
+    :param values: sorted numpy array with the non missing observations
+    :param seed: numpy SeedSequence, one generator is spawned from it for each batch
+    :return: function returning the lower and upper limits of the 95% intervals of the mean and lower and upper 
+        limits for the median
+    """
+    if not len(values):
+        return lambda: ((np.nan, np.nan), (np.nan, np.nan))
+    values = values.astype(np.float64)
+    batch_size = max(1, min(n_bootstrap, batch_weights // len(values)))
+    sizes = [min(batch_size, n_bootstrap - start) for start in range(0, n_bootstrap, batch_size)]
+    generators = [np.random.default_rng(x) for x in seed.spawn(len(sizes))]
+    batches = [submit(executor, bootstrap_batch, values, size, rng) for size, rng in zip(sizes, generators)]
+    def get_intervals():
+        results = [x() for x in batches]
+        means = np.concatenate([x[0] for x in results])
+        medians = np.concatenate([x[1] for x in results])
+        return tuple(np.percentile(means, [2.5, 97.5])), tuple(np.percentile(medians, [2.5, 97.5]))
+    return get_intervals
+
+def add_bootstrap_ci(var_dict, accumulators, table_columns, var, coltype, var_label=None, rounding=1, n_bootstrap=1000,
+        seed=None, executor=None):
+    """
+    Adds 95% percentile bootstrap confidence intervals to the summaries of the variable var. Categorical levels get the
+    interval of their percentage after their value, numerical variables get the rows "Mean [95% CI]" and "Median [95% CI]".
+    The resamples of all the table columns are submitted to executor if set, and the intervals formatted once they are done.
+
+    :param var_dict: dictionary with the summary series for each table column
+    :param accumulators: list with the accumulator of each cell
+    :param seed: numpy SeedSequence, one generator is spawned from it for each table column
+    :param executor: concurrent.futures executor shared by all the columns of the table summary
+    :return: dictionary with the summary series for each table column, with the intervals
+    """
+    label = str(var_label) if var_label else str(var)
+    seeds = seed.spawn(len(table_columns))
+    pending = list()
+    for (column_label, cells), column_seed in zip(table_columns, seeds):
+        acc = merge_accumulators([accumulators[x] for x in cells]) if cells else empty_accumulator(coltype)
+        if coltype == "categorical":
+            intervals = submit(executor, bootstrap_proportions, acc.counts.to_numpy(), acc.n, n_bootstrap,
+                               np.random.default_rng(column_seed))
+        else:
+            if acc.values is None:
+                raise Exception("bootstrap confidence intervals need the values of numerical columns, they are not available "
+                                "for aggregated data")
+            intervals = bootstrap_mean_median(acc.dense_values(), n_bootstrap, column_seed, executor=executor)
+        pending.append((column_label, acc, intervals))
+
+    results = dict()
+    for column_label, acc, get_intervals in pending:
+        curstat = var_dict[column_label]
+        if coltype == "categorical":
+            lower, upper = get_intervals()
+            intervals = pd.Series([format_interval(a, b, rounding) for a, b in zip(lower, upper)],
+                                  index=pd.MultiIndex.from_arrays([[label]*len(acc.counts), [str(x) for x in acc.counts.index]]))
+            intervals = intervals.reindex(curstat.index)
+            results[column_label] = curstat.where(intervals.isna(), curstat.astype(str) + " " + intervals)
+        else:
+            mean_ci, median_ci = get_intervals()
+            estimates = [acc.mean(), acc.median()]
+            if rounding is not None:
+                estimates = [round(x, rounding) for x in estimates]
+            intervals = pd.Series([str(estimates[0]) + " " + format_interval(*mean_ci, rounding),
+                                   str(estimates[1]) + " " + format_interval(*median_ci, rounding)],
+                                  index=pd.MultiIndex.from_arrays([[label]*2, ["Mean [95% CI]", "Median [95% CI]"]]))
+            results[column_label] = pd.concat([curstat, intervals])
+    return results
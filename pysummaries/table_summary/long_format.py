@@ -0,0 +1,143 @@
+# #############################################################################
+# Copyright 2024 F. Hoffmann-La Roche
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# #############################################################################
+"""
+Table summaries for data in long format, with one row per subject, variable and value.
+"""
+import numpy as np
+import pandas as pd
+
+from .utils import detect_df_col_types, count_distinct
+from .strata import get_strata_columns, get_selected_rows, factorize_strata, get_table_columns, add_pooled_columns
+from .accumulators import accumulate, categorical_accumulators
+from .table_summary import (get_series, calculate_stats, get_functions, get_column_functions,
+        summarize_accumulators, SummaryFrameBuilder)
+
+
+def summarize_long(df, variable_col, value_col, strata=None, id_column=None, show_overall=True, columns_labels=None, overall_name='Overall',
+        columns_include=None, columns_exclude=None, categorical_functions=None, numerical_functions=None, rounding=1,
+        categorical_missing_level='Missing', pooled_columns=None, where=None):
+    """
+    Calculates a table summary from a pandas dataframe in long format, where each row has the name of a variable in variable_col
+    and its value in value_col, without pivoting it to wide format. The rows are sorted once by variable and stratum and every variable is
+    summarized from its own slice, as numerical or categorical depending on its values. The result has the same layout
+    as the one from calculate_table_summary.
+
+    :param df: pandas dataframe in long format
+    :type df: pandas dataframe, mandatory
+    :param variable_col: name of the column with the variable names
+    :type variable_col: str, mandatory
+    :param value_col: name of the column with the values
+    :type value_col: str, mandatory
+    :param strata: strata as in calculate_table_summary. Strata columns must be columns of the long dataframe.
+    :type strata: str, list or dict, optional
+    :param id_column: name of the column identifying subjects. The number of observations for each column of the table is the number
+        of distinct subjects, as the number of rows would count every subject once per variable.
+    :type id_column: str, mandatory
+    :param columns_labels: A dictionary defining labels for the variables. Keys should be the variable names and values a string with the label.
+    :type columns_labels: dict, optional
+    :param columns_include: variables to include in the report, also determines the order of variables in the report. By default
+        variables are reported in order of appearance.
+    :type columns_include: list, optional
+    :param columns_exclude: variables to exclude from the report
+    :type columns_exclude: list, optional
+    :param show_overall, overall_name, categorical_functions, numerical_functions, rounding, categorical_missing_level, pooled_columns, where:
+        as in calculate_table_summary. Percentages for categorical variables use the number of rows of the variable as denominator.
+    :return: the table summary as a pandas dataframe
+    :rtype: pandas dataframe
+    :return: the number of observations for each column in the table summary as a dictionary
+    :rtype: dictionary
+
+    :Example:
+
+    >>> from pysummaries import summarize_long
+    >>> tone, strat_numbers = summarize_long(labs, variable_col="parameter", value_col="value", strata="arm", id_column="subject")
+    """
+    categorical_functions, numerical_functions = get_functions(categorical_functions, numerical_functions)
+    for column in (variable_col, value_col):
+        if column not in df.columns:
+            raise Exception(f"column {column} not found in dataframe")
+
+    if id_column is None:
+        raise Exception("summarize_long needs id_column to count the subjects, the rows of long data are one per subject and variable")
+    if id_column not in df.columns:
+        raise Exception(f"id_column {id_column} not found in dataframe")
+
+    strata_columns = get_strata_columns(strata)
+    selected_rows = get_selected_rows(df, where)
+    cell_codes, cell_labels = factorize_strata(df, strata_columns, rows=selected_rows)
+    ncells = len(cell_labels)
+    table_columns = get_table_columns(cell_labels, len(strata_columns), show_overall=show_overall, overall_name=overall_name)
+    if pooled_columns:
+        table_columns = add_pooled_columns(table_columns, cell_labels, pooled_columns, len(strata_columns), show_overall=show_overall)
+
+    id_codes, _ = pd.factorize(df[id_column])
+    if np.any(id_codes[cell_codes >= 0] < 0):
+        raise Exception("id_column may not contain missing values")
+    cell_numbers = count_distinct(cell_codes, id_codes, ncells)
+    strat_numbers = dict()
+    for column_label, cells in table_columns:
+        if len(cells) == 1:
+            strat_numbers[column_label] = int(cell_numbers[cells].sum())
+        else:
+            column_rows = np.flatnonzero(np.isin(cell_codes, cells))
+            strat_numbers[column_label] = len(np.unique(id_codes[column_rows]))
+
+    # one sort by variable and cell, then every variable and cell is a contiguous slice
+    var_codes, variables = pd.factorize(df[variable_col])
+    rows = np.flatnonzero((cell_codes >= 0) & (var_codes >= 0))
+    rows = rows[np.lexsort((cell_codes[rows], var_codes[rows]))]
+    var_bounds = np.searchsorted(var_codes[rows], np.arange(len(variables) + 1))
+
+    varnames = list(variables)
+    if columns_include:
+        varnames = [v for v in columns_include if v in varnames]
+    if columns_exclude:
+        varnames = [v for v in varnames if v not in columns_exclude]
+    if not varnames:
+        raise Exception("No variables left after filtering for columns_include and columns_exclude")
+
+    builder = SummaryFrameBuilder([column_label for column_label, cells in table_columns])
+    for varname in varnames:
+        varindx = variables.get_loc(varname)
+        var_rows = rows[var_bounds[varindx]:var_bounds[varindx+1]]
+        values = df[value_col].iloc[var_rows]
+        coltype = detect_df_col_types(pd.DataFrame({varname: values}))[varname]
+        curfuns, catna = get_column_functions(coltype, categorical_functions, numerical_functions)
+        if coltype == "numerical" and values.dtype == object:
+            values = pd.to_numeric(values)
+        var_df = pd.DataFrame({value_col: values.reset_index(drop=True)})
+        cell_bounds = np.searchsorted(cell_codes[var_rows], np.arange(ncells + 1))
+        col_label = None
+        if columns_labels:
+            col_label = columns_labels.get(varname)
+        var_dict = dict()
+        accumulators = list()
+        if coltype == "categorical":
+            accumulators = categorical_accumulators(var_df[value_col], cell_codes[var_rows], ncells,
+                    categorical_missing_level=categorical_missing_level)
+        for cellindx in range(ncells):
+            if coltype == "categorical":
+                curseries = accumulators[cellindx]
+            else:
+                curseries = get_series(var_df, value_col, coltype, rows=np.arange(cell_bounds[cellindx], cell_bounds[cellindx+1]))
+                accumulators.append(accumulate(curseries, coltype))
+            if len(strata_columns):
+                var_dict[cell_labels[cellindx]] = calculate_stats(curseries, varname, curfuns, coltype, rounding=rounding, var_label=col_label)
+        builder.add_variable(summarize_accumulators(var_dict, accumulators, table_columns, varname, curfuns, coltype,
+                var_label=col_label, rounding=rounding), catna=catna)
+
+    tonedf = builder.build()
+    return tonedf, strat_numbers
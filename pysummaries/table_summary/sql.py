@@ -0,0 +1,304 @@
+# #############################################################################
+# Copyright 2024 F. Hoffmann-La Roche
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# #############################################################################
+"""
+Table summaries calculated inside a database through a DB-API connection. Only
+aggregates are sent back and assembled with from_aggregates.
+"""
+import numpy as np
+import pandas as pd
+
+from .utils import detect_df_col_types
+from .strata import get_strata_columns
+from .aggregates import from_aggregates, quantile_functions
+from .table_summary import get_functions
+
+# quantiles needed by the package functions and the names from_aggregates expects
+sql_quantiles = {'q1': 0.25, 'median': 0.5, 'q3': 0.75}
+
+
+def quote_identifier(name):
+    """
+    Quotes a column or table name for SQL
+    """
+    return '"' + str(name).replace('"', '""') + '"'
+
+def get_sql_source(table_or_query):
+    """
+    Gets the FROM clause for a table name or a SELECT query
+    """
+    if table_or_query.strip().lower().startswith(("select", "with")):
+        return f"({table_or_query}) AS pysummaries_source"
+    return quote_identifier(table_or_query)
+
+def get_quantile_method(connection):
+    """
+    Guesses how quantiles can be calculated from the module of the connection: with quantile_cont for DuckDB,
+    with window functions for SQLite, which has no percentile functions, and with percentile_cont otherwise.
+    """
+    module = type(connection).__module__.split('.')[0]
+    if module == 'duckdb':
+        return 'quantile_cont'
+    if module in ('sqlite3', '_sqlite3'):
+        return 'window'
+    return 'percentile_cont'
+
+def run_query(connection, query, object_columns=None):
+    """
+    Runs the query and returns the result as a pandas dataframe. Columns in object_columns keep the python objects
+    returned by the database, so that for example integers with missing values are not converted to floats.
+    """
+    cursor = connection.cursor()
+    try:
+        cursor.execute(query)
+        rows = cursor.fetchall()
+        columns = [x[0] for x in cursor.description]
+    finally:
+        cursor.close()
+    result = pd.DataFrame.from_records(rows, columns=columns)
+    for column in (object_columns or list()):
+        position = columns.index(column)
+        result[column] = pd.Series([x[position] for x in rows], index=result.index, dtype=object)
+    return result
+
+def categorical_counts(connection, source, condition, strata_names, columns, grouping_sets):
+    """
+    Counts the rows of every level of every categorical column in columns for each stratum in one query, with GROUPING SETS
+    if grouping_sets is True, otherwise with UNION ALL of one grouped query per column (levels of different columns may then
+    have different types, as in SQLite).
+
+    :return: dataframe with the strata columns and the columns level, count and variable, ordered by column, strata and level
+    """
+    stratacols = ''.join([f"{quote_identifier(x)}, " for x in strata_names])
+    cols = [quote_identifier(x) for x in columns]
+    levels = [f"l{indx}" for indx in range(len(columns))]
+    if grouping_sets:
+        # every row has the level of one column, the one not grouped out
+        selects = [f"{col} AS {level}, GROUPING({col}) AS g{indx}" for indx, (col, level) in enumerate(zip(cols, levels))]
+        sets = ', '.join([f"({stratacols}{col})" for col in cols])
+        query = (f"SELECT {stratacols}{', '.join(selects)}, COUNT(*) AS count FROM {source}{condition} "
+            f"GROUP BY GROUPING SETS ({sets}) ORDER BY {stratacols}{', '.join(levels)}")
+        result = run_query(connection, query, object_columns=levels)
+        parts = [result.loc[result[f"g{indx}"] == 0, strata_names + [level, 'count']].rename(columns={level: 'level'})
+                 for indx, level in enumerate(levels)]
+    else:
+        query = ' UNION ALL '.join([f"SELECT {indx} AS variable_index, {stratacols}{col} AS level, COUNT(*) AS count "
+            f"FROM {source}{condition} GROUP BY {stratacols}{col}" for indx, col in enumerate(cols)])
+        query += f" ORDER BY variable_index, {stratacols}level"
+        result = run_query(connection, query, object_columns=['level'])
+        parts = [result.loc[result['variable_index'] == indx, strata_names + ['level', 'count']] for indx in range(len(columns))]
+    return pd.concat([part.assign(variable=column) for part, column in zip(parts, columns)], ignore_index=True)
+
+def numerical_query(source, condition, group, columns, quantile_method, rollup=False):
+    """
+    Query with count, missing, sum, sum of squares, minimum, maximum (and, if quantile_method is percentile_cont or
+    quantile_cont, quantiles) of every numerical column in columns, grouped by the columns in group. With rollup, 
+    the rows for every prefix of group, with the rest of group columns missing, are added with GROUP BY ROLLUP.
+    """
+    selects = [quote_identifier(x) for x in group]
+    for indx, column in enumerate(columns):
+        col = quote_identifier(column)
+        selects.extend([f"COUNT({col}) AS c{indx}_count", f"COUNT(*) - COUNT({col}) AS c{indx}_nmissing",
+            f"SUM({col}) AS c{indx}_sum", f"SUM(CAST({col} AS DOUBLE) * {col}) AS c{indx}_sum_squares",
+            f"MIN({col}) AS c{indx}_min", f"MAX({col}) AS c{indx}_max"])
+        for name, q in sql_quantiles.items():
+            if quantile_method == 'percentile_cont':
+                selects.append(f"PERCENTILE_CONT({q}) WITHIN GROUP (ORDER BY {col}) AS c{indx}_{name}")
+            elif quantile_method == 'quantile_cont':
+                selects.append(f"QUANTILE_CONT({col}, {q}) AS c{indx}_{name}")
+    query = f"SELECT {', '.join(selects)} FROM {source}{condition}"
+    if group:
+        groupcols = ', '.join(selects[:len(group)])
+        query += f" GROUP BY ROLLUP ({groupcols})" if rollup else f" GROUP BY {groupcols}"
+        query += f" ORDER BY {groupcols}"
+    return query
+
+def window_quantiles(connection, source, condition, group, column):
+    """
+    Calculates the quantiles of column for each group with window functions, for databases without percentile functions.
+    Only the (up to) two values around each quantile are fetched and interpolated linearly as numpy does.
+    """
+    col = quote_identifier(column)
+    partition = f"PARTITION BY {', '.join([quote_identifier(x) for x in group])} " if group else ""
+    notnull = f"{col} IS NOT NULL"
+    condition = f"{condition} AND {notnull}" if condition else f" WHERE {notnull}"
+    groupcols = ''.join([f"{quote_identifier(x)}, " for x in group])
+    positions = ' OR '.join([f"(rn >= CAST((cnt - 1) * {q} AS INTEGER) + 1 AND rn <= CAST((cnt - 1) * {q} AS INTEGER) + 2)"
+        for q in sql_quantiles.values()])
+    query = (f"SELECT * FROM (SELECT {groupcols}{col} AS value, "
+        f"ROW_NUMBER() OVER ({partition}ORDER BY {col}) AS rn, COUNT(*) OVER ({partition.strip()}) AS cnt "
+        f"FROM {source}{condition}) AS ranked WHERE {positions}")
+    values = run_query(connection, query)
+    results = list()
+    if not len(values):
+        return pd.DataFrame(columns=group + list(sql_quantiles.keys()))
+    for key, rows in values.groupby(group if group else np.zeros(len(values)), sort=False):
+        rows = rows.sort_values('rn')
+        sorted_values = rows['value'].to_numpy(dtype=np.float64)
+        ranks = rows['rn'].to_numpy()
+        count = rows['cnt'].iloc[0]
+        result = dict(zip(group, key if type(key) == tuple else (key,))) if group else dict()
+        for name, q in sql_quantiles.items():
+            h = (count - 1) * q
+            lower = sorted_values[ranks == int(h) + 1][0]
+            upper = sorted_values[ranks == min(int(h) + 2, count)][0]
+            result[name] = lower + (h - int(h)) * (upper - lower)
+        results.append(result)
+    return pd.DataFrame(results)
+
+def summarize_sql(connection, table_or_query, strata=None, columns=None, where=None, column_types=None, quantile_method=None,
+        show_overall=True, columns_labels=None, overall_name='Overall', categorical_functions=None, numerical_functions=None,
+        rounding=1, categorical_missing_level='Missing'):
+    """
+    Calculates a table summary inside a database. Aggregate queries (COUNT, SUM, MIN, MAX with GROUP BY, and percentile or
+    window functions for quantiles) are run through the DB-API connection and only the aggregates are fetched and assembled
+    into the same table summary calculate_table_summary gives. Strata are in sorted order. The counts of all categorical columns 
+    are calculated in one query, and with percentile functions the moments and quantiles of all numerical columns for the strata 
+    and the overall columns in one GROUP BY ROLLUP query.
+
+    :param connection: DB-API connection, for example from sqlite3
+    :param table_or_query: name of a table or a SELECT query
+    :type table_or_query: str, mandatory
+    :param strata: name or list of names of the columns to stratify the table
+    :type strata: str or list, optional
+    :param columns: columns to summarize, by default all except the strata, in this order
+    :type columns: list, optional
+    :param where: SQL condition to select the rows to summarize, for example "age > 18"
+    :type where: str, optional
+    :param column_types: a dictionary with column names as keys and 'categorical' or 'numerical' as values. Types not set
+        here are detected on the first 1000 rows.
+    :type column_types: dict, optional
+    :param quantile_method: how to calculate quantiles: 'percentile_cont' (PERCENTILE_CONT ... WITHIN GROUP as in PostgreSQL or Oracle),
+        'quantile_cont' (DuckDB) or 'window' (ROW_NUMBER window functions, for SQLite and other databases without percentile functions).
+        By default it is guessed from the connection.
+    :type quantile_method: str, optional
+    :param show_overall, columns_labels, overall_name, categorical_functions, numerical_functions, rounding, categorical_missing_level:
+        as in calculate_table_summary. Only the functions included in the package can be used for numerical variables.
+    :return: the table summary as a pandas dataframe
+    :rtype: pandas dataframe
+    :return: the number of observations for each column in the table summary as a dictionary
+    :rtype: dictionary
+
+    :Example:
+
+    >>> import sqlite3
+    >>> from pysummaries import summarize_sql
+    >>> connection = sqlite3.connect("study.db")
+    >>> tone, strat_numbers = summarize_sql(connection, "patients", strata="arm")
+    """
+    categorical_functions, numerical_functions = get_functions(categorical_functions, numerical_functions)
+    if quantile_method is None:
+        quantile_method = get_quantile_method(connection)
+    if quantile_method not in ('percentile_cont', 'quantile_cont', 'window'):
+        raise Exception(f"Available quantile methods are 'percentile_cont', 'quantile_cont' or 'window', got {quantile_method}")
+    strata_names = [x for x, bins in get_strata_columns(strata)]
+    source = get_sql_source(table_or_query)
+    condition = f" WHERE {where}" if where else ""
+
+    sample = run_query(connection, f"SELECT * FROM {source}{condition} LIMIT 1000")
+    for column in strata_names:
+        if column not in sample.columns:
+            raise Exception(f"strata column {column} not found in {table_or_query}")
+    if columns is None:
+        columns = [c for c in sample.columns if c not in strata_names]
+    coltypes = dict(column_types) if column_types else dict()
+    undetected = [c for c in columns if c not in coltypes]
+    if undetected:
+        coltypes.update(detect_df_col_types(sample, columns=undetected))
+    categorical_columns = [c for c in columns if coltypes[c] == "categorical"]
+    numerical_columns = [c for c in columns if coltypes[c] == "numerical"]
+    if not categorical_columns and not numerical_columns:
+        raise Exception("No categorical or numerical columns to summarize")
+
+    if strata_names:
+        nullstrata = ' OR '.join([f"{quote_identifier(x)} IS NULL" for x in strata_names])
+        nullcondition = f"{condition} AND ({nullstrata})" if condition else f" WHERE {nullstrata}"
+        if run_query(connection, f"SELECT COUNT(*) AS n FROM {source}{nullcondition}")['n'].iloc[0]:
+            raise Exception("strata may not contain missing values")
+    # databases with percentile functions (PostgreSQL, Oracle, DuckDB) also have GROUPING SETS and ROLLUP, 
+    # so that every table is calculated in one scan
+    grouping_sets = quantile_method != 'window'
+    categorical = None
+    if categorical_columns:
+        categorical = categorical_counts(connection, source, condition, strata_names, categorical_columns, grouping_sets)
+
+    numerical = None
+    if numerical_columns:
+        with_quantiles = any([fun in quantile_functions for fun in numerical_functions.values()])
+        method = quantile_method if with_quantiles else None
+        # groupings for the strata and, for the overall columns, for every prefix of the strata, all in one 
+        # GROUP BY ROLLUP if the database has it, otherwise one query per grouping, as the quantiles from window 
+        # functions are calculated for each grouping anyway
+        rollup = show_overall and grouping_sets
+        groupings = [strata_names]
+        if show_overall and strata_names and not rollup:
+            groupings.extend([strata_names[:k] for k in reversed(range(len(strata_names)))])
+        numerical = list()
+        # minimum and maximum keep the type of the column, integers are shown without decimals as in calculate_table_summary
+        extremes = [f"c{indx}_{x}" for indx in range(len(numerical_columns)) for x in ('min', 'max')]
+        for group in groupings:
+            aggregates = run_query(connection, numerical_query(source, condition, group, numerical_columns, method, rollup=rollup),
+                    object_columns=extremes)
+            for indx, column in enumerate(numerical_columns):
+                stats = aggregates[group + [x for x in aggregates.columns if x.startswith(f"c{indx}_")]]
+                stats = stats.rename(columns={x: x[len(f"c{indx}_"):] for x in stats.columns if x.startswith(f"c{indx}_")})
+                if method == 'window':
+                    quantiles = window_quantiles(connection, source, condition, group, column)
+                    if group:
+                        stats = stats.merge(quantiles, on=group, how='left')
+                    else:
+                        stats = pd.concat([stats, quantiles], axis=1)
+                for missing_stratum in strata_names[len(group):]:
+                    stats[missing_stratum] = None
+                stats['variable'] = column
+                numerical.append(stats)
+        numerical = pd.concat(numerical, ignore_index=True)
+
+    return from_aggregates(categorical, numerical, strata=strata_names or None, show_overall=show_overall, columns_labels=columns_labels,
+            overall_name=overall_name, columns_include=columns, categorical_functions=categorical_functions,
+            numerical_functions=numerical_functions, rounding=rounding, categorical_missing_level=categorical_missing_level)
+
+def summarize_duckdb(path, strata=None, columns=None, where=None, column_types=None, connection=None,
+        show_overall=True, columns_labels=None, overall_name='Overall', categorical_functions=None, numerical_functions=None,
+        rounding=1, categorical_missing_level='Missing'):
+    """
+    Calculates a table summary of Parquet or CSV files with DuckDB, which needs to be installed. The files are read by DuckDB
+    in parallel (reading only the needed columns of Parquet files) and only the aggregates are fetched, as in summarize_sql.
+
+    :param path: path or glob of Parquet files, for example 'data/*.parquet', or of CSV files if it ends with .csv or .csv.gz
+    :type path: str, mandatory
+    :param connection: DuckDB connection, by default a new in-memory one
+    :param strata, columns, where, column_types, show_overall, columns_labels, overall_name, categorical_functions, numerical_functions,
+        rounding, categorical_missing_level: as in summarize_sql
+    :return: the table summary as a pandas dataframe and the number of observations for each column in the table summary
+    :rtype: tuple of pandas dataframe and dictionary
+
+    :Example:
+
+    >>> from pysummaries import summarize_duckdb
+    >>> tone, strat_numbers = summarize_duckdb("data/*.parquet", strata="arm")
+    """
+    try:
+        import duckdb
+    except ImportError:
+        raise Exception("summarize_duckdb needs the duckdb package, install it with pip install duckdb")
+    if connection is None:
+        connection = duckdb.connect()
+    reader = "read_csv_auto" if path.lower().endswith(('.csv', '.csv.gz')) else "read_parquet"
+    path = path.replace("'", "''")
+    return summarize_sql(connection, f"SELECT * FROM {reader}('{path}')", strata=strata, columns=columns, where=where,
+            column_types=column_types, quantile_method='quantile_cont', show_overall=show_overall, columns_labels=columns_labels,
+            overall_name=overall_name, categorical_functions=categorical_functions, numerical_functions=numerical_functions,
+            rounding=rounding, categorical_missing_level=categorical_missing_level)
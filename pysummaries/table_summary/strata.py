@@ -0,0 +1,262 @@
+# #############################################################################
+# Copyright 2024 F. Hoffmann-La Roche
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# #############################################################################
+"""
+Functions to split a dataframe into strata (cells) and to define the columns
+of the table summary in terms of those cells.
+"""
+import numpy as np
+import pandas as pd
+
+
+def get_strata_columns(strata):
+    """
+    Returns the list of strata as tuples of column name and bins. bins is None if the column
+    is used as it is, or a list of bin edges if the numerical column has to be binned.
+    """
+    if strata is None:
+        return list()
+    if type(strata) == dict:
+        return list(strata.items())
+    if type(strata) != list and type(strata) != tuple:
+        strata = [strata]
+    strata_columns = list()
+    for curstrata in strata:
+        if type(curstrata) == dict:
+            strata_columns.extend(curstrata.items())
+        else:
+            strata_columns.append((curstrata, None))
+    return strata_columns
+
+def get_bin_labels(bins):
+    """
+    Labels for the bins defined by the edges in bins. Bins are closed on the left, and
+    the last one also on the right.
+    """
+    labels = [f"[{left}, {right})" for left, right in zip(bins[:-1], bins[1:])]
+    labels[-1] = labels[-1][:-1] + "]"
+    return labels
+
+def bin_column(series, bins):
+    """
+    Assigns the values of a numerical series to the bins defined by the edges in bins, 
+    without creating a new column.
+
+    :param series: pandas numerical series
+    :param bins: list of increasing bin edges
+    :return: integer numpy array with the bin number for each value
+    """
+    bins = np.asarray(bins)
+    if len(bins) < 2 or np.any(np.diff(bins) <= 0):
+        raise Exception(f"bins for strata column {series.name} must be a list of at least two increasing values")
+    values = series.to_numpy(dtype=np.float64, na_value=np.nan)
+    if np.any((values < bins[0]) | (values > bins[-1])):
+        raise Exception(f"strata column {series.name} has values outside of the bins {bins[0]} - {bins[-1]}")
+    codes = np.searchsorted(bins, values, side='right') - 1
+    codes[values == bins[-1]] = len(bins) - 2
+    return codes
+
+def get_selected_rows(df, where):
+    """
+    Gets the positions of the rows selected by where.
+
+    :param df: pandas dataframe
+    :param where: None to select all rows, a boolean mask with the same length as the dataframe, a string with a 
+        boolean expression evaluated with pandas.DataFrame.eval, a dictionary with column names as keys and a value or 
+        list of values to keep as values, or an array of integer row positions.
+    :return: None if all rows are selected, otherwise a numpy array with the positions of the selected rows
+    """
+    if where is None:
+        return None
+    if type(where) == dict:
+        mask = np.ones(len(df), dtype=bool)
+        for column, values in where.items():
+            if column not in df.columns:
+                raise Exception(f"column {column} in where not found in dataframe")
+            if type(values) != list and type(values) != tuple:
+                values = [values]
+            mask &= df[column].isin(values).to_numpy()
+        where = mask
+    elif type(where) == str:
+        where = df.eval(where)
+    where = np.asarray(where)
+    if where.dtype == bool:
+        if len(where) != len(df):
+            raise Exception("where as a boolean mask must have the same length as the dataframe")
+        return np.flatnonzero(where)
+    if np.issubdtype(where.dtype, np.integer):
+        if len(where) and (where.min() < 0 or where.max() >= len(df)):
+            raise Exception("where as row positions must be between 0 and the number of rows of the dataframe")
+        return where
+    raise Exception("where must be a boolean mask, a string with a boolean expression, a dictionary or an array of row positions")
+
+def sample_rows(df, where, size, random_state=None):
+    """
+    Draws a simple random sample, without replacement, of at most size rows among the rows selected by where.
+    Only row positions are drawn, the dataframe is not read.
+
+    :param random_state: seed or numpy random Generator
+    :return: numpy array with the positions of the sampled rows in increasing order and the number of selected rows
+    """
+    rows = get_selected_rows(df, where)
+    nrows = len(df) if rows is None else len(rows)
+    rng = np.random.default_rng(random_state)
+    sample = np.sort(rng.choice(nrows, size=min(size, nrows), replace=False))
+    if rows is not None:
+        sample = np.sort(rows[sample])
+    return sample, nrows
+
+def factorize_strata_column(df, column, bins=None, rows=None):
+    """
+    Factorizes one strata column, using only the rows at the positions in rows if not None.
+
+    :return: integer numpy array with the code for each (selected) row and a list of labels. If bins is None, labels are the
+        values of the column in order of appearance, otherwise labels for the non empty bins in order
+    """
+    if column not in df.columns:
+        raise Exception(f"strata column {column} not found in dataframe")
+    series = df[column]
+    if rows is not None:
+        series = series.iloc[rows]
+    if any(pd.isna(series)):
+        raise Exception("strata may not contain missing values")
+    if bins is None:
+        codes, uniques = pd.factorize(series)
+        return codes, list(uniques)
+    codes, bin_codes = pd.factorize(bin_column(series, bins), sort=True)
+    bin_labels = get_bin_labels(list(bins))
+    return codes, [bin_labels[x] for x in bin_codes]
+
+def factorize_strata(df, strata_columns, rows=None):
+    """
+    Assigns every row of the dataframe to a cell, a cell being a unique combination of values
+    of the strata columns. If there are no strata columns all rows are in one cell.
+
+    :param df: pandas dataframe
+    :param strata_columns: list of tuples of column name and bins, as returned by get_strata_columns
+    :param rows: None or numpy array with the positions of the selected rows, the other rows are not assigned to any cell.
+    :return: an integer numpy array with the cell number for each row (-1 for rows not selected), and a list with the label for each cell.
+        If there is only one strata column labels are the values of the column in order of appearance (or the bins
+        in order), otherwise they are tuples with one value per column, ordered by the first column, then the second etc.
+    """
+    nrows = len(df) if rows is None else len(rows)
+    factorized = [factorize_strata_column(df, column, bins, rows=rows) for column, bins in strata_columns]
+
+    if len(factorized) == 1:
+        codes, labels = factorized[0]
+    else:
+        # one combined factorization of the mixed radix key built from the codes of each column
+        key = np.zeros(nrows, dtype=np.int64)
+        for curcodes, curuniques in factorized:
+            key = key * len(curuniques) + curcodes
+        codes, keys = pd.factorize(key, sort=True)
+        labels = list()
+        for curkey in keys:
+            label = list()
+            for curcodes, curuniques in reversed(factorized):
+                curkey, curcode = divmod(curkey, len(curuniques))
+                label.append(curuniques[curcode])
+            labels.append(tuple(reversed(label)))
+
+    if rows is not None:
+        allcodes = np.full(len(df), -1, dtype=np.int64)
+        allcodes[rows] = codes
+        codes = allcodes
+    return codes, labels
+
+def get_cell_rows(codes, ncells):
+    """
+    Gets the positions of the rows for every cell, sorting the codes only once
+
+    :param codes: integer numpy array with the cell number for each row, -1 for rows not in any cell
+    :param ncells: number of cells
+    :return: list of numpy arrays with the positions of the rows in each cell
+    """
+    if not ncells:
+        return list()
+    order = np.argsort(codes, kind='stable')
+    counts = np.bincount(codes[codes >= 0], minlength=ncells)
+    order = order[len(codes) - counts.sum():]
+    bounds = np.cumsum(counts)
+    return np.split(order, bounds[:-1])
+
+def get_table_columns(labels, nlevels, show_overall=True, overall_name='Overall'):
+    """
+    Defines the columns of the table summary. Every column is a tuple of the column label
+    and the list of cells (as indexes in labels) summarized in the column.
+
+    With one strata column there is one column per cell plus the overall column. With more than one
+    strata column, after the cells of each value of an outer strata column there is a column with the
+    overall for that value, and the grand overall is the last column.
+    """
+    ncells = len(labels)
+    if not nlevels:
+        return [(overall_name, list(range(ncells)))]
+    if nlevels == 1:
+        columns = [(label, [indx]) for indx, label in enumerate(labels)]
+        if show_overall:
+            columns.append((overall_name, list(range(ncells))))
+        return columns
+
+    columns = list()
+    # cells in the current group for each depth of nesting
+    groups = [list() for x in range(nlevels-1)]
+    for indx, label in enumerate(labels):
+        if indx and show_overall:
+            prevlabel = labels[indx-1]
+            # close the groups where the prefix changed, innermost first
+            for depth in reversed(range(1, nlevels)):
+                if label[:depth] != prevlabel[:depth]:
+                    columns.append((prevlabel[:depth] + ('',)*(nlevels-1-depth) + (overall_name,), groups[depth-1]))
+                    groups[depth-1] = list()
+        columns.append((label, [indx]))
+        for group in groups:
+            group.append(indx)
+    if show_overall and labels:
+        for depth in reversed(range(1, nlevels)):
+            columns.append((labels[-1][:depth] + ('',)*(nlevels-1-depth) + (overall_name,), groups[depth-1]))
+        columns.append((('',)*(nlevels-1) + (overall_name,), list(range(ncells))))
+    return columns
+
+def add_pooled_columns(columns, labels, pooled_columns, nlevels, show_overall=True):
+    """
+    Adds pooled columns, each summarizing the union of several strata, before the overall column.
+
+    :param columns: list of table columns as returned by get_table_columns
+    :param labels: list of cell labels
+    :param pooled_columns: dictionary with the pooled column name as key and a list of strata as values. With more than one
+        strata column the strata can be either values of the first strata column or tuples with one value per strata column.
+    :param nlevels: number of strata columns
+    :param show_overall: whether columns has an overall column as the last element
+    :return: list of table columns including the pooled ones
+    """
+    if not nlevels:
+        raise Exception("pooled_columns can only be used if strata is defined")
+    pooled = list()
+    for name, members in pooled_columns.items():
+        cells = list()
+        for member in members:
+            if nlevels == 1:
+                curcells = [indx for indx, label in enumerate(labels) if label == member]
+            else:
+                curcells = [indx for indx, label in enumerate(labels) if label == member or label[0] == member]
+            if not curcells:
+                raise Exception(f"stratum {member} for pooled column {name} not found")
+            cells.extend(curcells)
+        column_label = name if nlevels == 1 else ('',)*(nlevels-1) + (name,)
+        pooled.append((column_label, sorted(set(cells))))
+    if show_overall:
+        return columns[:-1] + pooled + columns[-1:]
+    return columns + pooled
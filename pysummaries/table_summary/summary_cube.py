@@ -0,0 +1,350 @@
+# #############################################################################
+# Copyright 2024 F. Hoffmann-La Roche
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# #############################################################################
+"""
+Precomputed cube of accumulators over a few dimension columns, to calculate table summaries
+for any stratification or filter over those dimensions by rolling up cells.
+"""
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from .utils import detect_df_col_types, get_masked_numerical_values, first_occurrences
+from .strata import get_strata_columns, get_bin_labels, factorize_strata, get_table_columns, add_pooled_columns
+from .accumulators import CategoricalAccumulator, NumericalAccumulator, QuantileSketch
+from .table_summary import (get_series, get_functions, get_column_functions,
+        summarize_accumulators, SummaryFrameBuilder)
+
+
+class SummaryCube:
+    """
+    Cube with the state needed to summarise every variable of a pandas dataframe for each unique
+    combination of values (cell) of a few dimension columns.
+
+    For categorical variables the cube holds the counts of each level per cell, for numerical variables the
+    number of observations, missing values, sum, sum of squared differences to the mean, minimum, maximum and a
+    QuantileSketch of at most sketch_size points per cell, so the size of the cube does not grow with the number of rows.
+    Quantiles are exact as long as the rolled up cells have no more than sketch_size observations, and approximate 
+    otherwise. Table summaries stratified by or filtered on any of the dimensions are calculated rolling up the cells, 
+    without going through the rows of the dataframe. As for aggregated data, only the numerical functions included in 
+    the package can be calculated from the cube.
+
+    The cube can be saved to a file and loaded again without the dataframe.
+
+    :param df: pandas dataframe
+    :type df: pandas dataframe, mandatory
+    :param dimensions: columns to use as dimensions, either a list of column names or a dictionary (or list with dictionaries)
+        with a numerical column name as key and a list of increasing bin edges as value, as in strata for calculate_table_summary.
+    :type dimensions: str, list or dict, mandatory
+    :param columns_include: columns to summarize, also determines the order of columns in the summaries
+    :type columns_include: list, optional
+    :param columns_exclude: columns not to summarize
+    :type columns_exclude: list, optional
+    :param categorical_missing_level: if a categorical column has NAs, they will be counted as a level with this name, by default 'Missing'.
+        If set to None, the NAs will not be counted and therefore not reported.
+    :type categorical_missing_level: str, optional
+    :param sketch_size: maximum number of points of the quantile sketch of each cell, by default 10000
+    :type sketch_size: int, optional
+    :param exact_quantiles: if True, the cube keeps all the sorted values of the numerical columns instead of sketches, for
+        exact quantiles. The cube then takes 8 bytes per non missing value of every numerical column, as much as the columns themselves.
+    :type exact_quantiles: bool, optional
+
+    :Example:
+
+    >>> from pysummaries import SummaryCube
+    >>> cube = SummaryCube(df, dimensions=["group", "gender", "region"])
+    >>> cube.save("summary_cube.pkl")
+    >>> tone, strat_numbers = cube.calculate_table_summary(strata="gender", where={"region": ["North", "South"]})
+    """
+    def __init__(self, df, dimensions, columns_include=None, columns_exclude=None, categorical_missing_level='Missing',
+            sketch_size=10000, exact_quantiles=False):
+        self.dimensions = get_strata_columns(dimensions)
+        if not self.dimensions:
+            raise Exception("at least one dimension is needed to build a SummaryCube")
+        self.categorical_missing_level = categorical_missing_level
+        self.sketch_size = sketch_size
+        self.exact_quantiles = exact_quantiles
+        cell_codes, cell_labels = factorize_strata(df, self.dimensions)
+        if len(self.dimensions) == 1:
+            cell_labels = [(x,) for x in cell_labels]
+        self.ncells = len(cell_labels)
+        self.cell_labels = cell_labels
+        self.cell_sizes = np.bincount(cell_codes, minlength=self.ncells)
+        # position of the first row of every cell, to order strata as in the dataframe
+        cell_first_rows = first_occurrences(cell_codes)
+        self.cell_first_rows = np.empty(self.ncells, dtype=np.int64)
+        self.cell_first_rows[cell_codes[cell_first_rows]] = cell_first_rows
+
+        coltypes = detect_df_col_types(df)
+        colnames = df.columns.to_list()
+        if columns_include:
+            colnames = [c for c in columns_include if c in colnames]
+        if columns_exclude:
+            colnames = [c for c in colnames if c not in columns_exclude]
+        self.coltypes = dict()
+        self.levels = dict()
+        self.categories = dict()
+        self.level_counts = dict()
+        self.level_first_rows = dict()
+        self.numerical_stats = dict()
+        # sorted values with exact_quantiles, otherwise the points of the sketches, and for both the offsets of each cell
+        self.values = dict()
+        self.value_offsets = dict()
+        self.weights = dict()
+        for colname in colnames:
+            coltype = coltypes[colname]
+            if coltype == "categorical":
+                self._add_categorical(df, colname, cell_codes)
+            elif coltype == "numerical":
+                self._add_numerical(df, colname, cell_codes)
+            else:
+                continue
+            self.coltypes[colname] = coltype
+
+    def _add_categorical(self, df, colname, cell_codes):
+        curseries = get_series(df, colname, "categorical", categorical_missing_level=self.categorical_missing_level)
+        if curseries.dtype.name == 'category':
+            codes = curseries.cat.codes.to_numpy().astype(np.int64)
+            levels = curseries.cat.categories
+            self.categories[colname] = levels.to_list()
+        else:
+            codes, levels = pd.factorize(curseries)
+            levels = pd.Index(levels)
+            self.categories[colname] = None
+        nlevels = len(levels)
+        counted = codes >= 0
+        keys = cell_codes[counted] * nlevels + codes[counted]
+        counts = np.bincount(keys, minlength=self.ncells * nlevels).reshape(self.ncells, nlevels)
+        # first row of each level in each cell, to order levels with the same count as value_counts does
+        first_rows = np.full((self.ncells, nlevels), np.iinfo(np.int64).max, dtype=np.int64)
+        first = first_occurrences(cell_codes, codes)
+        first = first[codes[first] >= 0]
+        first_rows[cell_codes[first], codes[first]] = first
+        self.levels[colname] = levels
+        self.level_counts[colname] = counts
+        self.level_first_rows[colname] = first_rows
+
+    def _add_numerical(self, df, colname, cell_codes):
+        values, missing = get_masked_numerical_values(df[colname])
+        values = values[~missing]
+        codes = cell_codes[~missing]
+        order = np.lexsort((values, codes))
+        values = values[order]
+        codes = codes[order]
+        count = np.bincount(codes, minlength=self.ncells)
+        total = np.bincount(codes, weights=values, minlength=self.ncells)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = total / count
+        m2 = np.bincount(codes, weights=(values - mean[codes])**2, minlength=self.ncells)
+        offsets = np.concatenate([[0], np.cumsum(count)])
+        nonempty = count > 0
+        # minimum and maximum keep the dtype of the values, so integers are formatted as integers
+        minimum = np.zeros(self.ncells, dtype=values.dtype)
+        maximum = np.zeros(self.ncells, dtype=values.dtype)
+        minimum[nonempty] = values[offsets[:-1][nonempty]]
+        maximum[nonempty] = values[offsets[1:][nonempty] - 1]
+        self.numerical_stats[colname] = {
+                'count': count,
+                'nmissing': np.bincount(cell_codes[missing], minlength=self.ncells),
+                'total': total,
+                'm2': m2,
+                'minimum': minimum,
+                'maximum': maximum,
+        }
+        if self.exact_quantiles:
+            self.values[colname] = values
+            self.value_offsets[colname] = offsets
+            return
+        sketches = [QuantileSketch.from_values(values[offsets[x]:offsets[x+1]], self.sketch_size) for x in range(self.ncells)]
+        self.values[colname] = np.concatenate([x.points for x in sketches] + [np.array([], dtype=np.float64)])
+        self.weights[colname] = np.concatenate([x.weights for x in sketches] + [np.array([], dtype=np.int64)])
+        self.value_offsets[colname] = np.concatenate([[0], np.cumsum([len(x.points) for x in sketches], dtype=np.int64)])
+
+    def memory_usage(self):
+        """
+        Returns the memory used by the arrays of the cube in bytes
+        """
+        arrays = [self.cell_sizes, self.cell_first_rows]
+        arrays.extend(self.level_counts.values())
+        arrays.extend(self.level_first_rows.values())
+        arrays.extend(self.values.values())
+        arrays.extend(self.weights.values())
+        arrays.extend(self.value_offsets.values())
+        for stats in self.numerical_stats.values():
+            arrays.extend(stats.values())
+        return sum([x.nbytes for x in arrays])
+
+    def save(self, filename):
+        """
+        Saves the cube to a file
+        """
+        with open(filename, 'wb') as f:
+            pickle.dump(self, f)
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Loads a cube saved with save
+        """
+        with open(filename, 'rb') as f:
+            cube = pickle.load(f)
+        if not isinstance(cube, cls):
+            raise Exception(f"{filename} does not contain a SummaryCube")
+        return cube
+
+    def _get_dimension_index(self, colname):
+        names = [x for x, bins in self.dimensions]
+        if colname not in names:
+            raise Exception(f"column {colname} is not a dimension of the cube")
+        return names.index(colname)
+
+    def get_selected_cells(self, where=None):
+        """
+        Gets the positions of the cells selected by where, a dictionary with dimension names as keys and a
+        value or list of values to keep as values. For binned dimensions the values are the bin labels.
+        """
+        selected = np.ones(self.ncells, dtype=bool)
+        if where is None:
+            return np.flatnonzero(selected)
+        if type(where) != dict:
+            raise Exception("where for a SummaryCube must be a dictionary of dimensions and values")
+        for colname, values in where.items():
+            dimindx = self._get_dimension_index(colname)
+            if type(values) != list and type(values) != tuple:
+                values = [values]
+            selected &= np.array([label[dimindx] in values for label in self.cell_labels], dtype=bool)
+        return np.flatnonzero(selected)
+
+    def rollup(self, strata_columns, selected):
+        """
+        Groups the selected cells of the cube into the cells of the table summary, in the same order as
+        factorize_strata would give for the rows of the dataframe.
+
+        :return: list of labels and list of arrays with the cube cells in each table cell
+        """
+        if not strata_columns:
+            return [()], [selected]
+        ranks = list()
+        for colname, bins in strata_columns:
+            if bins is not None:
+                raise Exception("strata for a SummaryCube must be dimension names, bins are set when building the cube")
+            dimindx = self._get_dimension_index(colname)
+            values = [self.cell_labels[x][dimindx] for x in selected]
+            dimbins = self.dimensions[dimindx][1]
+            if dimbins is not None:
+                # bins are ordered as the bins, other values by first appearance
+                bin_labels = get_bin_labels(list(dimbins))
+                ranks.append(np.array([bin_labels.index(x) for x in values], dtype=np.int64))
+            else:
+                codes, uniques = pd.factorize(pd.Series(values, dtype=object))
+                first_rows = np.full(len(uniques), np.iinfo(np.int64).max, dtype=np.int64)
+                np.minimum.at(first_rows, codes, self.cell_first_rows[selected])
+                ranks.append(np.argsort(np.argsort(first_rows))[codes])
+        groups, group_codes = np.unique(np.stack(ranks, axis=1), axis=0, return_inverse=True)
+        group_codes = group_codes.reshape(-1)
+        labels = list()
+        cells = list()
+        for groupindx in range(len(groups)):
+            members = selected[group_codes == groupindx]
+            labels.append(tuple([self.cell_labels[members[0]][self._get_dimension_index(colname)] for colname, bins in strata_columns]))
+            cells.append(members)
+        if len(strata_columns) == 1:
+            labels = [x[0] for x in labels]
+        return labels, cells
+
+    def accumulate(self, colname, cells):
+        """
+        Creates the accumulator for the column colname rolling up the cube cells in cells
+        """
+        if self.coltypes[colname] == "categorical":
+            counts = self.level_counts[colname][cells].sum(axis=0)
+            n = int(self.cell_sizes[cells].sum())
+            if self.categories[colname] is not None:
+                return CategoricalAccumulator(pd.Series(counts, index=self.levels[colname]), n, categories=self.categories[colname])
+            # same order as value_counts: by count, then by first appearance
+            first_rows = self.level_first_rows[colname][cells].min(axis=0, initial=np.iinfo(np.int64).max)
+            present = np.flatnonzero(counts)
+            order = present[np.lexsort((first_rows[present], -counts[present]))]
+            return CategoricalAccumulator(pd.Series(counts[order], index=self.levels[colname][order]), n)
+
+        stats = self.numerical_stats[colname]
+        count = stats['count'][cells]
+        nmissing = int(stats['nmissing'][cells].sum())
+        offsets = self.value_offsets[colname]
+        values = np.concatenate([self.values[colname][offsets[x]:offsets[x+1]] for x in cells] + [self.values[colname][:0]])
+        order = np.argsort(values, kind='stable')
+        values = values[order]
+        sketch = None
+        if not self.exact_quantiles:
+            # the sketches of the cells merged at once
+            weights = np.concatenate([self.weights[colname][offsets[x]:offsets[x+1]] for x in cells] + [self.weights[colname][:0]])
+            sketch = QuantileSketch.compress(values, weights[order], self.sketch_size)
+            values = None
+        if not count.sum():
+            return NumericalAccumulator(0, nmissing, 0.0, 0.0, np.nan, np.nan, values, sketch=sketch)
+        # combine the moments of the cells
+        nonempty = count > 0
+        count = count[nonempty]
+        total = stats['total'][cells][nonempty]
+        mean = total.sum() / count.sum()
+        m2 = (stats['m2'][cells][nonempty] + count * (total/count - mean)**2).sum()
+        minimum = stats['minimum'][cells][nonempty].min()
+        maximum = stats['maximum'][cells][nonempty].max()
+        return NumericalAccumulator(int(count.sum()), nmissing, total.sum(), m2, minimum, maximum, values, sketch=sketch)
+
+    def calculate_table_summary(self, strata=None, where=None, show_overall=True, columns_labels=None, overall_name='Overall',
+            columns_include=None, columns_exclude=None, categorical_functions=None, numerical_functions=None, rounding=1,
+            pooled_columns=None):
+        """
+        Calculates a table summary from the cube. Parameters are the same as for calculate_table_summary, except that
+        strata must be dimensions of the cube, where must be a dictionary with dimensions as keys and a value or list of values
+        to keep as values, and there is no id_column.
+
+        :return: the table summary as a pandas dataframe and the number of observations for each column in the table summary
+        :rtype: tuple of pandas dataframe and dictionary
+        """
+        categorical_functions, numerical_functions = get_functions(categorical_functions, numerical_functions)
+        strata_columns = get_strata_columns(strata)
+        cell_labels, cells = self.rollup(strata_columns, self.get_selected_cells(where))
+        table_columns = get_table_columns(cell_labels, len(strata_columns), show_overall=show_overall, overall_name=overall_name)
+        if pooled_columns:
+            table_columns = add_pooled_columns(table_columns, cell_labels, pooled_columns, len(strata_columns), show_overall=show_overall)
+
+        strata_names = [x for x, bins in strata_columns if self.dimensions[self._get_dimension_index(x)][1] is None]
+        colnames = [c for c in self.coltypes.keys() if c not in strata_names]
+        if columns_include:
+            colnames = [c for c in columns_include if c in colnames]
+        if columns_exclude:
+            colnames = [c for c in colnames if c not in columns_exclude]
+        if not colnames:
+            raise Exception("No columns left after filtering for columns_include, columns_exclude and strata")
+
+        cell_numbers = np.array([self.cell_sizes[x].sum() for x in cells], dtype=np.int64)
+        strat_numbers = {column_label: int(cell_numbers[column_cells].sum()) for column_label, column_cells in table_columns}
+
+        builder = SummaryFrameBuilder([column_label for column_label, column_cells in table_columns])
+        for colname in colnames:
+            coltype = self.coltypes[colname]
+            curfuns, catna = get_column_functions(coltype, categorical_functions, numerical_functions)
+            col_label = None
+            if columns_labels:
+                col_label = columns_labels.get(colname)
+            accumulators = [self.accumulate(colname, x) for x in cells]
+            builder.add_variable(summarize_accumulators(dict(), accumulators, table_columns, colname, curfuns, coltype,
+                    var_label=col_label, rounding=rounding), catna=catna)
+
+        tonedf = builder.build()
+        return tonedf, strat_numbers
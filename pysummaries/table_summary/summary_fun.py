@@ -14,11 +14,149 @@
 # limitations under the License.
 # #############################################################################
 """
-Functions to summarise pandas series
+Functions to summarise pandas series.
+
+The format_* functions build the reported values from already calculated statistics,
+they are shared by the functions working on series and the ones working on 
+mergeable accumulators, so that both produce exactly the same output.
 """
+import numpy as np
 import pandas as pd
 
-def categorical_n(curseries, rounding):
+# quantile of the standard normal distribution for 95% confidence intervals
+normal_quantile_95 = 1.959963984540054
+
+def format_n_percent(counts, n, rounding):
+    """
+    Formats "N (%)" from the counts for each category and the total number of observations
+
+    :param counts: counts per category
+    :type counts: pandas series
+    :param n: number of observations used as denominator for the percentages
+    :type n: int
+    :param rounding: number of decimal points to show round the results
+    :type rounding: int
+    :return: a series with a string value per categorical level
+    :rtype: pandas series
+    """
+    curperc = counts.div(float(n)).mul(100)
+    if rounding is not None:
+        curperc = round(curperc, rounding)
+    curperc = " (" + curperc.astype(str).str.cat([" %)"]*len(curperc))
+    curn = counts.astype(str).str.cat(curperc)
+    return curn
+
+def format_percent(counts, n, rounding):
+    """
+    Formats the percentage from the counts for each category and the total number of observations
+
+    :param counts: counts per category
+    :type counts: pandas series
+    :param n: number of observations used as denominator for the percentages
+    :type n: int
+    :param rounding: number of decimal points to show round the results
+    :type rounding: int
+    :return: a series with a string value per categorical level
+    :rtype: pandas series
+    """
+    curperc = counts.div(float(n)).mul(100)
+    if rounding is not None:
+        curperc = round(curperc, rounding)
+    curperc = curperc.astype(str).str.cat([" %"]*len(curperc))
+    return curperc
+
+def format_percent_ci(counts, n, rounding):
+    """
+    Formats "% [95% CI]" from the counts for each category and the total number of observations, 
+    with the normal approximation to the binomial distribution
+
+    :param counts: counts per category
+    :type counts: pandas series
+    :param n: number of observations used as denominator for the percentages
+    :type n: int
+    :param rounding: number of decimal points to show round the results
+    :type rounding: int
+    :return: a series with a string value per categorical level
+    :rtype: pandas series
+    """
+    prop = counts.div(float(n)) if n else counts * np.nan
+    margin = normal_quantile_95 * np.sqrt(prop * (1 - prop) / n) if n else prop
+    values = [prop.mul(100), (prop - margin).clip(lower=0).mul(100), (prop + margin).clip(upper=1).mul(100)]
+    if rounding is not None:
+        values = [round(x, rounding) for x in values]
+    curperc, lower, upper = [x.astype(str) for x in values]
+    return curperc + " % [" + lower + " ; " + upper + "]"
+
+def format_mean_ci(mean, std, count, rounding):
+    """
+    Formats "Mean [95% CI]" with the normal approximation
+    """
+    margin = normal_quantile_95 * std / np.sqrt(count) if count else np.nan
+    lower = mean - margin
+    upper = mean + margin
+    if rounding is not None:
+        mean = round(mean, rounding)
+        lower = round(lower, rounding)
+        upper = round(upper, rounding)
+    return str(mean) + " [" + str(lower) + " ; " + str(upper) + "]"
+
+def format_mean_sd(mean, std, rounding):
+    """
+    Formats "Mean (SD)" 
+    """
+    mean = str(round(mean, 1))
+    if rounding is not None:
+        std = round(std, rounding)
+    std = " (" + str(std) + ")"
+    return mean + std
+
+def format_median_iqr(median, q1, q3, rounding):
+    """
+    Formats "Median [IQR]" 
+    """
+    iqr = q3 - q1
+    if rounding is not None:
+        median = round(median, rounding)
+        iqr = round(iqr, rounding)
+    median = str(median)
+    iqr = " [" + str(iqr) + "]"
+    return median + iqr
+
+def format_median_q1q3(median, q1, q3, rounding):
+    """
+    Formats "Median [Q1 ; Q3]"
+    """
+    if rounding is not None:
+        median = round(median, rounding)
+        q1 = round(q1, rounding)
+        q3 = round(q3, rounding)
+    median = str(median)
+    iqr = " [" + str(q1) +  " ; " + str(q3) + "]"
+    return median + iqr
+
+def format_min_max(minimum, maximum, rounding):
+    """
+    Formats "Min ; Max"
+    """
+    if rounding is not None:
+        minimum = round(minimum, rounding)
+        maximum = round(maximum,rounding)
+    minimum = str(minimum)
+    maximum = str(maximum)
+    return minimum + " ; " + maximum
+
+def format_missing(n, total, rounding):
+    """
+    Formats "N (%)" of missing values from the number of missing values and the total number of observations
+    """
+    perc = 0
+    if total:
+        perc = 100 * (n/total) 
+    if rounding is not None:
+        perc = round(perc, 1)
+    return str(n) + " (" + str(perc) + " %)"
+
+def categorical_n(curseries, rounding, n=None):
     """
     Calculates the N for each category in the series.
 
@@ -26,17 +164,18 @@ def categorical_n(curseries, rounding):
     :type curseries: pandas series
     :param rounding: number of decimal points to show round the results
     :type rounding: int
+    :param n: number of observations to use as denominator for percentages. If None, the length of curseries is used
+    :type n: int, optional
     :return: a series with a numerical or string value per categorical level
     :rtype: pandas series
     """
-    curstat_n = len(curseries)
     dosort = True
     if curseries.dtype.name == 'category':
         dosort = False
     curn = curseries.value_counts(sort=dosort)
     return curn
 
-def categorical_n_percent(curseries, rounding):
+def categorical_n_percent(curseries, rounding, n=None):
     """
     Calculates "N (%)" fo each category in the series
 
@@ -44,21 +183,18 @@ def categorical_n_percent(curseries, rounding):
     :type curseries: pandas series
     :param rounding: number of decimal points to show round the results
     :type rounding: int
+    :param n: number of observations to use as denominator for percentages. If None, the length of curseries is used
+    :type n: int, optional
     :return: a series with a numerical or string value per categorical level
     :rtype: pandas series
     """
-    curstat_n = len(curseries)
+    curstat_n = len(curseries) if n is None else n
     dosort = True
     if curseries.dtype.name == 'category':
         dosort = False
-    curperc = curseries.value_counts(sort=dosort).div(float(curstat_n)).mul(100)
-    if rounding is not None:
-        curperc = round(curperc, rounding)
-    curperc = " (" + curperc.astype(str).str.cat([" %)"]*len(curperc))
-    curn = curseries.value_counts(sort=dosort).astype(str).str.cat(curperc)
-    return curn
+    return format_n_percent(curseries.value_counts(sort=dosort), curstat_n, rounding)
 
-def categorical_percent(curseries, rounding):
+def categorical_percent(curseries, rounding, n=None):
     """
     Calculates the percentage for each category in the series
 
@@ -66,15 +202,46 @@ def categorical_percent(curseries, rounding):
     :type curseries: pandas series
     :param rounding: number of decimal points to show round the results
     :type rounding: int
+    :param n: number of observations to use as denominator for percentages. If None, the length of curseries is used
+    :type n: int, optional
     :return: a series with a numerical or string value per categorical level
     :rtype: pandas series
     """
-    curstat_n = len(curseries)
-    curperc = curseries.value_counts().div(float(curstat_n)).mul(100)
-    if rounding is not None:
-        curperc = round(curperc, rounding)
-    curperc = curperc.astype(str).str.cat([" %"]*len(curperc))
-    return curperc
+    curstat_n = len(curseries) if n is None else n
+    return format_percent(curseries.value_counts(), curstat_n, rounding)
+
+def categorical_percent_ci(curseries, rounding, n=None):
+    """
+    Calculates the percentage and its 95% confidence interval for each category in the series, for 
+    example to summarize a random sample of the data
+
+    :param curseries: series to be summarized
+    :type curseries: pandas series
+    :param rounding: number of decimal points to show round the results
+    :type rounding: int
+    :param n: number of observations to use as denominator for percentages. If None, the length of curseries is used
+    :type n: int, optional
+    :return: a series with a string value per categorical level
+    :rtype: pandas series
+    """
+    curstat_n = len(curseries) if n is None else n
+    dosort = True
+    if curseries.dtype.name == 'category':
+        dosort = False
+    return format_percent_ci(curseries.value_counts(sort=dosort), curstat_n, rounding)
+
+def numerical_mean_ci(curseries, rounding):
+    """
+    Calculates "Mean [95% CI]" for the numerical series
+
+    :param curseries: series to be summarized
+    :type curseries: pandas series
+    :param rounding: number of decimal points to show round the results
+    :type rounding: int
+    :return: a single value with the summary for the series
+    :rtype: int, float or string
+    """
+    return format_mean_ci(curseries.mean(), curseries.std(), curseries.count(), rounding)
 
 def numerical_mean_sd(curseries, rounding):
     """
@@ -87,12 +254,7 @@ def numerical_mean_sd(curseries, rounding):
     :return: a single value with the summary for the series
     :rtype: int, float or string
     """
-    mean = str(round(curseries.mean(), 1))
-    std = curseries.std()
-    if rounding is not None:
-        std = round(std, rounding)
-    std = " (" + str(std) + ")"
-    return mean + std
+    return format_mean_sd(curseries.mean(), curseries.std(), rounding)
 
 def numerical_median_iqr(curseries, rounding):
     """
@@ -105,14 +267,7 @@ def numerical_median_iqr(curseries, rounding):
     :return: a single value with the summary for the series
     :rtype: int, float or string
     """
-    median = curseries.median()
-    iqr = curseries.quantile(0.75) - curseries.quantile(0.25)
-    if rounding is not None:
-        median = round(median, rounding)
-        iqr = round(iqr, rounding)
-    median = str(median)
-    iqr = " [" + str(iqr) + "]"
-    return median + iqr
+    return format_median_iqr(curseries.median(), curseries.quantile(0.25), curseries.quantile(0.75), rounding)
 
 def numerical_median_q1q3(curseries, rounding):
     """
@@ -125,16 +280,7 @@ def numerical_median_q1q3(curseries, rounding):
     :return: a single value with the summary for the series
     :rtype: int, float or string
     """
-    median = curseries.median()
-    q1 = curseries.quantile(0.25)
-    q3 = curseries.quantile(0.75)
-    if rounding is not None:
-        median = round(median, rounding)
-        q1 = round(q1, rounding)
-        q3 = round(q3, rounding)
-    median = str(median)
-    iqr = " [" + str(q1) +  " ; " + str(q3) + "]"
-    return median + iqr
+    return format_median_q1q3(curseries.median(), curseries.quantile(0.25), curseries.quantile(0.75), rounding)
 
 def numerical_min_max(curseries, rounding):
     """
@@ -147,14 +293,7 @@ def numerical_min_max(curseries, rounding):
     :return: a single value with the summary for the series
     :rtype: int, float or string
     """
-    minimum = curseries.min()
-    maximum = curseries.max()
-    if rounding is not None:
-        minimum = round(minimum, rounding)
-        maximum = round(maximum,rounding)
-    minimum = str(minimum)
-    maximum = str(maximum)
-    return minimum + " ; " + maximum
+    return format_min_max(curseries.min(), curseries.max(), rounding)
 
 def numerical_missing(curseries, rounding):
     """
@@ -167,13 +306,5 @@ def numerical_missing(curseries, rounding):
     :return: a single value with the summary for the series
     :rtype: int, float or string
     """
-    n = 0
-    perc = 0
-    if len(curseries):
-        n = len(curseries[pd.isna(curseries)])
-        perc = 100 * (n/len(curseries)) 
-    if rounding is not None:
-        perc = round(perc, 1)
-    return str(n) + " (" + str(perc) + " %)"
-
-
+    n = int(pd.isna(curseries).sum())
+    return format_missing(n, len(curseries), rounding)
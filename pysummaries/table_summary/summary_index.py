@@ -0,0 +1,260 @@
+# #############################################################################
+# Copyright 2024 F. Hoffmann-La Roche
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# #############################################################################
+"""
+Bitmap index to calculate many table summaries for different strata and subsets
+of the same dataframe.
+"""
+import numpy as np
+import pandas as pd
+
+from .utils import detect_df_col_types, get_masked_numerical_values
+from .strata import get_strata_columns, get_table_columns, add_pooled_columns
+from .accumulators import CategoricalAccumulator, NumericalAccumulator
+from .table_summary import (get_series, get_functions, get_column_functions,
+        summarize_accumulators, SummaryFrameBuilder)
+
+# number of bits set for every byte value
+POPCOUNT = np.array([bin(x).count('1') for x in range(256)], dtype=np.uint8)
+
+
+def popcount(bitmaps):
+    """
+    Counts the bits set in a packed bitmap, or in each row of a 2D array of packed bitmaps
+    """
+    return POPCOUNT[bitmaps].sum(axis=-1, dtype=np.int64)
+
+def first_set_bit(bitmap):
+    """
+    Position of the first bit set in a non empty packed bitmap
+    """
+    byte = np.flatnonzero(bitmap)[0]
+    return byte * 8 + np.unpackbits(bitmap[byte:byte+1]).argmax()
+
+
+class SummaryIndex:
+    """
+    Index over a pandas dataframe to calculate table summaries for different strata and subsets of rows
+    without going through the categorical columns again.
+
+    For every level of every categorical column the index holds a packed bitmap of the rows having that
+    level. Strata and filters are resolved by intersecting bitmaps and categorical counts by counting the 
+    bits set in the intersections. Numerical columns are kept as numpy arrays in their dtype (without copying 
+    them when possible) with a packed bitmap of their missing values, and only the values of the selected 
+    rows are read.
+
+    Memory for the bitmaps is the number of rows / 8 bytes per level, therefore high cardinality columns
+    (ids, free text) should be excluded.
+
+    :param df: pandas dataframe
+    :type df: pandas dataframe, mandatory
+    :param columns_include: columns to index, also determines the order of columns in the summaries
+    :type columns_include: list, optional
+    :param columns_exclude: columns not to index
+    :type columns_exclude: list, optional
+    :param categorical_missing_level: if a categorical column has NAs, they will be indexed as a level with this name, by default 'Missing'.
+        If set to None, the NAs will not be indexed and therefore not reported.
+    :type categorical_missing_level: str, optional
+
+    :Example:
+
+    >>> from pysummaries import SummaryIndex
+    >>> index = SummaryIndex(df)
+    >>> tone, strat_numbers = index.calculate_table_summary(strata="group", where={"region": ["North", "South"]})
+    """
+    def __init__(self, df, columns_include=None, columns_exclude=None, categorical_missing_level='Missing'):
+        self.nrows = len(df)
+        self.categorical_missing_level = categorical_missing_level
+        coltypes = detect_df_col_types(df)
+        colnames = df.columns.to_list()
+        if columns_include:
+            colnames = [c for c in columns_include if c in colnames]
+        if columns_exclude:
+            colnames = [c for c in colnames if c not in columns_exclude]
+        self.coltypes = dict()
+        self.levels = dict()
+        self.categories = dict()
+        self.bitmaps = dict()
+        self.missing_rows = dict()
+        self.values = dict()
+        for colname in colnames:
+            coltype = coltypes[colname]
+            if coltype == "categorical":
+                self._index_categorical(df, colname)
+            elif coltype == "numerical":
+                self._index_numerical(df, colname)
+            else:
+                continue
+            self.coltypes[colname] = coltype
+        self.all_rows = np.packbits(np.ones(self.nrows, dtype=bool))
+
+    def _index_categorical(self, df, colname):
+        # rows with NAs are needed to reject them as strata
+        self.missing_rows[colname] = np.packbits(pd.isna(df[colname]).to_numpy())
+        curseries = get_series(df, colname, "categorical", categorical_missing_level=self.categorical_missing_level)
+        if curseries.dtype.name == 'category':
+            codes = curseries.cat.codes.to_numpy()
+            levels = curseries.cat.categories
+            self.categories[colname] = levels.to_list()
+        else:
+            codes, levels = pd.factorize(curseries)
+            levels = pd.Index(levels)
+            self.categories[colname] = None
+        bitmaps = np.zeros((len(levels), (self.nrows + 7)//8), dtype=np.uint8)
+        mask = np.zeros(self.nrows, dtype=bool)
+        for levelindx in range(len(levels)):
+            np.equal(codes, levelindx, out=mask)
+            bitmaps[levelindx] = np.packbits(mask)
+        self.levels[colname] = levels
+        self.bitmaps[colname] = bitmaps
+
+    def _index_numerical(self, df, colname):
+        values, missing = get_masked_numerical_values(df[colname])
+        self.values[colname] = values
+        self.missing_rows[colname] = np.packbits(missing)
+
+    def memory_usage(self):
+        """
+        Returns the memory used by the index in bytes. Numerical columns
+        may share their memory with the dataframe.
+        """
+        bitmaps = sum([x.nbytes for x in self.bitmaps.values()]) + sum([x.nbytes for x in self.missing_rows.values()])
+        values = sum([x.nbytes for x in self.values.values()])
+        return bitmaps + values
+
+    def _get_level_bitmap(self, colname, values):
+        if self.coltypes.get(colname) != "categorical":
+            raise Exception(f"column {colname} is not a categorical column in the index")
+        if type(values) != list and type(values) != tuple:
+            values = [values]
+        levels = self.levels[colname]
+        bitmap = np.zeros_like(self.all_rows)
+        for value in values:
+            if value in levels:
+                bitmap |= self.bitmaps[colname][levels.get_loc(value)]
+        return bitmap
+
+    def get_rows_bitmap(self, where=None):
+        """
+        Gets the packed bitmap of the rows selected by where.
+
+        :param where: a dictionary with names of categorical columns as keys and a value or list of values to
+            keep as values. If None all rows are selected
+        :type where: dict, optional
+        :return: packed bitmap as a numpy uint8 array
+        """
+        bitmap = self.all_rows.copy()
+        if where is None:
+            return bitmap
+        if type(where) != dict:
+            raise Exception("where for a SummaryIndex must be a dictionary of columns and values")
+        for colname, values in where.items():
+            bitmap &= self._get_level_bitmap(colname, values)
+        return bitmap
+
+    def get_cells(self, strata_columns, selected):
+        """
+        Splits the selected rows into cells, in the same order as factorize_strata.
+
+        :return: list of cell labels and list of cell bitmaps
+        """
+        labels = [()]
+        cells = [selected]
+        for colname, bins in strata_columns:
+            if bins is not None:
+                raise Exception("binned strata are not supported by SummaryIndex")
+            if self.coltypes.get(colname) != "categorical":
+                raise Exception(f"strata column {colname} is not a categorical column in the index")
+            if (self.missing_rows[colname] & selected).any():
+                raise Exception("strata may not contain missing values")
+            # levels present in the selected rows, in order of appearance
+            level_bitmaps = self.bitmaps[colname] & selected
+            present = np.flatnonzero(popcount(level_bitmaps))
+            first_rows = [first_set_bit(level_bitmaps[x]) for x in present]
+            present = present[np.argsort(first_rows, kind='stable')]
+            newlabels = list()
+            newcells = list()
+            for label, cell in zip(labels, cells):
+                for levelindx in present:
+                    newcell = cell & level_bitmaps[levelindx]
+                    if newcell.any():
+                        newlabels.append(label + (self.levels[colname][levelindx],))
+                        newcells.append(newcell)
+            labels = newlabels
+            cells = newcells
+        if len(strata_columns) == 1:
+            labels = [x[0] for x in labels]
+        return labels, cells
+
+    def accumulate(self, colname, cell):
+        """
+        Creates the accumulator for the column colname and the rows in the bitmap cell
+        """
+        if self.coltypes[colname] == "categorical":
+            level_bitmaps = self.bitmaps[colname] & cell
+            counts = pd.Series(popcount(level_bitmaps), index=self.levels[colname])
+            if self.categories[colname] is None:
+                # same order as value_counts: by count, then by first appearance in the cell
+                present = np.flatnonzero(counts.to_numpy())
+                first_rows = [first_set_bit(level_bitmaps[x]) for x in present]
+                counts = counts.iloc[present[np.lexsort((first_rows, -counts.to_numpy()[present]))]]
+            return CategoricalAccumulator(counts, int(popcount(cell)), categories=self.categories[colname])
+        present = cell & ~self.missing_rows[colname]
+        values = self.values[colname][np.flatnonzero(np.unpackbits(present, count=self.nrows))]
+        return NumericalAccumulator.from_values(values, int(popcount(cell)) - len(values))
+
+    def calculate_table_summary(self, strata=None, where=None, show_overall=True, columns_labels=None, overall_name='Overall',
+            columns_include=None, columns_exclude=None, categorical_functions=None, numerical_functions=None, rounding=1,
+            pooled_columns=None):
+        """
+        Calculates a table summary from the index. Parameters are the same as for calculate_table_summary, except that
+        strata must be categorical columns in the index, where must be a dictionary with names of categorical columns as keys
+        and a value or list of values to keep as values, and there is no id_column.
+
+        :return: the table summary as a pandas dataframe and the number of observations for each column in the table summary
+        :rtype: tuple of pandas dataframe and dictionary
+        """
+        categorical_functions, numerical_functions = get_functions(categorical_functions, numerical_functions)
+        strata_columns = get_strata_columns(strata)
+        cell_labels, cells = self.get_cells(strata_columns, self.get_rows_bitmap(where))
+        table_columns = get_table_columns(cell_labels, len(strata_columns), show_overall=show_overall, overall_name=overall_name)
+        if pooled_columns:
+            table_columns = add_pooled_columns(table_columns, cell_labels, pooled_columns, len(strata_columns), show_overall=show_overall)
+
+        strata_names = [x for x, bins in strata_columns]
+        colnames = [c for c in self.coltypes.keys() if c not in strata_names]
+        if columns_include:
+            colnames = [c for c in columns_include if c in colnames]
+        if columns_exclude:
+            colnames = [c for c in colnames if c not in columns_exclude]
+        if not colnames:
+            raise Exception("No columns left after filtering for columns_include, columns_exclude and strata")
+
+        cell_numbers = np.array([popcount(cell) for cell in cells], dtype=np.int64)
+        strat_numbers = {column_label: int(cell_numbers[column_cells].sum()) for column_label, column_cells in table_columns}
+
+        builder = SummaryFrameBuilder([column_label for column_label, column_cells in table_columns])
+        for colname in colnames:
+            coltype = self.coltypes[colname]
+            curfuns, catna = get_column_functions(coltype, categorical_functions, numerical_functions)
+            col_label = None
+            if columns_labels:
+                col_label = columns_labels.get(colname)
+            accumulators = [self.accumulate(colname, cell) for cell in cells]
+            builder.add_variable(summarize_accumulators(dict(), accumulators, table_columns, colname, curfuns, coltype,
+                    var_label=col_label, rounding=rounding), catna=catna)
+
+        tonedf = builder.build()
+        return tonedf, strat_numbers
@@ -14,9 +14,20 @@
 # limitations under the License.
 # #############################################################################
 
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+import numpy as np
 import pandas as pd
 
-from .utils import detect_df_col_types
+from .utils import (as_dataframe, detect_df_col_types, get_masked_numerical_values, estimate_distinct, parse_memory_size,
+        estimate_row_bytes, is_mapped, first_occurrences, count_distinct)
+from .strata import get_strata_columns, get_selected_rows, factorize_strata, get_cell_rows, get_table_columns, add_pooled_columns
+from .wide import get_wide_columns, summarize_wide
+from .bootstrap import add_bootstrap_ci, percentage_functions
+from .accumulators import (CategoricalAccumulator, NumericalAccumulator, HeavyHitters, accumulate, categorical_accumulators,
+        sparse_numerical_accumulators, narrow_numerical_accumulators, chunked_accumulators, merge_accumulators, empty_accumulator, numerical_formatters)
 from . import summary_fun as sf
 
 
@@ -52,56 +63,260 @@ numerical_presets = {
 
 }
 
-def calculate_stats(df, var, functions, coltype, strata=None, stratcat=None, var_label=None, rounding=1, categorical_missing_level=None):
+def get_series(df, var, coltype, rows=None, categorical_missing_level=None):
     """
-    For the dataframe df, for the variable var, apply all the functions. 
-    If there is a stratum stratcat defined, then the dataframe will be sliced
-    using the column strata for the stratum defined.
-    If var_label is not None, then it will be used as index for the returning dataframe
+    Gets the series for the variable var from the dataframe df.
+    If rows is not None, it is an array with the positions of the rows to use. Consecutive positions, as the cells of 
+    data sorted by the strata, are taken as a slice, without copying the column (for example a memory-mapped one).
+    For categorical variables NAs are replaced by categorical_missing_level if set. Numerical variables with
+    nullable or pyarrow backed dtypes are converted to numpy, with NaN for missing values, except integers with
+    missing values, which become nullable integers.
     """
-    if strata is None and stratcat is None:
-        curseries = df.loc[:, var]
+    if rows is not None and len(rows) and (np.diff(rows) == 1).all():
+        curseries = df[var].iloc[rows[0]:rows[-1] + 1]
+    elif rows is not None:
+        curseries = df[var].iloc[rows]
     else:
-        curseries = df.loc[df[strata]==stratcat, var]
+        curseries = df.loc[:, var]
+    if coltype == 'numerical' and not isinstance(curseries.dtype, np.dtype):
+        # nullable and pyarrow backed numbers are summarized as numpy arrays
+        values, missing = get_masked_numerical_values(curseries)
+        if values.dtype.kind in 'iu' and missing.any():
+            values = pd.arrays.IntegerArray(values, missing)
+        curseries = pd.Series(values, index=curseries.index, name=curseries.name, copy=False)
     if coltype=='categorical' and  categorical_missing_level:
-        curseries = curseries.copy()
+        # set_categories and fillna return new series, the dataframe is not modified
         if curseries.dtype.name=='category':
             cats = curseries.cat.categories.to_list() + [categorical_missing_level]
             curseries = curseries.cat.set_categories(cats)
         curseries = curseries.fillna(categorical_missing_level)
-    curstratdf = None
+    return curseries
+
+def get_top_levels(curseries, k, chunk_size=100000):
+    """
+    Gets the k most frequent levels of a categorical series. Candidate levels are found with a HeavyHitters summary 
+    updated chunk by chunk, so the memory used does not depend on the number of distinct levels, and only the candidates 
+    are then counted exactly. The levels are the exact top k if the k-th level has more than n/(size+1) of the n 
+    observations, size being the number of counters (at least 10*k).
+
+    :return: pandas series with the exact counts of the top levels, ties in order of first appearance as in value_counts
+    """
+    size = max(10 * k, 1000)
+    sketch = HeavyHitters(size)
+    for start in range(0, len(curseries), chunk_size):
+        sketch = sketch.merge(HeavyHitters.from_series(curseries.iloc[start:start+chunk_size], size))
+    counts = curseries[curseries.isin(sketch.levels())].value_counts()
+    return counts[counts > 0].iloc[:k]
+
+def collapse_levels(curseries, max_levels, rows=None, other_level='Other'):
+    """
+    Keeps the max_levels most frequent levels of a categorical series, counted on the rows at the positions
+    in rows if not None, and replaces the other non missing values by other_level. 
+
+    :return: the series unchanged if it has no more than max_levels levels, otherwise a categorical series with the
+        kept levels, by decreasing frequency, and other_level as categories
+    """
+    selected = curseries if rows is None else curseries.iloc[rows]
+    counts = get_top_levels(selected, max_levels)
+    if counts.sum() == selected.count():
+        return curseries
+    kept = counts.index
+    if other_level in kept:
+        raise Exception(f"level {other_level} is already a level of {curseries.name}")
+    if curseries.dtype.name == 'category':
+        # only the categories are looked up, the codes are remapped
+        lookup = pd.Index(kept).get_indexer(curseries.cat.categories)
+        lookup[lookup < 0] = len(kept)
+        codes = np.append(lookup, -1)[curseries.cat.codes.to_numpy()]
+    else:
+        codes = pd.Index(kept).get_indexer(curseries)
+        codes[(codes < 0) & curseries.notna().to_numpy()] = len(kept)
+    categories = kept.to_list() + [other_level]
+    return pd.Series(pd.Categorical.from_codes(codes, categories=categories), index=curseries.index, name=curseries.name)
+
+def calculate_stats(curseries, var, functions, coltype, var_label=None, rounding=1, n=None):
+    """
+    For the series curseries, holding the variable var, apply all the functions. 
+    curseries can also be an accumulator, in which case the functions are calculated from the 
+    accumulated state.
+    If var_label is not None, then it will be used as index for the returning dataframe
+    If n is not None it is passed to categorical functions as denominator for the percentages.
+    """
+    label = str(var_label) if var_label else str(var)
+    stats = list()
     for funlabel, fun in functions.items():
-        curstat = fun(curseries, rounding)
+        if isinstance(curseries, (CategoricalAccumulator, NumericalAccumulator)):
+            curstat = curseries.apply(fun, rounding)
+        elif n is not None:
+            curstat = fun(curseries, rounding, n=n)
+        else:
+            curstat = fun(curseries, rounding)
         if coltype == "categorical":
-            if var_label:
-                curstat.index = pd.MultiIndex.from_tuples([(str(var_label), str(a)) for a in curstat.index])
-            else:
-                curstat.index = pd.MultiIndex.from_tuples([(str(var), str(a)) for a in curstat.index])
-        elif coltype == "numerical":
-            if type(curstat) != pd.Series:
-                curstat = pd.Series(curstat)
-            if var_label:
-                curstat.index = pd.MultiIndex.from_tuples([(str(var_label), str(funlabel))])
+            curstat.index = pd.MultiIndex.from_arrays([[label]*len(curstat), [str(a) for a in curstat.index]])
+        elif coltype == "numerical" and type(curstat) == pd.Series:
+            curstat = curstat.iloc[0]
+        stats.append(curstat)
+    if not stats:
+        return None
+    if coltype == "numerical":
+        # one value per function, the series is built once
+        return pd.Series(stats, index=pd.MultiIndex.from_arrays([[label]*len(stats), [str(x) for x in functions.keys()]]))
+    if len(stats) == 1:
+        return stats[0]
+    return pd.concat(stats)
+
+
+def get_functions(categorical_functions, numerical_functions):
+    """
+    Validates the categorical and numerical functions, replacing presets and None by the 
+    corresponding functions. See calculate_table_summary for the details.
+    """
+    if categorical_functions:
+        if type(categorical_functions)==str:
+            temp = categorical_presets.get(categorical_functions)
+            if not temp:
+                raise Exception(f"categorical preset {categorical_functions} not defined!")
+            categorical_functions = temp
+        elif type(categorical_functions)==list or type(categorical_functions)==tuple:
+            if len(categorical_functions)!=2:
+                raise Exception("The length of categorical functions must be 2!")
+            if not callable(categorical_functions[0]):
+                raise Exception("The first element of categorical_functions must be a function")
+            #if not type(categorical_functions[1])==str:
+                #raise Exception("The second element of categorical_functions must be a string")
+        else:
+            raise Exception("categorical_functions should be either string, list or tuple")
+    else:
+        categorical_functions = categorical_presets["n_percent"]
+
+    if numerical_functions:
+        if type(numerical_functions)==str:
+            temp = numerical_presets.get(numerical_functions)
+            if not temp:
+                raise Exception(f"numerical preset {numerical_functions} not defined!")
+            numerical_functions = temp
+        elif type(numerical_functions)==dict:
+            if not all([callable(x) for x in numerical_functions.values()]):
+                raise Exception("The values of numerical_functions must be functions")
+            if not all([type(x)==str for x in numerical_functions.keys()]):
+                raise Exception("The keys of numerical_functions must be strings")
+        else:
+            raise Exception("numerical_functions should be either string or dict")
+    else:
+        numerical_functions = numerical_presets["meansd_medianq1q3_minmax_missing"]
+
+    return categorical_functions, numerical_functions
+
+def get_column_functions(coltype, categorical_functions, numerical_functions):
+    """
+    Returns the functions to apply to a column of coltype as a dictionary
+    and the value to use for empty categorical levels.
+    """
+    catna = None
+    if coltype == "categorical":
+        curfuns, catna = categorical_functions
+        curfuns = {'': curfuns}
+    elif coltype == "numerical":
+        curfuns = numerical_functions
+    else:
+        raise NotImplementedError(f"statistics for coltype {coltype} not implemented")
+    return curfuns, catna
+
+def summarize_accumulators(var_dict, accumulators, table_columns, var, functions, coltype, var_label=None, rounding=1):
+    """
+    Completes the summaries for the variable var. var_dict has the table columns already calculated, the 
+    rest of table columns are calculated merging the accumulators of their cells.
+
+    :return: dictionary with the summary series for each table column, in the order of table_columns
+    """
+    for column_label, cells in table_columns:
+        if column_label not in var_dict:
+            if cells:
+                merged = merge_accumulators([accumulators[x] for x in cells])
             else:
-                curstat.index = pd.MultiIndex.from_tuples([(str(var), str(funlabel))])
-        if curstratdf is None:
-            curstratdf = curstat
-        else: 
-            curstratdf = pd.concat([curstratdf, curstat])
-    return curstratdf
+                merged = empty_accumulator(coltype)
+            var_dict[column_label] = calculate_stats(merged, var, functions, coltype, rounding=rounding, var_label=var_label)
+    return {column_label: var_dict[column_label] for column_label, cells in table_columns}
+
+# with engine='auto', float columns are summarized with the wide engine if there are at least 
+# auto_wide_columns (float columns times table columns with one cell) summaries to calculate at once, 
+# or at least two float columns and no more than auto_wide_rows rows
+auto_wide_columns = 10
+auto_wide_rows = 100000
+# by groups are calculated in parallel threads if there are at least auto_parallel_rows rows
+auto_parallel_rows = 100000
+# chunks have at least min_chunk_size rows, as the cost of every chunk does not depend on its size
+min_chunk_size = 1000
+
+
+class SummaryFrameBuilder:
+    """
+    Collects the summaries of the variables of a table summary and builds the summary dataframe once, 
+    with one MultiIndex for the rows and one array per table column.
+    """
+    def __init__(self, column_labels):
+        """
+        :param column_labels: labels of the table columns, in order
+        """
+        self.column_labels = list(column_labels)
+        self.row_indexes = list()
+        self.column_parts = [list() for x in self.column_labels]
+
+    def add_variable(self, var_dict, catna=None):
+        """
+        Adds the rows of one variable. var_dict has a series for every table column, they are aligned on the union
+        of their indexes as in a dataframe, and empty categorical levels are filled with catna if set.
+        """
+        if not self.column_labels:
+            return
+        series = [var_dict[column_label] for column_label in self.column_labels]
+        index = series[0].index
+        for curseries in series[1:]:
+            index = index.union(curseries.index, sort=None)
+        for parts, curseries in zip(self.column_parts, series):
+            if not curseries.index.equals(index):
+                curseries = curseries.reindex(index)
+                if catna:
+                    curseries = curseries.fillna(catna)
+            parts.append(curseries)
+        self.row_indexes.append(index)
+
+    def build(self):
+        """
+        :return: the table summary as a pandas dataframe
+        """
+        if not self.column_labels or not self.row_indexes:
+            return pd.DataFrame()
+        nlevels = self.row_indexes[0].nlevels
+        index = pd.MultiIndex.from_arrays([np.concatenate([x.get_level_values(level).to_numpy() for x in self.row_indexes])
+                                           for level in range(nlevels)])
+        columns = dict()
+        for column_label, parts in zip(self.column_labels, self.column_parts):
+            values = parts[0] if len(parts) == 1 else pd.concat(parts, ignore_index=True)
+            columns[column_label] = values.array
+        return pd.DataFrame(columns, index=index, copy=False)
 
 
 def calculate_table_summary(df, strata=None, show_overall=True, columns_labels=None, overall_name='Overall',
         columns_include=None, columns_exclude=None,
         categorical_functions=None, numerical_functions=None, rounding=1, 
-        categorical_missing_level='Missing'):
+        categorical_missing_level='Missing', id_column=None, pooled_columns=None, where=None, engine='auto',
+        column_types=None, by=None, n_jobs=None, max_levels=None, high_cardinality='raise', categorical_top_k=None, memory_limit=None,
+        precision='float64', ci=None, n_bootstrap=1000, random_state=None):
     """
     Calculates  a table summary from a pandas dataframe.
 
-    :param df: pandas dataframe from which to calculate the table one
-    :type df: pandas dataframe, mandatory
-    :param strata: the name of a column in the dataframe to stratify the table one (columns)
-    :type strata: str, optional
+    :param df: pandas dataframe from which to calculate the table one. It can also be a numpy structured array or memmap, a pyarrow Table or
+        the path to an Arrow IPC/Feather file, which is memory-mapped; numerical columns of those are summarized without copying them
+        into memory (for Arrow, if uncompressed and without missing values).
+    :type df: pandas dataframe, numpy array, pyarrow Table or str, mandatory
+    :param strata: the name of a column in the dataframe to stratify the table one (columns). If a list of column names, there will be one 
+        column for each combination of values of those columns, the columns of the table will be a multi-index and, if show_overall is True,
+        there will be an overall column for each value of the outer strata columns. A numerical column can be binned on the fly 
+        passing a dictionary with the column name as key and a list of increasing bin edges as value, for example {'age': [18, 40, 65, 120]}; 
+        bins are closed on the left (the last one also on the right) and the binned column is still summarized. Dictionaries can also be 
+        elements of the list.
+    :type strata: str, list or dict, optional
     :param show_overall: Show the Overall column. By default True. If False it will take effect only if strata is defined, otherwise ignored
     :type show_overall: bool, optional
     :param columns_labels: A dictionary defining labels for the columns. Keys should be the column name and values a string with the label. Non existing
@@ -126,11 +341,89 @@ def calculate_table_summary(df, strata=None, show_overall=True, columns_labels=N
     :param categorical_missing_level: if a categorical column has NAs, they will be replaced by the string indicated here, by default 'Missing'. That will create a new level 
         in the category. If set to None, the NAs will not be replaced.
     :type categorical_missing_level: str, optional
+    :param id_column: the name of a column in the dataframe identifying subjects, for data where one subject may have multiple records.
+        If set, categorical counts, percentages and the number of observations in the column headers count distinct subjects instead of records.
+        Numerical columns are still summarized over all records. Custom categorical functions must accept a keyword argument n with the number of
+        subjects to use as denominator.
+    :type id_column: str, optional
+    :param pooled_columns: a dictionary to add columns summarizing several strata together, for example {'All active': ['B', 'C', 'D']}. Keys 
+        are the names of the new columns and values lists of strata values (or, if strata is a list, values of the first strata column or tuples). 
+        The pooled columns are placed before the Overall column and are calculated merging the statistics already calculated for each stratum.
+    :type pooled_columns: dict, optional
+    :param where: rows to summarize, either a boolean mask with the same length as the dataframe, a string with a boolean expression 
+        that will be evaluated with pandas.DataFrame.eval (for example 'safety_pop & age > 18'), a dictionary with column names as keys and 
+        a value or list of values to keep (for example {'region': ['North', 'South']}), or an array with the integer positions of the rows. 
+        The dataframe is not copied, only the positions of the selected rows are used. By default all rows are summarized.
+    :type where: boolean array, str, dict or integer array, optional
+    :param engine: how numerical columns are calculated. With 'loop' each column is summarized on its own. With 'wide' all the 
+        float columns are taken as one 2D array and each statistic is calculated for all of them at once, which is much faster for 
+        thousands of numerical columns. Only the numerical functions included in the package can be calculated in this way, if there is any 
+        other function all columns are summarized one by one. The results are the same with both engines. The wide engine copies the 
+        float columns into one float64 array, and it is not used if that array does not fit in memory_limit. With 'auto' (default) 
+        the wide engine is used if there are at least 10 summaries of float columns to calculate together (float columns times 
+        strata cells, or the overall column without strata), or at least 2 float columns and no more than 100000 rows, unless the 
+        columns are memory-mapped or Arrow data read from disk as they are needed. By groups are calculated in parallel threads, 
+        one per core, if n_jobs is not set and there are at least 100000 rows. Chunks are only used with memory_limit, so the 
+        results do not depend on the memory of the machine. 
+        The engine used is reported in the attrs of the table summary dataframe: 'engine' is 'loop', 'wide' or 'chunked' (with 
+        'chunk_size' for the number of rows per chunk), and for by, 'n_jobs' is the number of threads.
+    :type engine: str, optional
+    :param column_types: a dictionary with column names as keys and 'categorical' or 'numerical' as values, to set the type of those
+        columns instead of detecting it.
+    :type column_types: dict, optional
+    :param by: the name of a column in the dataframe to calculate one table summary for each of its values (for example one table per 
+        study site). The dataframe is split once into contiguous groups of row positions, without copying it, and column types are 
+        detected only once for all groups.
+    :type by: str, optional
+    :param n_jobs: number of threads to calculate the by groups or the bootstrap batches in parallel. By default 1, or chosen as explained 
+        for engine 'auto'.
+    :type n_jobs: int, optional
+    :param max_levels: maximum number of levels for categorical columns, to catch identifiers or free text columns that were not
+        excluded. The number of distinct values of each categorical column is estimated with HyperLogLog, in one pass over the
+        whole column. By default there is no maximum.
+    :type max_levels: int, optional
+    :param high_cardinality: what to do with categorical columns with more than max_levels levels: 'raise' (default) raises an 
+        exception, 'skip' leaves them out of the table and 'other' shows only the max_levels most frequent levels in the 
+        summarized rows and counts the rest in a level 'Other'.
+    :type high_cardinality: str, optional
+    :param categorical_top_k: if set, categorical columns show only their categorical_top_k most frequent levels in the summarized 
+        rows and an 'Other' level counting the rest. The most frequent levels are found with a mergeable Misra-Gries summary, 
+        chunk by chunk, and then counted exactly, so levels outside the top are never counted or formatted.
+    :type categorical_top_k: int, optional
+    :param memory_limit: memory available for the calculation on top of the data, as a number of bytes or a string such as '4GB'.
+        The memory needed is estimated from the dtypes of the columns and the number of rows; if it is over the limit, categorical 
+        columns and numerical columns are summarized going through the rows in chunks and merging the accumulators of the chunks, 
+        the wide engine is not used, and quantiles are approximated with a mergeable sketch of 10000 points if a column of the 
+        table has more observations. Categorical levels with the same count may then be in a different order. Only the numerical 
+        functions included in the package can be calculated in chunks, and categorical columns with id_column are still 
+        calculated on all rows at once. Chunks have at least 1000 rows, and a limit below the 16 bytes per row needed for 
+        the cell codes and the sketches of numerical columns (up to 320KB per cell) raises an exception. By groups calculated in 
+        parallel threads share the limit. By default there is no limit.
+    :type memory_limit: int or str, optional
+    :param precision: with 'float32', numerical columns are kept in the narrowest dtype holding their values exactly: integers
+        in the narrowest integer width and float64 values as float32 if none of them changes, halving the memory read and sorted.
+        Sums, moments and quantile interpolations are still calculated in float64 (with a compensated sum), so the results are 
+        the same as with the default 'float64'. The wide engine is not used.
+    :type precision: str, optional
+    :param ci: with 'bootstrap', 95% percentile bootstrap confidence intervals are added: after the value of each categorical level
+        for its percentage if the categorical functions show percentages ('n_percent' or 'percent'), and as the rows 
+        "Mean [95% CI]" and "Median [95% CI]" for numerical columns. All the resamples of a table 
+        column are drawn at once as positions counted into weights and the statistics calculated as matrix operations, in batches 
+        spread over one pool of n_jobs threads with the resamples of all the table columns. Categorical columns with id_column get 
+        no intervals, and ci cannot be combined with memory_limit, as chunks keep only sketches of the numerical values.
+    :type ci: str, optional
+    :param n_bootstrap: number of bootstrap resamples, by default 1000
+    :type n_bootstrap: int, optional
+    :param random_state: seed for the bootstrap resamples; the intervals are the same for the same seed whatever the number of threads
+    :type random_state: int or numpy.random.Generator, optional
     :return: the table summary as a pandas dataframe
     :rtype: pandas dataframe
     :return: the number of observations for each column in the table summary as a dictionary where keys are column names (strata levels) and 
       the values are the counts as integers.
     :rtype: dictionary
+    :return: if by is set, instead of the two values above, a dictionary with the values of the by column as keys, in order of appearance,
+      and tuples of table summary and number of observations as values
+    :rtype: dictionary
         
     :Example:
     
@@ -139,96 +432,266 @@ def calculate_table_summary(df, strata=None, show_overall=True, columns_labels=N
 
     """
 
-    if categorical_functions:
-        if type(categorical_functions)==str:
-            temp = categorical_presets.get(categorical_functions)
-            if not temp:
-                raise Exception(f"categorical preset {categorical_functions} not defined!")
-            categorical_functions = temp
-        elif type(categorical_functions)==list or type(categorical_functions)==tuple:
-            if len(categorical_functions)!=2:
-                raise Exception("The length of categorical functions must be 2!")
-            if not callable(categorical_functions[0]):
-                raise Exception("The first element of categorical_functions must be a function")
-            #if not type(categorical_functions[1])==str:
-                #raise Exception("The second element of categorical_functions must be a string")
-        else:
-            raise Exception("categorical_functions should be either string, list or tuple")
-    else:
-        categorical_functions = categorical_presets["n_percent"]
+    categorical_functions, numerical_functions = get_functions(categorical_functions, numerical_functions)
+    df = as_dataframe(df)
+    if engine not in ('loop', 'wide', 'auto'):
+        raise Exception(f"Available engines are 'loop', 'wide' or 'auto', got {engine}")
+    if ci not in (None, 'bootstrap'):
+        raise Exception(f"ci must be None or 'bootstrap', got {ci}")
+    if ci is not None and memory_limit is not None:
+        raise Exception("ci='bootstrap' cannot be combined with memory_limit: the bootstrap resamples the values of numerical "
+                        "columns, and chunks keep only sketches of them")
+    if precision not in ('float64', 'float32'):
+        raise Exception(f"precision must be 'float64' or 'float32', got {precision}")
+    if high_cardinality not in ('raise', 'skip', 'other'):
+        raise Exception(f"high_cardinality must be 'raise', 'skip' or 'other', got {high_cardinality}")
 
-    if numerical_functions:
-        if type(numerical_functions)==str:
-            temp = numerical_presets.get(numerical_functions)
-            if not temp:
-                raise Exception(f"numerical preset {numerical_functions} not defined!")
-            numerical_functions = temp
-        elif type(numerical_functions)==dict:
-            if not all([callable(x) for x in numerical_functions.values()]):
-                raise Exception("The values of numerical_functions must be functions")
-            if not all([type(x)==str for x in numerical_functions.keys()]):
-                raise Exception("The keys of numerical_functions must be strings")
-        else:
-            raise Exception("numerical_functions should be either string or dict")
-    else:
-        numerical_functions = numerical_presets["meansd_medianq1q3_minmax_missing"]
+    coltypes = dict(column_types) if column_types else dict()
+    undetected = [c for c in df.columns if c not in coltypes]
+    if undetected:
+        coltypes.update(detect_df_col_types(df, columns=undetected))
 
+    if by is not None:
+        if by not in df.columns:
+            raise Exception(f"by column {by} not found in dataframe")
+        # one factorization and sort of the by column, every group is summarized from its row positions
+        selected_rows = get_selected_rows(df, where)
+        by_series = df[by] if selected_rows is None else df[by].iloc[selected_rows]
+        if by_series.isna().any():
+            raise Exception("by column may not contain missing values")
+        by_codes, by_labels = factorize_strata(df, [(by, None)], rows=selected_rows)
+        by_rows = get_cell_rows(by_codes, len(by_labels))
+        columns_exclude = list(columns_exclude or list()) + [by]
+        def summarize_group(rows):
+            return calculate_table_summary(df, strata=strata, show_overall=show_overall, columns_labels=columns_labels, 
+                    overall_name=overall_name, columns_include=columns_include, columns_exclude=columns_exclude,
+                    categorical_functions=categorical_functions, numerical_functions=numerical_functions, rounding=rounding,
+                    categorical_missing_level=categorical_missing_level, id_column=id_column, pooled_columns=pooled_columns, 
+                    where=rows, engine=engine, column_types=coltypes, max_levels=max_levels, high_cardinality=high_cardinality,
+                    categorical_top_k=categorical_top_k, memory_limit=group_memory_limit, precision=precision, ci=ci,
+                    n_bootstrap=n_bootstrap, random_state=random_state)
+        if n_jobs is None:
+            n_jobs = 1
+            if engine == 'auto' and np.count_nonzero(by_codes >= 0) >= auto_parallel_rows:
+                n_jobs = max(1, min(os.cpu_count() or 1, len(by_labels)))
+        # the groups summarized at the same time share the memory
+        group_memory_limit = memory_limit
+        if memory_limit is not None and n_jobs > 1:
+            group_memory_limit = parse_memory_size(memory_limit) // n_jobs
+        if n_jobs > 1:
+            with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+                results = list(executor.map(summarize_group, by_rows))
+        else:
+            results = [summarize_group(rows) for rows in by_rows]
+        for tonedf, strat_numbers in results:
+            tonedf.attrs['n_jobs'] = n_jobs
+        return dict(zip(by_labels, results))
 
-    coltypes = detect_df_col_types(df)
     colnames = df.columns.to_list()
-    strat_cats = list()
-    if strata is not None:
-        if any(pd.isna(df[strata])):
-            raise Exception("strata may not contain missing values")
-        if strata in coltypes and strata in colnames:
-            del coltypes[strata]
-            colnames.remove(strata)
-        else:
-            raise Exception(f"strata column {strata} not found in dataframe")
-        strat_cats = df[strata].unique()
+    strata_columns = get_strata_columns(strata)
+    for strata_column, bins in strata_columns:
+        # binned numerical columns are still summarized
+        if strata_column in colnames and bins is None:
+            del coltypes[strata_column]
+            colnames.remove(strata_column)
+    selected_rows = get_selected_rows(df, where)
+    cell_codes, cell_labels = factorize_strata(df, strata_columns, rows=selected_rows)
+    ncells = len(cell_labels)
+    cell_rows = get_cell_rows(cell_codes, ncells)
+    table_columns = get_table_columns(cell_labels, len(strata_columns), show_overall=show_overall, overall_name=overall_name)
+    if pooled_columns:
+        table_columns = add_pooled_columns(table_columns, cell_labels, pooled_columns, len(strata_columns), show_overall=show_overall)
+
+    id_codes = None
+    if id_column is not None:
+        if id_column not in colnames:
+            raise Exception(f"id_column {id_column} not found in dataframe")
+        del coltypes[id_column]
+        colnames.remove(id_column)
+        id_codes, _ = pd.factorize(df[id_column])
+        if np.any(id_codes[cell_codes >= 0] < 0):
+            raise Exception("id_column may not contain missing values")
 
     if columns_include:
         colnames = [c for c in columns_include if c in colnames]
     if columns_exclude:
         colnames = [c for c in colnames if c not in columns_exclude]
+    collapsed_columns = list()
+    if max_levels is not None:
+        for colname in [c for c in colnames if coltypes[c] == "categorical"]:
+            nlevels = estimate_distinct(df[colname])
+            if nlevels <= max_levels:
+                continue
+            if high_cardinality == 'raise':
+                raise Exception(f"column {colname} has about {nlevels} distinct values, more than max_levels ({max_levels}). Exclude it "
+                                "with columns_exclude or set high_cardinality to 'skip' or 'other'")
+            elif high_cardinality == 'skip':
+                colnames.remove(colname)
+            else:
+                collapsed_columns.append(colname)
     if not colnames:
         raise Exception("No columns left after filtering for columns_include, columns_exclude and strata")
 
-    df_list = list()
+    # number of observations (or distinct subjects) per column, used for the headers and as denominators
+    if id_codes is not None:
+        cell_numbers = count_distinct(cell_codes, id_codes, ncells)
+    else:
+        cell_numbers = np.array([len(rows) for rows in cell_rows], dtype=np.int64)
     strat_numbers = dict()
-    for colname in colnames:
-        coltype = coltypes[colname]
-        var_dict = dict()
-        if coltype == "categorical":
-            curfuns, catna = categorical_functions
-            curfuns = {'': curfuns}
-        elif coltype == "numerical":
-            curfuns = numerical_functions
+    for column_label, cells in table_columns:
+        if len(cells) == 1 or id_codes is None:
+            strat_numbers[column_label] = int(cell_numbers[cells].sum())
         else:
-            raise NotImplementedError(f"statistics for column {colname} (coltype) not implemented")
-        col_label=None
-        if columns_labels:
-            col_label = columns_labels.get(colname)
-        # overall
-        overalldf = calculate_stats(df, colname, curfuns, coltype, rounding=rounding, var_label=col_label, categorical_missing_level=categorical_missing_level)
-        # strata
-        for stratcat in strat_cats:
-            curstratdf = calculate_stats(df, colname, curfuns, coltype, strata=strata, stratcat=stratcat, rounding=rounding, var_label=col_label, categorical_missing_level=categorical_missing_level)
-            var_dict[stratcat] = curstratdf
-            strat_numbers[stratcat] = len(df.loc[df[strata]==stratcat])
-        var_dict[overall_name] = overalldf
-        strat_numbers[overall_name] = len(df)
-        var_df = pd.DataFrame(var_dict)
-        if coltype == "categorical":
-            if catna:
-                var_df = var_df.fillna(catna)
-        df_list.append(var_df)
+            column_rows = np.flatnonzero(np.isin(cell_codes, cells))
+            strat_numbers[column_label] = len(np.unique(id_codes[column_rows]))
 
-    tonedf = pd.concat(df_list)
+    nrows = len(df) if selected_rows is None else len(selected_rows)
+    wide_columns = list()
+    wide_dicts = dict()
+    if engine in ('wide', 'auto') and precision == 'float64' and ci is None:
+        wide_columns = get_wide_columns(df, colnames, coltypes, numerical_functions)
+    if engine == 'auto' and wide_columns:
+        # the wide engine copies the float columns into one float64 block: it is used for enough summaries 
+        # calculated at once, cells being calculated together and merged columns from the accumulators of the cells,
+        # and not for columns read from disk as they are needed (memory-mapped or Arrow data)
+        nsummaries = len(wide_columns) * len([cells for column_label, cells in table_columns if len(cells) == 1])
+        if nsummaries < auto_wide_columns and (len(wide_columns) < 2 or nrows > auto_wide_rows):
+            wide_columns = list()
+        elif any([is_mapped(df[c].to_numpy()) for c in wide_columns]):
+            wide_columns = list()
 
-    if not show_overall and strata:
-        tonedf = tonedf.drop(columns=overall_name)
-        del strat_numbers[overall_name]
+    # rows per chunk if the calculation in memory would go over memory_limit
+    chunk_size = None
+    if memory_limit is not None:
+        limit = parse_memory_size(memory_limit)
+        row_bytes = max([estimate_row_bytes(df[c].dtype, coltypes[c]) for c in colnames])
+        if any([fun not in numerical_formatters for fun in numerical_functions.values()]):
+            # the full series is rebuilt for other functions
+            row_bytes += 16
+        # cell codes and the positions of the rows of each cell are needed for all rows
+        fixed_bytes = 16 * len(df)
+        if wide_columns and fixed_bytes + 16 * len(wide_columns) * nrows > limit:
+            # the 2D block of the wide columns and its subsets for the table columns do not fit, 
+            # the columns are summarized one by one
+            wide_columns = list()
+        if fixed_bytes + row_bytes * nrows > limit:
+            numerical_columns = [c for c in colnames if coltypes[c] == "numerical"]
+            if numerical_columns and any([fun not in numerical_formatters for fun in numerical_functions.values()]):
+                raise Exception(f"the table summary needs more than memory_limit ({memory_limit}) and only the numerical functions "
+                                "included in the package can be calculated in chunks")
+            # the accumulators of every cell are kept across chunks: for numerical columns a sketch of up to 10000 of its
+            # values (value and weight) merged with the sketch of each chunk
+            cell_bytes = 0
+            if numerical_columns:
+                cell_bytes = 2 * 16 * int(np.minimum([len(rows) for rows in cell_rows], 10000).sum())
+            if limit <= fixed_bytes + cell_bytes:
+                raise Exception(f"memory_limit ({memory_limit}) is not enough for the cell codes of {len(df)} rows and the "
+                                f"accumulators of {ncells} cells, which need {fixed_bytes + cell_bytes} bytes on top of the chunks")
+            chunk_size = max(min_chunk_size, int((limit - fixed_bytes - cell_bytes) // (2 * row_bytes)))
+            wide_columns = list()
+    if wide_columns:
+        wide_dicts = summarize_wide(df, wide_columns, table_columns, cell_rows, numerical_functions,
+                columns_labels=columns_labels, rounding=rounding)
 
-    return tonedf, strat_numbers
+    if ci is not None:
+        if isinstance(random_state, np.random.Generator):
+            random_state = int(random_state.integers(2**63))
+        seeds = np.random.SeedSequence(random_state).spawn(len(colnames))
+        ci_jobs = n_jobs
+        if ci_jobs is None:
+            ci_jobs = (os.cpu_count() or 1) if engine == 'auto' else 1
+    # one pool for the bootstrap resamples of all the columns
+    pool = ThreadPoolExecutor(max_workers=ci_jobs) if ci is not None and ci_jobs > 1 else nullcontext()
+    with pool as executor:
+        df_list = list()
+        for colindx, colname in enumerate(colnames):
+            if colname in wide_dicts:
+                df_list.append((wide_dicts[colname], None))
+                continue
+            coltype = coltypes[colname]
+            var_dict = dict()
+            accumulators = list()
+            curfuns, catna = get_column_functions(coltype, categorical_functions, numerical_functions)
+            col_label=None
+            if columns_labels:
+                col_label = columns_labels.get(colname)
+            coldf = df
+            top_k = categorical_top_k if coltype == "categorical" else None
+            if colname in collapsed_columns:
+                top_k = max_levels if top_k is None else min(top_k, max_levels)
+            missing_level = categorical_missing_level
+            if top_k:
+                original = df[colname]
+                collapsed = collapse_levels(original, top_k, rows=selected_rows)
+                coldf = pd.DataFrame({colname: collapsed}, copy=False)
+                if collapsed is not original:
+                    # collapsed columns have a missing level only if some selected rows are missing
+                    codes = collapsed.cat.codes.to_numpy()
+                    if not (codes < 0 if selected_rows is None else codes[selected_rows] < 0).any():
+                        missing_level = None
+            if id_codes is not None and coltype == "categorical":
+                # keep one record per subject and level, every column is calculated on its own rows
+                # as distinct counts cannot be added across cells
+                level_codes, _ = pd.factorize(coldf[colname])
+                cell_distinct_rows = first_occurrences(cell_codes, id_codes, level_codes)
+                for column_label, cells in table_columns:
+                    if len(cells) == 1:
+                        rows = cell_distinct_rows[cell_codes[cell_distinct_rows] == cells[0]]
+                    else:
+                        column_rows = np.flatnonzero(np.isin(cell_codes, cells))
+                        rows = column_rows[first_occurrences(id_codes[column_rows], level_codes[column_rows])]
+                    curseries = get_series(coldf, colname, coltype, rows=rows, categorical_missing_level=missing_level)
+                    var_dict[column_label] = calculate_stats(curseries, colname, curfuns, coltype, n=strat_numbers[column_label],
+                            rounding=rounding, var_label=col_label)
+            elif coltype == "categorical" or isinstance(df[colname].dtype, pd.SparseDtype) or chunk_size or precision == 'float32':
+                # level counts for all cells in one pass, missing values counted without filling a copy of the column,
+                # sparse numerical columns from their stored values and fill value counts, any other column in chunks
+                # of rows over the memory limit and numerical columns in narrow dtypes for float32 precision
+                sparse = isinstance(df[colname].dtype, pd.SparseDtype)
+                if chunk_size and not sparse:
+                    accumulators = chunked_accumulators(coldf[colname], coltype, cell_codes, ncells, chunk_size,
+                            categorical_missing_level=missing_level)
+                elif coltype == "numerical" and not sparse:
+                    accumulators = narrow_numerical_accumulators(df[colname], cell_rows)
+                elif coltype == "categorical":
+                    accumulators = categorical_accumulators(coldf[colname], cell_codes, ncells, categorical_missing_level=missing_level)
+                else:
+                    accumulators = sparse_numerical_accumulators(df[colname], cell_codes, ncells)
+                if not strata_columns:
+                    # no cells if no rows are selected
+                    acc = accumulators[0] if accumulators else empty_accumulator(coltype)
+                    var_dict[overall_name] = calculate_stats(acc, colname, curfuns, coltype, rounding=rounding, var_label=col_label)
+                else:
+                    for cellindx, acc in enumerate(accumulators):
+                        var_dict[cell_labels[cellindx]] = calculate_stats(acc, colname, curfuns, coltype, rounding=rounding, var_label=col_label)
+            elif not strata_columns:
+                curseries = get_series(df, colname, coltype, rows=selected_rows, categorical_missing_level=missing_level)
+                var_dict[overall_name] = calculate_stats(curseries, colname, curfuns, coltype, rounding=rounding, var_label=col_label)
+                if ci is not None and ncells:
+                    accumulators.append(accumulate(curseries, coltype))
+            else:
+                # cells are calculated from the data, other columns by merging the accumulators of their cells
+                for cellindx, rows in enumerate(cell_rows):
+                    curseries = get_series(df, colname, coltype, rows=rows, categorical_missing_level=missing_level)
+                    var_dict[cell_labels[cellindx]] = calculate_stats(curseries, colname, curfuns, coltype, rounding=rounding, var_label=col_label)
+                    accumulators.append(accumulate(curseries, coltype))
+            var_dict = summarize_accumulators(var_dict, accumulators, table_columns, colname, curfuns, coltype,
+                    var_label=col_label, rounding=rounding)
+            # categorical intervals are for percentages, not for counts or custom functions
+            if ci is not None and not (coltype == "categorical" and (id_codes is not None or
+                    not all([fun in percentage_functions for fun in curfuns.values()]))):
+                var_dict = add_bootstrap_ci(var_dict, accumulators, table_columns, colname, coltype, var_label=col_label, rounding=rounding,
+                        n_bootstrap=n_bootstrap, seed=seeds[colindx], executor=executor)
+            df_list.append((var_dict, catna))
 
+    builder = SummaryFrameBuilder([column_label for column_label, cells in table_columns])
+    for var_dict, catna in df_list:
+        builder.add_variable(var_dict, catna)
+    tonedf = builder.build()
+    if chunk_size:
+        tonedf.attrs['engine'] = 'chunked'
+        tonedf.attrs['chunk_size'] = chunk_size
+    else:
+        tonedf.attrs['engine'] = 'wide' if wide_columns else 'loop'
+
+    return tonedf, strat_numbers
@@ -14,6 +14,7 @@
 # limitations under the License.
 # #############################################################################
 import datetime
+import os
 
 import pandas as pd
 import numpy as np
@@ -28,27 +29,131 @@ datetime_types = {datetime.datetime, np.datetime64, np.dtype('<M8[ns]'), np.date
 categorical_types = {pd.core.dtypes.dtypes.CategoricalDtype, bool}
 
 
-def detect_df_col_types(df):
+def as_dataframe(data):
+    """
+    Gets the data to summarize as a pandas dataframe without copying the columns where possible.
+
+    :param data: a pandas dataframe, a numpy structured array (or memmap) with named fields, a 2D numpy array (or memmap),
+        a pyarrow Table or RecordBatch, or the path to an Arrow IPC/Feather file, which is memory-mapped. Numerical columns 
+        without missing values of uncompressed Arrow data and numpy fields are not copied, the operating system reads 
+        them from disk as they are needed.
+    :return: pandas dataframe
+    """
+    if isinstance(data, pd.DataFrame):
+        return data
+    if isinstance(data, np.ndarray):
+        if data.dtype.names:
+            return pd.DataFrame({name: data[name] for name in data.dtype.names}, copy=False)
+        if data.ndim == 2:
+            return pd.DataFrame(data, copy=False)
+        raise Exception("numpy arrays to summarize must be structured arrays or 2D arrays")
+    if isinstance(data, (str, os.PathLike)):
+        try:
+            import pyarrow as pa
+            import pyarrow.ipc
+        except ImportError:
+            raise Exception("reading Arrow IPC/Feather files needs the pyarrow package")
+        data = pa.ipc.open_file(pa.memory_map(os.fspath(data))).read_all()
+    if type(data).__module__.startswith('pyarrow') and hasattr(data, 'to_pandas'):
+        # each column in its own block so that numerical columns are not copied
+        return data.to_pandas(split_blocks=True, types_mapper=arrow_types_mapper)
+    raise Exception(f"data of type {type(data).__name__} cannot be summarized")
+
+def arrow_types_mapper(pa_type):
+    """
+    Types mapper for converting Arrow data to pandas. Strings and binaries stay in their Arrow buffers as pyarrow backed
+    columns instead of becoming python objects. Numbers get numpy dtypes (without a copy if there are no missing values),
+    dictionaries become pandas categoricals, booleans numpy booleans and dates and timestamps numpy datetimes, as by default.
+    """
+    import pyarrow as pa
+    if pa.types.is_string(pa_type) or pa.types.is_large_string(pa_type) or pa.types.is_binary(pa_type) or pa.types.is_large_binary(pa_type):
+        return pd.ArrowDtype(pa_type)
+    return None
+
+def get_dtype_col_type(dtype):
+    """
+    Gets the column type (categorical, numerical or datetime) from a column dtype, based on the
+    dtype kind for numpy and pandas extension dtypes and on the Arrow type for pyarrow backed dtypes.
+    Returns None for object columns, for which the values have to be inspected.
+    """
+    if isinstance(dtype, pd.ArrowDtype):
+        import pyarrow as pa
+        pa_type = dtype.pyarrow_dtype
+        if pa.types.is_integer(pa_type) or pa.types.is_floating(pa_type) or pa.types.is_decimal(pa_type):
+            return "numerical"
+        if pa.types.is_temporal(pa_type):
+            return "datetime"
+        # strings, dictionaries and booleans
+        return "categorical"
+    if dtype == object:
+        return None
+    if dtype in datetime_types:
+        return "datetime"
+    if dtype.kind in 'iuf':
+        # numpy and nullable integers and floats of any size
+        return "numerical"
+    return "categorical"
+
+def get_numerical_values(curseries):
+    """
+    Gets the values of a numerical series as a numpy array. numpy columns are not copied. Missing values in
+    nullable and pyarrow backed columns become NaN, integers without missing values stay integers, and pyarrow
+    columns are converted from their Arrow buffers (decimals as floats) without going through python objects.
+    Sparse columns are densified, the table summary uses sparse_numerical_accumulators for them instead.
+    """
+    dtype = curseries.dtype
+    if isinstance(dtype, pd.SparseDtype):
+        curseries = curseries.sparse.to_dense()
+        dtype = curseries.dtype
+    if isinstance(dtype, np.dtype):
+        if dtype.kind in 'iuf':
+            return curseries.to_numpy()
+        return curseries.to_numpy(dtype=np.float64, na_value=np.nan)
+    if isinstance(dtype, pd.ArrowDtype):
+        import pyarrow as pa
+        values = pa.array(curseries.array)
+        if pa.types.is_decimal(values.type):
+            values = values.cast(pa.float64())
+        return values.to_numpy(zero_copy_only=False)
+    if dtype.kind in 'iuf' and not curseries.hasnans:
+        return curseries.to_numpy(dtype=dtype.numpy_dtype)
+    return curseries.to_numpy(dtype=np.float64, na_value=np.nan)
+
+def get_masked_numerical_values(curseries):
+    """
+    Gets the values of a numerical series as a numpy array and a boolean numpy array flagging the missing values.
+    Unlike get_numerical_values, nullable and pyarrow backed integers with missing values stay integers (with 0
+    at the missing positions) so their minimum and maximum are formatted as integers, as for the series.
+    """
+    dtype = curseries.dtype
+    if not isinstance(dtype, (np.dtype, pd.SparseDtype)) and dtype.kind in 'iu' and curseries.hasnans:
+        missing = curseries.isna().to_numpy()
+        return curseries.to_numpy(dtype=dtype.numpy_dtype, na_value=0), missing
+    values = get_numerical_values(curseries)
+    return values, pd.isna(values)
+
+def detect_df_col_types(df, columns=None):
     """
     Gets a dataframe and returns a dictionary with keys being column 
     names from the dataframe and value is the type:
-    categorical, numerical or datetime
+    categorical, numerical or datetime.
+    If columns is not None, only those columns are checked.
     """
 
     types = df.dtypes.values.tolist()
-    columns = df.columns.values.tolist()
+    columns_all = df.columns.values.tolist()
+    if columns is None:
+        columns = columns_all
+    else:
+        dtypes = dict(zip(columns_all, types))
+        types = [dtypes[c] for c in columns]
 
     results = dict()
     for colname, coltype in zip(columns, types):
-        if coltype in categorical_types:
-            results[colname] = "categorical"
-            continue
-        elif coltype in numeric_types:
-            results[colname] = "numerical"
-            continue
-        elif coltype in datetime_types:
-            results[colname] = "datetime"
-        elif coltype == object:
+        dtype_col_type = get_dtype_col_type(coltype)
+        if dtype_col_type is not None:
+            results[colname] = dtype_col_type
+        else:
             col = df[colname].dropna()
             if len(col):
                 curtype = type(col.iloc[0])
@@ -71,8 +176,140 @@ def detect_df_col_types(df):
                 results[colname] = "datetime"
             else:
                 results[colname] = "categorical"
-        else:
-            results[colname] = "categorical"
 
     return results
 
+
+def estimate_distinct(curseries, precision=12):
+    """
+    Estimates the number of distinct non missing values of a series with HyperLogLog on the hashes of the values,
+    in one vectorized pass and with 2**precision registers (relative error about 1.04/sqrt(2**precision), 1.6% by default). 
+    For categorical series the number of categories is returned.
+    """
+    if curseries.dtype.name == 'category':
+        return len(curseries.cat.categories)
+    if isinstance(curseries.dtype, pd.SparseDtype):
+        # stored values plus the fill value
+        nfill = 0 if pd.isna(curseries.dtype.fill_value) else 1
+        return estimate_distinct(pd.Series(curseries.array.sp_values), precision=precision) + nfill
+    hashes = pd.util.hash_pandas_object(curseries.dropna(), index=False).to_numpy()
+    if not len(hashes):
+        return 0
+    nregisters = 1 << precision
+    registers = np.zeros(nregisters, dtype=np.int64)
+    indexes = (hashes >> np.uint64(64 - precision)).astype(np.int64)
+    rest = hashes << np.uint64(precision)
+    # position of the first set bit of the rest of the hash
+    ranks = np.full(len(rest), 64 - precision + 1, dtype=np.int64)
+    nonzero = rest > 0
+    ranks[nonzero] = 64 - np.floor(np.log2(rest[nonzero].astype(np.float64))).astype(np.int64)
+    ranks = np.clip(ranks, 1, 64 - precision + 1)
+    np.maximum.at(registers, indexes, ranks)
+    alpha = 0.7213 / (1 + 1.079 / nregisters)
+    estimate = alpha * nregisters**2 / np.sum(2.0**-registers)
+    nzeros = np.count_nonzero(registers == 0)
+    if estimate <= 2.5 * nregisters and nzeros:
+        # linear counting for small cardinalities
+        estimate = nregisters * np.log(nregisters / nzeros)
+    return int(round(estimate))
+
+memory_units = {'B': 1, 'KB': 1024, 'MB': 1024**2, 'GB': 1024**3, 'TB': 1024**4}
+
+def parse_memory_size(size):
+    """
+    Gets a number of bytes from an integer or a string with a number and a unit, for example '4GB' or '512 MB'
+    (units are powers of 1024)
+    """
+    if isinstance(size, (int, np.integer)):
+        return int(size)
+    if type(size) == str:
+        value = size.strip().upper()
+        for unit in sorted(memory_units, key=len, reverse=True):
+            if value.endswith(unit):
+                try:
+                    return int(float(value[:-len(unit)]) * memory_units[unit])
+                except ValueError:
+                    break
+    raise Exception(f"memory size must be a number of bytes or a string such as '4GB', got {size}")
+
+def narrow_values(values, block_size=65536):
+    """
+    Converts a numpy array of numbers to the narrowest dtype holding all of them exactly: the narrowest integer width 
+    for integers, float32 for float64 values if no value changes. Otherwise the values are returned unchanged.
+    float64 values are checked on a sample first and then converted block by block, stopping at the first block
+    with a value that changes, so columns that do not fit in float32 are not copied.
+    """
+    if values.dtype.kind in 'iu':
+        if not len(values):
+            return values
+        minimum, maximum = values.min(), values.max()
+        if minimum >= 0:
+            return values.astype(np.min_scalar_type(maximum), copy=False)
+        for dtype in (np.int8, np.int16, np.int32):
+            if np.iinfo(dtype).min <= minimum and maximum <= np.iinfo(dtype).max:
+                return values.astype(dtype)
+        return values
+    if values.dtype == np.float64:
+        sample = values[::max(1, len(values) // 1000)]
+        with np.errstate(over='ignore'):
+            if not np.array_equal(sample.astype(np.float32), sample, equal_nan=True):
+                return values
+            narrow = np.empty(len(values), dtype=np.float32)
+            for start in range(0, len(values), block_size):
+                block = values[start:start+block_size]
+                narrow[start:start+block_size] = block
+                if not np.array_equal(narrow[start:start+block_size], block, equal_nan=True):
+                    return values
+        return narrow
+    return values
+
+def estimate_row_bytes(dtype, coltype):
+    """
+    Estimates the number of bytes per row needed to summarize a column with dtype in memory, on top of the 
+    column itself: copies of the values of each cell and the sorted values for numerical columns, level codes and 
+    (cell, level) keys for categorical ones.
+    """
+    if isinstance(dtype, pd.SparseDtype):
+        # only the stored values are used, taken as dense as an upper bound
+        dtype = dtype.subtype
+    if coltype == "numerical":
+        itemsize = dtype.itemsize if isinstance(dtype, np.dtype) else 8
+        return itemsize + 24
+    if dtype.name == 'category':
+        return 32
+    return 40
+
+def is_mapped(values):
+    """
+    Whether the numpy array values is a view of memory not allocated by numpy, as a memmap or the buffer of 
+    Arrow data, so that its pages are read from disk (or shared) as they are needed instead of being in memory.
+    """
+    while isinstance(values, np.ndarray):
+        if isinstance(values, np.memmap):
+            return True
+        if values.base is None:
+            return False
+        values = values.base
+    return True
+
+def first_occurrences(*codes):
+    """
+    Gets one or more integer code arrays of the same length (for example strata,
+    subject id and categorical level codes as returned by pandas.factorize) and
+    returns the sorted positions of the first row for each distinct combination of codes.
+    """
+    keys = pd.DataFrame({indx: code for indx, code in enumerate(codes)}, copy=False)
+    return np.flatnonzero(~keys.duplicated().to_numpy())
+
+def count_distinct(group_codes, id_codes, ngroups):
+    """
+    Counts the number of distinct ids in each group in one pass.
+
+    :param group_codes: integer array with the group (for example stratum) for each row, rows with negative codes are ignored
+    :param id_codes: integer array with the id for each row
+    :param ngroups: number of groups
+    :return: integer array of length ngroups with the number of distinct ids per group
+    """
+    first = first_occurrences(group_codes, id_codes)
+    first_groups = group_codes[first]
+    return np.bincount(first_groups[first_groups >= 0], minlength=ngroups)
@@ -0,0 +1,167 @@
+# #############################################################################
+# Copyright 2024 F. Hoffmann-La Roche
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# #############################################################################
+"""
+Wide engine: summarises many float columns at once, computing every statistic
+for all the columns with one numpy call per table column.
+"""
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from . import summary_fun as sf
+from .accumulators import NumericalAccumulator, merge_accumulators, numerical_formatters
+
+
+class BlockStats:
+    """
+    Statistics for every column of a 2D block of values (rows x columns), calculated
+    on demand along axis 0 ignoring NaNs.
+    """
+    def __init__(self, block):
+        self.block = block
+        self.cache = dict()
+
+    def _get(self, name, fun, shape=()):
+        if name not in self.cache:
+            if not len(self.block):
+                # no rows, statistics are NaN as for an empty series
+                self.cache[name] = np.full(shape + self.block.shape[1:], np.nan)
+            else:
+                with warnings.catch_warnings():
+                    # all NaN or too short columns give NaN, as the series functions do
+                    warnings.simplefilter("ignore", category=RuntimeWarning)
+                    self.cache[name] = fun()
+        return self.cache[name]
+
+    def nmissing(self):
+        # python integers, as the counts of the series functions, so that percentages are rounded the same way
+        return [int(n) for n in np.isnan(self.block).sum(axis=0)]
+
+    def mean(self):
+        return self._get('mean', lambda: np.nanmean(self.block, axis=0))
+
+    def std(self):
+        return self._get('std', lambda: np.nanstd(self.block, axis=0, ddof=1))
+
+    def median(self):
+        return self._get('median', lambda: np.nanmedian(self.block, axis=0))
+
+    def quartiles(self):
+        return self._get('quartiles', lambda: np.nanpercentile(self.block, [25, 75], axis=0), shape=(2,))
+
+    def minimum(self):
+        return self._get('minimum', lambda: np.nanmin(self.block, axis=0))
+
+    def maximum(self):
+        return self._get('maximum', lambda: np.nanmax(self.block, axis=0))
+
+
+def wide_mean_sd(stats, rounding):
+    return [sf.format_mean_sd(m, s, rounding) for m, s in zip(stats.mean(), stats.std())]
+
+def wide_median_iqr(stats, rounding):
+    q1, q3 = stats.quartiles()
+    return [sf.format_median_iqr(m, a, b, rounding) for m, a, b in zip(stats.median(), q1, q3)]
+
+def wide_median_q1q3(stats, rounding):
+    q1, q3 = stats.quartiles()
+    return [sf.format_median_q1q3(m, a, b, rounding) for m, a, b in zip(stats.median(), q1, q3)]
+
+def wide_min_max(stats, rounding):
+    return [sf.format_min_max(a, b, rounding) for a, b in zip(stats.minimum(), stats.maximum())]
+
+def wide_missing(stats, rounding):
+    total = len(stats.block)
+    return [sf.format_missing(n, total, rounding) for n in stats.nmissing()]
+
+wide_formatters = {
+        sf.numerical_mean_sd: wide_mean_sd,
+        sf.numerical_median_iqr: wide_median_iqr,
+        sf.numerical_median_q1q3: wide_median_q1q3,
+        sf.numerical_min_max: wide_min_max,
+        sf.numerical_missing: wide_missing,
+}
+
+def get_wide_columns(df, colnames, coltypes, numerical_functions):
+    """
+    Returns the columns in colnames that can be summarized with the wide engine: numerical columns
+    with a numpy float dtype, if all numerical functions have a vectorized version.
+    """
+    if not all([fun in wide_formatters for fun in numerical_functions.values()]):
+        return list()
+    return [c for c in colnames if coltypes[c] == "numerical" and df[c].dtype.kind == 'f' and isinstance(df[c].dtype, np.dtype)]
+
+def merged_formatted(block, cells, cell_rows, cell_accumulators, functions, rounding):
+    """
+    Formats the functions for a table column with several cells from the merged accumulators of its cells,
+    the accumulators of every cell are calculated once and kept in cell_accumulators.
+
+    :return: list with, for every function, the list of formatted values of the columns of the block
+    """
+    merged = list()
+    for colindx in range(block.shape[1]):
+        accumulators = list()
+        for cell in cells:
+            if (cell, colindx) not in cell_accumulators:
+                values = block[cell_rows[cell], colindx]
+                missing = np.isnan(values)
+                cell_accumulators[(cell, colindx)] = NumericalAccumulator.from_values(values[~missing], int(missing.sum()))
+            accumulators.append(cell_accumulators[(cell, colindx)])
+        merged.append(merge_accumulators(accumulators))
+    return [[numerical_formatters[fun](acc, rounding) for acc in merged] for fun in functions.values()]
+
+def summarize_wide(df, colnames, table_columns, cell_rows, functions, columns_labels=None, rounding=1):
+    """
+    Summarizes the float columns colnames of df as one 2D array. Table columns with one cell are calculated
+    on the subset of rows of the block, giving the same values as the series functions, and table columns with 
+    several cells by merging the accumulators of their cells, as the loop engine does.
+
+    :param table_columns: list of table columns, as returned by get_table_columns
+    :param cell_rows: list with the positions of the rows for each cell
+    :param functions: dictionary of labels and numerical functions, all of them in wide_formatters
+    :return: dictionary with, for every column in colnames, a dictionary of table column labels and series with one
+        value per function, as calculate_stats returns them
+    """
+    # the block is column major, so reductions along axis 0 go through contiguous columns
+    block = np.asfortranarray(df[colnames].to_numpy(dtype=np.float64))
+    results = dict()
+    cell_accumulators = dict()
+    for column_label, cells in table_columns:
+        if len(cells) > 1:
+            formatted = merged_formatted(block, cells, cell_rows, cell_accumulators, functions, rounding)
+        else:
+            colrows = cell_rows[cells[0]] if cells else np.array([], dtype=np.int64)
+            if len(colrows) == len(block):
+                stats = BlockStats(block)
+            else:
+                # the subset is also column major: sums along a strided column are added in a different order
+                stats = BlockStats(np.asfortranarray(block[colrows]))
+            formatted = [wide_formatters[fun](stats, rounding) for fun in functions.values()]
+        # one row per column and function, columns first
+        results[column_label] = np.array([x for values in zip(*formatted) for x in values], dtype=object)
+
+    # the index is built once and sliced for every column
+    nfuns = len(functions)
+    labels = [str(columns_labels.get(c) or c) if columns_labels else str(c) for c in colnames]
+    index = pd.MultiIndex.from_arrays([np.repeat(labels, nfuns), [str(x) for x in functions.keys()] * len(colnames)])
+    var_dicts = dict()
+    for indx, colname in enumerate(colnames):
+        rows = slice(indx*nfuns, (indx+1)*nfuns)
+        colindex = index[rows]
+        var_dicts[colname] = {column_label: pd.Series(values[rows], index=colindex, copy=False)
+                              for column_label, values in results.items()}
+    return var_dicts
@@ -40,6 +40,7 @@ setup(
     long_description=long_description,
     long_description_content_type="text/markdown",
     install_requires=['pandas>=2.0.0', 'great-tables>=0.11.0', 'jinja2'],
+    extras_require={'duckdb': ['duckdb']},
     classifiers=[
         "Programming Language :: Python",
         "License :: OSI Approved :: Apache Software License",
@@ -19,6 +19,8 @@ import unittest
 import os
 import sys
 import shutil
+import tempfile
+import sqlite3
 import pickle
 
 import pandas as pd
@@ -59,6 +61,559 @@ class TestBasic(unittest.TestCase):
         sum_table_html_test = self.test_data['summary_table_gt'] 
         self.assertTrue(sum_table_html==sum_table_html_test)
 
+    def test_id_column(self):
+        df = pd.DataFrame({'id': [1, 1, 2, 3, 3, 4],
+                   'medication': ['A', 'B', 'A', 'A', 'B', 'B'],
+                   'group': ['Control', 'Control', 'Experimental', 'Experimental', 'Experimental', 'Control',]})
+        # repeated records for the same subject must not change the result
+        df = pd.concat([df, df])
+        sum_table, strat_nums = pysummaries.calculate_table_summary(df, strata='group', id_column='id')
+        self.assertEqual(strat_nums, {'Control': 2, 'Experimental': 2, 'Overall': 4})
+        self.assertEqual(sum_table.loc[('medication', 'A'), 'Experimental'], '2 (100.0 %)')
+        self.assertEqual(sum_table.loc[('medication', 'B'), 'Overall'], '3 (75.0 %)')
+        self.assertFalse('id' in sum_table.index.get_level_values(0))
+
+    def test_multiple_strata(self):
+        df = self.sample_data.dropna()
+        sum_table, strat_nums = pysummaries.calculate_table_summary(df, strata=['group', 'gender'])
+        self.assertTrue(isinstance(sum_table.columns, pd.MultiIndex))
+        self.assertEqual(strat_nums[('Control', 'Overall')], len(df[df.group=='Control']))
+        self.assertEqual(strat_nums[('', 'Overall')], len(df))
+        # cells and marginals must be the same as stratifying the subset by one column
+        control_table, _ = pysummaries.calculate_table_summary(df[df.group=='Control'], strata='gender', columns_exclude=['group'])
+        for col in control_table.columns:
+            self.assertTrue(sum_table[('Control', col)].equals(control_table[col]))
+        overall_table, _ = pysummaries.calculate_table_summary(df, strata='group', columns_exclude=['gender'])
+        self.assertTrue(sum_table[('', 'Overall')].equals(overall_table['Overall']))
+        # without strata there is only the overall column
+        sum_table, strat_nums = pysummaries.calculate_table_summary(df)
+        self.assertEqual(sum_table.columns.to_list(), ['Overall'])
+        self.assertEqual(strat_nums, {'Overall': len(df)})
+
+    def test_pooled_columns(self):
+        df = self.sample_data.copy()
+        df['arm'] = ['A', 'B', 'C', 'D'] * 25 + ['A']
+        sum_table, strat_nums = pysummaries.calculate_table_summary(df, strata='arm', columns_exclude=['group'],
+                pooled_columns={'All active': ['B', 'C', 'D']})
+        self.assertEqual(sum_table.columns.to_list(), ['A', 'B', 'C', 'D', 'All active', 'Overall'])
+        active = df[df.arm != 'A']
+        active_table, active_nums = pysummaries.calculate_table_summary(active, strata='arm', columns_exclude=['group'])
+        self.assertEqual(strat_nums['All active'], active_nums['Overall'])
+        self.assertTrue(sum_table.loc[active_table.index, 'All active'].equals(active_table['Overall']))
+        with self.assertRaises(Exception):
+            pysummaries.calculate_table_summary(df, strata='arm', pooled_columns={'All active': ['B', 'E']})
+
+    def test_binned_strata(self):
+        df = self.sample_data.dropna()
+        columns_before = df.columns.to_list()
+        sum_table, strat_nums = pysummaries.calculate_table_summary(df, strata={'age': [20, 40, 60, 80]})
+        self.assertEqual(df.columns.to_list(), columns_before)
+        self.assertEqual(list(strat_nums.keys()), ['[20, 40)', '[40, 60)', '[60, 80]', 'Overall'])
+        self.assertEqual(strat_nums['[60, 80]'], ((df.age >= 60) & (df.age <= 80)).sum())
+        df2 = df.copy()
+        df2['band'] = pd.cut(df2.age, [20, 40, 60, 80], right=False).astype(str)
+        band_table, _ = pysummaries.calculate_table_summary(df2, strata='band', columns_exclude=['age'])
+        self.assertTrue(sum_table.loc['gender', '[20, 40)'].equals(band_table.loc['gender', '[20, 40)']))
+        with self.assertRaises(Exception):
+            pysummaries.calculate_table_summary(df, strata={'age': [30, 40]})
+
+    def test_where(self):
+        df = self.sample_data
+        mask = df.age > 40
+        for strata in ['group', None]:
+            sum_table_test, strat_nums_test = pysummaries.calculate_table_summary(df[mask], strata=strata)
+            for where in [mask, 'age > 40', np.flatnonzero(mask)]:
+                sum_table, strat_nums = pysummaries.calculate_table_summary(df, strata=strata, where=where)
+                self.assertTrue(sum_table.equals(sum_table_test))
+                self.assertEqual(strat_nums, strat_nums_test)
+            # no selected rows
+            sum_table, strat_nums = pysummaries.calculate_table_summary(df, strata=strata, where=np.zeros(len(df), dtype=bool))
+            self.assertEqual(strat_nums, {'Overall': 0})
+        with self.assertRaises(Exception):
+            pysummaries.calculate_table_summary(df, strata='group', where=mask[:10])
+
+    def test_summary_index(self):
+        # integers and nullable integers with missing values keep integer minimum, maximum and quantiles
+        rows = np.arange(len(self.sample_data))
+        df = self.sample_data.assign(visits=rows % 5, doses=pd.array(np.where(rows % 7 == 0, None, rows % 4), dtype='Int64'))
+        index = pysummaries.SummaryIndex(df)
+        for strata in ['group', None]:
+            for where in [None, {'gender': 'Male'}, {'region': ['North', 'South'], 'group': 'Control'}]:
+                sum_table_test, strat_nums_test = pysummaries.calculate_table_summary(df, strata=strata, where=where)
+                sum_table, strat_nums = index.calculate_table_summary(strata=strata, where=where)
+                self.assertTrue(sum_table.equals(sum_table_test))
+                self.assertEqual(strat_nums, strat_nums_test)
+
+    def test_wide_engine(self):
+        df = self.sample_data.copy()
+        df['weight'] = np.linspace(50, 90, len(df))
+        for strata in ['group', None]:
+            sum_table_test, strat_nums_test = pysummaries.calculate_table_summary(df, strata=strata)
+            sum_table, strat_nums = pysummaries.calculate_table_summary(df, strata=strata, engine='wide')
+            self.assertTrue(sum_table.equals(sum_table_test))
+            self.assertEqual(strat_nums, strat_nums_test)
+        # half way percentages and sums depending on the order of the additions must be the same as with the loop engine
+        rng = np.random.default_rng(0)
+        df = pd.DataFrame({'a': rng.normal(size=2000), 'b': rng.normal(size=2000), 'group': rng.choice(['x', 'y', 'z'], 2000)})
+        df.loc[:1588, 'a'] = np.nan
+        for strata in ['group', None]:
+            for rounding in [1, None]:
+                sum_table_test, strat_nums_test = pysummaries.calculate_table_summary(df, strata=strata, engine='loop', rounding=rounding)
+                sum_table, strat_nums = pysummaries.calculate_table_summary(df, strata=strata, engine='wide', rounding=rounding)
+                self.assertTrue(sum_table.equals(sum_table_test))
+        self.assertEqual(sum_table.loc[('a', 'Missing'), 'Overall'], '1589 (79.45 %)')
+
+    def test_summarize_long(self):
+        df = self.sample_data.copy()
+        df['id'] = np.arange(len(df))
+        long_df = df.melt(id_vars=['id', 'group'], value_vars=['gender', 'age', 'region'], var_name='parameter', value_name='value')
+        long_df = long_df.sample(frac=1, random_state=0)
+        sum_table_test, strat_nums_test = pysummaries.calculate_table_summary(df, strata='group', columns_exclude=['id'])
+        sum_table, strat_nums = pysummaries.summarize_long(long_df, 'parameter', 'value', strata='group', id_column='id',
+                columns_include=['gender', 'age', 'region'])
+        self.assertTrue(sum_table.equals(sum_table_test))
+        self.assertEqual(strat_nums, strat_nums_test)
+        with self.assertRaises(Exception):
+            pysummaries.summarize_long(long_df, 'parameter', 'value', strata='group')
+
+    def test_by_groups(self):
+        df = self.sample_data.dropna(subset=['region'])
+        for n_jobs in [1, 2]:
+            results = pysummaries.calculate_table_summary(df, strata='group', by='region', n_jobs=n_jobs)
+            self.assertEqual(list(results.keys()), list(df['region'].unique()))
+            for region, (sum_table, strat_nums) in results.items():
+                sum_table_test, strat_nums_test = pysummaries.calculate_table_summary(df[df['region'] == region], strata='group',
+                        columns_exclude=['region'])
+                self.assertTrue(sum_table.equals(sum_table_test))
+                self.assertEqual(strat_nums, strat_nums_test)
+        tables = pysummaries.get_table_summary(df, strata='group', by='region')
+        self.assertEqual(list(tables.keys()), list(df['region'].unique()))
+        # rendering must not change the numbers of observations
+        sum_table, strat_nums = pysummaries.calculate_table_summary(df.dropna(), strata=['group', 'gender'])
+        strat_nums_test = dict(strat_nums)
+        for x in range(2):
+            pysummaries.pysummaries.render_table_summary(sum_table, strat_nums, backend='gt')
+        self.assertEqual(strat_nums, strat_nums_test)
+
+    def test_from_aggregates(self):
+        df = self.sample_data
+        categorical = df.groupby(['group', 'region'], dropna=False, sort=False).size().reset_index(name='count')
+        categorical = categorical.rename(columns={'region': 'level'}).assign(variable='region')
+        numerical = list()
+        for group, rows in list(df.groupby('group', sort=False)) + [(None, df)]:
+            age = rows['age']
+            numerical.append({'group': group, 'variable': 'age', 'count': age.count(), 'nmissing': age.isna().sum(),
+                'sum': age.sum(), 'sum_squares': (age**2).sum(), 'min': age.min(), 'max': age.max(),
+                'q1': age.quantile(0.25), 'median': age.median(), 'q3': age.quantile(0.75)})
+        numerical = pd.DataFrame(numerical)
+        sum_table_test, strat_nums_test = pysummaries.calculate_table_summary(df, strata='group', columns_include=['region', 'age'])
+        sum_table, strat_nums = pysummaries.from_aggregates(categorical, numerical, strata='group')
+        self.assertTrue(sum_table.equals(sum_table_test))
+        self.assertEqual(strat_nums, strat_nums_test)
+        # without quantile columns only functions without quantiles can be calculated
+        moments = numerical.drop(columns=['q1', 'median', 'q3'])
+        with self.assertRaises(Exception):
+            pysummaries.from_aggregates(categorical, moments, strata='group')
+        functions = {'Mean (SD)': pysummaries.numerical_mean_sd, 'Min ; Max': pysummaries.numerical_min_max}
+        sum_table_test, strat_nums_test = pysummaries.calculate_table_summary(df, strata='group', columns_include=['region', 'age'],
+                numerical_functions=functions)
+        sum_table, strat_nums = pysummaries.from_aggregates(categorical, moments, strata='group', numerical_functions=functions)
+        self.assertTrue(sum_table.equals(sum_table_test))
+
+    def test_summarize_sql(self):
+        # integer minimum and maximum must not become floats
+        df = self.sample_data.assign(visits=np.arange(len(self.sample_data)) % 10)
+        connection = sqlite3.connect(':memory:')
+        df.to_sql('patients', connection, index=False)
+        # strata come sorted from the database
+        sum_table_test, strat_nums_test = pysummaries.calculate_table_summary(df.sort_values('group', kind='stable'), strata='group')
+        sum_table, strat_nums = pysummaries.summarize_sql(connection, 'patients', strata='group')
+        self.assertTrue(sum_table.equals(sum_table_test))
+        self.assertEqual(strat_nums, strat_nums_test)
+        connection.close()
+
+    def test_summarize_duckdb(self):
+        try:
+            import duckdb
+        except ImportError:
+            self.skipTest("duckdb is not installed")
+        df = self.sample_data.assign(visits=np.arange(len(self.sample_data)) % 10)
+        connection = duckdb.connect()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for indx, part in enumerate([df.iloc[:50], df.iloc[50:]]):
+                connection.register('part', part)
+                connection.execute(f"COPY (SELECT * FROM part) TO '{os.path.join(tmpdir, f'part{indx}.parquet')}'")
+            sum_table, strat_nums = pysummaries.summarize_duckdb(os.path.join(tmpdir, '*.parquet'), strata='group', connection=connection)
+            # the sample, the check of missing strata, all the categorical counts and all the numerical groupings: four scans
+            queries = list()
+            class LoggedCursor:
+                def __init__(self):
+                    self.cursor = connection.cursor()
+                def execute(self, query):
+                    queries.append(query)
+                    self.cursor.execute(query)
+                    self.description = self.cursor.description
+                def fetchall(self):
+                    return self.cursor.fetchall()
+                def close(self):
+                    self.cursor.close()
+            class LoggedConnection:
+                def cursor(self):
+                    return LoggedCursor()
+            source = f"SELECT * FROM read_parquet('{os.path.join(tmpdir, '*.parquet')}')"
+            nested_table, nested_nums = pysummaries.summarize_sql(LoggedConnection(), source, strata=['group', 'gender'],
+                    where='gender IS NOT NULL', quantile_method='quantile_cont')
+            self.assertEqual(len(queries), 4)
+        sum_table_test, strat_nums_test = pysummaries.calculate_table_summary(df.sort_values('group', kind='stable'), strata='group')
+        self.assertTrue(sum_table.equals(sum_table_test))
+        self.assertEqual(strat_nums, strat_nums_test)
+        nested = df.dropna(subset=['gender']).sort_values(['group', 'gender'], kind='stable')
+        sum_table_test, strat_nums_test = pysummaries.calculate_table_summary(nested, strata=['group', 'gender'])
+        self.assertTrue(nested_table.equals(sum_table_test))
+        self.assertEqual(nested_nums, strat_nums_test)
+
+    def test_memory_mapped_input(self):
+        df = pd.DataFrame({'x': np.linspace(0, 10, 100), 'k': np.arange(100, dtype=np.int32), 'g': np.arange(100, dtype=np.int8) % 3})
+        sum_table_test, strat_nums_test = pysummaries.calculate_table_summary(df, strata='g')
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'data.bin')
+            df.to_records(index=False).tofile(filename)
+            data = np.memmap(filename, dtype=df.to_records(index=False).dtype, mode='r')
+            sum_table, strat_nums = pysummaries.calculate_table_summary(data, strata='g')
+            self.assertTrue(sum_table.equals(sum_table_test))
+            self.assertEqual(strat_nums, strat_nums_test)
+            del data
+            # the cells of data sorted by the strata are slices of the mapped column
+            sorted_df = df.sort_values('g', kind='stable')
+            sorted_df.to_records(index=False).tofile(filename)
+            data = np.memmap(filename, dtype=df.to_records(index=False).dtype, mode='r')
+            mapped = pysummaries.table_summary.utils.as_dataframe(data)
+            rows = np.flatnonzero(data['g'] == 1)
+            curseries = pysummaries.table_summary.table_summary.get_series(mapped, 'x', 'numerical', rows=rows)
+            self.assertTrue(np.shares_memory(curseries.to_numpy(), data))
+            sum_table, strat_nums = pysummaries.calculate_table_summary(mapped, strata='g')
+            sum_table_test, strat_nums_test = pysummaries.calculate_table_summary(sorted_df.reset_index(drop=True), strata='g')
+            self.assertTrue(sum_table.equals(sum_table_test))
+            self.assertEqual(strat_nums, strat_nums_test)
+            del data, mapped, curseries
+        try:
+            import pyarrow.feather
+        except ImportError:
+            self.skipTest("pyarrow is not installed")
+        df = self.sample_data
+        sum_table_test, strat_nums_test = pysummaries.calculate_table_summary(df, strata='group')
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'data.feather')
+            pyarrow.feather.write_feather(df, filename, compression='uncompressed')
+            # string columns stay in the Arrow buffers instead of becoming python objects
+            data = pysummaries.table_summary.utils.as_dataframe(filename)
+            for colname in ('gender', 'region', 'group'):
+                self.assertTrue(isinstance(data[colname].dtype, pd.ArrowDtype))
+            sum_table, strat_nums = pysummaries.calculate_table_summary(filename, strata='group')
+            self.assertTrue(sum_table.equals(sum_table_test))
+            self.assertEqual(strat_nums, strat_nums_test)
+            del data
+
+    def test_missing_level_counts(self):
+        df = self.sample_data.copy()
+        df['group_cat'] = df['group'].astype('category')
+        original = df.copy()
+        sum_table, strat_nums = pysummaries.calculate_table_summary(df, strata='group')
+        self.assertTrue(df.equals(original))
+        sum_table_empty, strat_nums_empty = pysummaries.calculate_table_summary(df, where=np.array([], dtype=np.int64))
+        self.assertEqual(strat_nums_empty, {'Overall': 0})
+        filled = df.copy()
+        for colname in ('gender', 'region'):
+            filled[colname] = filled[colname].fillna('Missing')
+        filled['group_cat'] = filled['group_cat'].cat.add_categories(['Missing'])
+        sum_table_test, strat_nums_test = pysummaries.calculate_table_summary(filled, strata='group', categorical_missing_level=None)
+        self.assertTrue(sum_table.equals(sum_table_test))
+        self.assertEqual(strat_nums, strat_nums_test)
+
+    def test_summary_frame_builder(self):
+        df = self.sample_data.dropna()
+        sum_table, strat_nums = pysummaries.calculate_table_summary(df, strata=['group', 'region'])
+        self.assertTrue(isinstance(sum_table.index, pd.MultiIndex))
+        self.assertEqual(len(sum_table), len(sum_table.index.unique()))
+        # levels missing in a cell are filled with the empty level value of the preset
+        rows = df[(df.group == 'Control') & (df.region == 'East')]
+        for gender in df['gender'].unique():
+            if gender not in rows['gender'].values:
+                self.assertEqual(sum_table.loc[('gender', gender), ('Control', 'East')], '0 (0%)')
+        sum_table_n, _ = pysummaries.calculate_table_summary(df, strata='group', categorical_functions='n')
+        self.assertEqual(sum_table_n.loc[('gender', 'Male'), 'Overall'], (df['gender'] == 'Male').sum())
+
+    def test_extension_dtypes(self):
+        df = self.sample_data
+        sum_table_test, strat_nums_test = pysummaries.calculate_table_summary(df, strata='group')
+        nullable = df.assign(gender=df['gender'].astype('string'), age=df['age'].astype('Float32').astype('Float64'))
+        sum_table, strat_nums = pysummaries.calculate_table_summary(nullable, strata='group')
+        self.assertTrue(sum_table.equals(sum_table_test))
+        self.assertEqual(pysummaries.table_summary.utils.detect_df_col_types(df.assign(age=df['age'].astype(np.float32)))['age'],
+                'numerical')
+        # integers with missing values keep integer minimum and maximum in every kernel
+        rows = np.arange(len(df))
+        visits = df.assign(visits=pd.array(np.where(rows % 7 == 0, None, rows % 10), dtype='Int64'))
+        functions = {'Min, Max': pysummaries.numerical_min_max, 'Missing': pysummaries.numerical_missing,
+                     'Median [Q1 ; Q3]': pysummaries.numerical_median_q1q3}
+        sum_table, _ = pysummaries.calculate_table_summary(visits, strata='group', columns_include=['visits'], numerical_functions=functions)
+        self.assertEqual(sum_table.loc[('visits', 'Min, Max'), 'Overall'], '0 ; 9')
+        # the overall merged from the strata is the same as calculated on the whole column, with integer quartiles
+        # as pandas gives them for nullable integers with missing values
+        overall, _ = pysummaries.calculate_table_summary(visits, columns_include=['visits'], numerical_functions=functions)
+        self.assertTrue(sum_table['Overall'].equals(overall['Overall']))
+        self.assertEqual(sum_table.loc[('visits', 'Median [Q1 ; Q3]'), 'Overall'], '4.5 [2 ; 7]')
+        self.assertEqual(sum_table.loc[('visits', 'Missing'), 'Overall'], f"{len(rows[::7])} ({len(rows[::7])/len(df)*100:.1f} %)")
+        other, _ = pysummaries.calculate_table_summary(visits, strata='group', columns_include=['visits'], numerical_functions=functions,
+                precision='float32')
+        self.assertTrue(other.equals(sum_table))
+        # chunks of 10 rows
+        accumulators = pysummaries.table_summary.accumulators
+        acc = accumulators.chunked_accumulators(visits['visits'], 'numerical', np.zeros(len(df), dtype=np.int64), 1, 10)[0]
+        for funlabel, fun in functions.items():
+            self.assertEqual(acc.apply(fun, 1), sum_table.loc[('visits', funlabel), 'Overall'])
+        try:
+            import pyarrow
+        except ImportError:
+            self.skipTest("pyarrow is not installed")
+        arrow = df.assign(gender=df['gender'].astype('string[pyarrow]'), region=df['region'].astype(pd.ArrowDtype(pyarrow.large_string())),
+                age=df['age'].astype('double[pyarrow]'))
+        coltypes = pysummaries.table_summary.utils.detect_df_col_types(arrow)
+        self.assertEqual([coltypes[c] for c in ('gender', 'region', 'age')], ['categorical', 'categorical', 'numerical'])
+        sum_table, strat_nums = pysummaries.calculate_table_summary(arrow, strata='group')
+        self.assertTrue(sum_table.equals(sum_table_test))
+        self.assertEqual(strat_nums, strat_nums_test)
+        arrow_visits = visits.assign(visits=visits['visits'].astype('int64[pyarrow]'))
+        sum_table, _ = pysummaries.calculate_table_summary(arrow_visits, strata='group', columns_include=['visits'], numerical_functions=functions)
+        self.assertTrue(sum_table.equals(other))
+        dates = pd.DataFrame({'date': pd.Series(pd.date_range('2024-01-01', periods=3)).astype(pd.ArrowDtype(pyarrow.timestamp('ns'))),
+                              'day': pd.Series(pd.date_range('2024-01-01', periods=3).date, dtype=pd.ArrowDtype(pyarrow.date32()))})
+        self.assertEqual(pysummaries.table_summary.utils.detect_df_col_types(dates), {'date': 'datetime', 'day': 'datetime'})
+
+    def test_sparse_columns(self):
+        rows = np.arange(len(self.sample_data))
+        df = self.sample_data.assign(dose=np.where(rows % 4 == 0, 10.0, 0.0), ae=rows % 5 == 0)
+        df.loc[df.index[:3], 'dose'] = np.nan
+        sum_table_test, strat_nums_test = pysummaries.calculate_table_summary(df, strata='group')
+        sparse = df.assign(dose=df['dose'].astype(pd.SparseDtype(float, 0.0)), ae=df['ae'].astype(pd.SparseDtype(bool, False)),
+                gender=df['gender'].astype(pd.SparseDtype(object, 'Male')))
+        sum_table, strat_nums = pysummaries.calculate_table_summary(sparse, strata='group')
+        self.assertTrue(sum_table.equals(sum_table_test))
+        self.assertEqual(strat_nums, strat_nums_test)
+
+    def test_max_levels(self):
+        rows = np.arange(len(self.sample_data))
+        df = self.sample_data.assign(visit=np.where(rows % 2 == 0, 'screening', [f"visit {x}" for x in rows]))
+        with self.assertRaises(Exception):
+            pysummaries.calculate_table_summary(df, strata='group', max_levels=20)
+        sum_table, strat_nums = pysummaries.calculate_table_summary(df, strata='group', max_levels=20, high_cardinality='skip')
+        sum_table_test, strat_nums_test = pysummaries.calculate_table_summary(df, strata='group', columns_exclude=['visit'])
+        self.assertTrue(sum_table.equals(sum_table_test))
+        sum_table, strat_nums = pysummaries.calculate_table_summary(df, strata='group', max_levels=4, high_cardinality='other')
+        # collapsed columns have a missing level only if there are missing values
+        self.assertEqual(sum_table.loc['visit'].index.to_list(), ['screening', 'visit 1', 'visit 3', 'visit 5', 'Other'])
+        self.assertEqual(sum_table.loc[('visit', 'Other'), 'Overall'], '47 (46.5 %)')
+        self.assertTrue(sum_table.drop(index='visit', level=0).equals(sum_table_test))
+
+    def test_categorical_top_k(self):
+        rows = np.arange(len(self.sample_data))
+        df = self.sample_data.assign(code=[f"code {x}" for x in np.minimum(rows % 7, rows % 11)])
+        df.loc[df.index[:5], 'code'] = np.nan
+        sum_table, strat_nums = pysummaries.calculate_table_summary(df, strata='group', categorical_top_k=3)
+        sum_table_test, strat_nums_test = pysummaries.calculate_table_summary(df, strata='group')
+        self.assertEqual(strat_nums, strat_nums_test)
+        top = df['code'].value_counts().index[:3].to_list()
+        self.assertEqual(sum_table.loc['code'].index.to_list(), top + ['Other', 'Missing'])
+        self.assertTrue(sum_table.loc['code'].loc[top].equals(sum_table_test.loc['code'].loc[top]))
+        nother = df['code'].notna().sum() - df['code'].value_counts().iloc[:3].sum()
+        self.assertTrue(sum_table.loc[('code', 'Other'), 'Overall'].startswith(f"{nother} ("))
+        # the top levels are found merging the summaries of chunks
+        counts = pysummaries.table_summary.table_summary.get_top_levels(df['code'], 3, chunk_size=10)
+        self.assertEqual(counts.index.to_list(), top)
+        sum_table, strat_nums = pysummaries.calculate_table_summary(df.astype({'code': 'category'}), categorical_top_k=3)
+        self.assertEqual(sum_table.loc['code'].index.to_list(), top + ['Other', 'Missing'])
+        # no missing level if the selected rows have no missing values
+        for code in (df['code'], df['code'].astype('category')):
+            sum_table, strat_nums = pysummaries.calculate_table_summary(df.assign(code=code), strata='group', categorical_top_k=3,
+                    where=rows >= 5)
+            self.assertEqual(sum_table.loc['code'].index.to_list()[-1], 'Other')
+
+    def test_preview(self):
+        df = self.sample_data
+        preview = pysummaries.get_table_summary(df, strata='group', preview=True, preview_size=50, random_state=0, table_id=self.table_id)
+        self.assertEqual((preview.sample_size, preview.nrows), (50, len(df)))
+        self.assertIn('Mean [95% CI]', preview._repr_html_())
+        exact = pysummaries.get_table_summary(df, strata='group', table_id=self.table_id)
+        self.assertEqual(preview.refine()._repr_html_(), exact._repr_html_())
+        # the sample is drawn from the rows selected by where
+        sample, nrows = pysummaries.table_summary.strata.sample_rows(df, {'group': 'Control'}, 20, random_state=0)
+        self.assertEqual((len(sample), nrows), (20, (df['group'] == 'Control').sum()))
+        self.assertTrue((df['group'].iloc[sample] == 'Control').all())
+        # confidence intervals from accumulators are the same as from the series
+        functions = dict(categorical_functions=(pysummaries.categorical_percent_ci, '0.0 %'),
+                         numerical_functions={'Mean [95% CI]': pysummaries.numerical_mean_ci})
+        sum_table, strat_nums = pysummaries.calculate_table_summary(df, strata='group', **functions)
+        for group in ['Control', 'Experimental']:
+            sum_table_test, strat_nums_test = pysummaries.calculate_table_summary(df[df['group'] == group], 
+                    columns_exclude=['group'], **functions)
+            self.assertTrue(sum_table_test['Overall'].equals(sum_table.loc[sum_table_test.index, group]))
+
+    def test_memory_limit(self):
+        df = pd.concat([self.sample_data] * 40, ignore_index=True)
+        for strata in [None, 'group']:
+            sum_table_test, strat_nums_test = pysummaries.calculate_table_summary(df, strata=strata)
+            # under the minimum chunk size, chunks of 1000 rows
+            sum_table, strat_nums = pysummaries.calculate_table_summary(df, strata=strata, memory_limit=200000)
+            self.assertEqual(sum_table.attrs['chunk_size'], 1000)
+            self.assertTrue(sum_table.equals(sum_table_test))
+            self.assertEqual(strat_nums, strat_nums_test)
+        # 16 bytes per row for the cell codes, a sketch of 10000 values and weights for the cell, and two chunks of 
+        # 40 bytes per row for the categorical column
+        rows = np.arange(40000)
+        large = pd.DataFrame({'x': rows / 7, 'c': np.where(rows % 3 == 0, 'a', 'b').astype(object)})
+        for chunk_size in [5000, 8000]:
+            memory_limit = 16 * len(large) + 2 * 16 * 10000 + 2 * 40 * chunk_size
+            sum_table, strat_nums = pysummaries.calculate_table_summary(large, memory_limit=memory_limit)
+            self.assertEqual(sum_table.attrs['engine'], 'chunked')
+            self.assertEqual(sum_table.attrs['chunk_size'], chunk_size)
+        # by groups in two threads get half of the limit each: in memory with one thread, chunks of 1000 rows with two
+        large['b'] = rows % 2
+        memory_limit = 2 * (16 * len(large) + 2 * 16 * 10000 + 2 * 40 * 1000)
+        for n_jobs, engine in [(1, 'loop'), (2, 'chunked')]:
+            tables = pysummaries.calculate_table_summary(large, by='b', memory_limit=memory_limit, n_jobs=n_jobs)
+            self.assertTrue(all([tone.attrs['engine'] == engine for tone, strat_nums in tables.values()]))
+        self.assertEqual(tables[0][0].attrs['chunk_size'], 1000)
+        # not enough for the cell codes of all rows, or for them and the sketches of the cells
+        for memory_limit in (16 * len(df), 16 * len(df) + 100000):
+            with self.assertRaises(Exception):
+                pysummaries.calculate_table_summary(df, strata='group', memory_limit=memory_limit)
+        df = self.sample_data
+        self.assertEqual(pysummaries.table_summary.utils.parse_memory_size('4GB'), 4 * 1024**3)
+        with self.assertRaises(Exception):
+            pysummaries.calculate_table_summary(df, memory_limit=4000, numerical_functions={'Mean': lambda x, r: x.mean()})
+        # quantiles from a sketch with less points than observations are approximate
+        accumulators = pysummaries.table_summary.accumulators
+        values = np.arange(1000, dtype=np.float64)
+        acc = accumulators.chunked_accumulators(pd.Series(values), 'numerical', np.zeros(1000, dtype=np.int64), 1, 100, sketch_size=50)[0]
+        self.assertLessEqual(len(acc.sketch.points), 50)
+        self.assertAlmostEqual(acc.quantile(0.25), np.quantile(values, 0.25), delta=20)
+        self.assertEqual(acc.mean(), values.mean())
+
+    def test_engine_auto(self):
+        df = self.sample_data.copy()
+        sum_table, strat_nums = pysummaries.calculate_table_summary(df, strata='group')
+        self.assertEqual(sum_table.attrs['engine'], 'loop')
+        df['weight'] = np.linspace(50, 90, len(df))
+        sum_table_test, strat_nums_test = pysummaries.calculate_table_summary(df, strata='group', engine='loop')
+        sum_table, strat_nums = pysummaries.calculate_table_summary(df, strata='group')
+        self.assertEqual(sum_table.attrs['engine'], 'wide')
+        self.assertTrue(sum_table.equals(sum_table_test))
+        # the float64 block of 10 float columns does not fit in the limit, but the columns one by one do
+        floats = pd.DataFrame(np.linspace(0, 1, 10000).reshape(1000, 10))
+        sum_table_test, strat_nums_test = pysummaries.calculate_table_summary(floats, engine='loop')
+        sum_table, strat_nums = pysummaries.calculate_table_summary(floats)
+        self.assertEqual(sum_table.attrs['engine'], 'wide')
+        sum_table, strat_nums = pysummaries.calculate_table_summary(floats, memory_limit=100000)
+        self.assertEqual(sum_table.attrs['engine'], 'loop')
+        self.assertTrue(sum_table.equals(sum_table_test))
+        # memory-mapped columns are not copied into the block
+        with tempfile.TemporaryDirectory() as tmpdir:
+            data = np.memmap(os.path.join(tmpdir, 'data.bin'), dtype=np.float64, mode='w+', shape=floats.shape)
+            data[:] = floats.to_numpy()
+            sum_table, strat_nums = pysummaries.calculate_table_summary(data)
+            self.assertEqual(sum_table.attrs['engine'], 'loop')
+            self.assertTrue(sum_table.equals(sum_table_test))
+            del data
+        tables = pysummaries.calculate_table_summary(df, by='group', n_jobs=2)
+        self.assertTrue(all([tone.attrs['n_jobs'] == 2 for tone, strat_nums in tables.values()]))
+        with self.assertRaises(Exception):
+            pysummaries.calculate_table_summary(df, engine='fast')
+
+    def test_precision_float32(self):
+        rows = np.arange(len(self.sample_data))
+        df = self.sample_data.assign(visits=rows % 7 - 3, dose=(rows % 9) * 2.5, weight=np.linspace(50.1, 90.3, len(rows)))
+        df.loc[df.index[:4], 'dose'] = np.nan
+        for strata in [None, 'group']:
+            for rounding in [0, 1, 2]:
+                sum_table_test, strat_nums_test = pysummaries.calculate_table_summary(df, strata=strata, rounding=rounding)
+                sum_table, strat_nums = pysummaries.calculate_table_summary(df, strata=strata, rounding=rounding, precision='float32')
+                self.assertTrue(sum_table.equals(sum_table_test))
+                self.assertEqual(strat_nums, strat_nums_test)
+        narrow_values = pysummaries.table_summary.utils.narrow_values
+        self.assertEqual(narrow_values(df['visits'].to_numpy()).dtype, np.int8)
+        self.assertEqual(narrow_values(df['dose'].to_numpy()).dtype, np.float32)
+        self.assertEqual(narrow_values(df['weight'].to_numpy()).dtype, np.float64)
+        # a value that changes in a block after the sample, or overflows, keeps float64
+        values = np.arange(5000, dtype=np.float64)
+        self.assertTrue(np.array_equal(narrow_values(values, block_size=100), values))
+        self.assertEqual(narrow_values(values, block_size=100).dtype, np.float32)
+        for value in (0.1, 1e300):
+            values[4321] = value
+            self.assertEqual(narrow_values(values, block_size=100).dtype, np.float64)
+
+    def test_bootstrap_ci(self):
+        bootstrap = pysummaries.table_summary.bootstrap
+        # small batches so that resamples are spread over the threads
+        batch_weights = bootstrap.batch_weights
+        bootstrap.batch_weights = 1000
+        try:
+            sum_table_test, strat_nums_test = pysummaries.calculate_table_summary(self.sample_data, strata='group', ci='bootstrap',
+                    random_state=42, n_jobs=1)
+            sum_table, strat_nums = pysummaries.calculate_table_summary(self.sample_data, strata='group', ci='bootstrap',
+                    random_state=42, n_jobs=4)
+        finally:
+            bootstrap.batch_weights = batch_weights
+        self.assertTrue(sum_table.equals(sum_table_test))
+        self.assertEqual(strat_nums, strat_nums_test)
+        default_table, _ = pysummaries.calculate_table_summary(self.sample_data, strata='group')
+        for column in sum_table.columns:
+            for statistic in ["Mean [95% CI]", "Median [95% CI]"]:
+                estimate, interval = sum_table.loc[('age', statistic), column].split(" [")
+                lower, upper = [float(x) for x in interval.rstrip("]").split(" ; ")]
+                self.assertTrue(lower <= float(estimate) <= upper)
+            self.assertTrue(sum_table.loc[('gender', 'Male'), column].startswith(default_table.loc[('gender', 'Male'), column]))
+            self.assertTrue(sum_table.loc[('gender', 'Male'), column].endswith("]"))
+        # intervals of percentages are not added to cells showing only counts
+        counts_table, _ = pysummaries.calculate_table_summary(self.sample_data, strata='group', categorical_functions='n',
+                ci='bootstrap', random_state=42)
+        default_table, _ = pysummaries.calculate_table_summary(self.sample_data, strata='group', categorical_functions='n')
+        self.assertTrue(counts_table.loc['gender'].equals(default_table.loc['gender']))
+        self.assertTrue(counts_table.loc[('age', 'Mean [95% CI]')].str.endswith("]").all())
+        with self.assertRaises(Exception):
+            pysummaries.calculate_table_summary(self.sample_data, ci='normal')
+        # chunks keep only sketches of the values
+        with self.assertRaises(Exception):
+            pysummaries.calculate_table_summary(self.sample_data, ci='bootstrap', memory_limit='4GB')
+
+    def test_summary_cube(self):
+        df = self.sample_data.dropna(subset=['gender', 'region'])
+        # integers and nullable integers with missing values keep integer minimum, maximum and quantiles
+        rows = np.arange(len(df))
+        df = df.assign(visits=rows % 5, doses=pd.array(np.where(rows % 7 == 0, None, rows % 4), dtype='Int64'))
+        cube = pysummaries.SummaryCube(df, dimensions=['group', 'gender', 'region'])
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'cube.pkl')
+            cube.save(filename)
+            cube = pysummaries.SummaryCube.load(filename)
+        for strata in ['group', None, ['group', 'gender']]:
+            for where in [None, {'region': ['North', 'South']}]:
+                sum_table_test, strat_nums_test = pysummaries.calculate_table_summary(df, strata=strata, where=where)
+                sum_table, strat_nums = cube.calculate_table_summary(strata=strata, where=where)
+                self.assertTrue(sum_table.equals(sum_table_test))
+                self.assertEqual(strat_nums, strat_nums_test)
+        # sketches are bounded and keep exact moments, sorted values only with exact_quantiles
+        exact_cube = pysummaries.SummaryCube(df, dimensions=['group'], exact_quantiles=True)
+        small_cube = pysummaries.SummaryCube(df, dimensions=['group'], sketch_size=8)
+        self.assertLess(small_cube.memory_usage(), exact_cube.memory_usage())
+        self.assertLessEqual(len(small_cube.values['age']), 16)
+        sum_table_test, _ = pysummaries.calculate_table_summary(df, strata='group')
+        self.assertTrue(exact_cube.calculate_table_summary(strata='group')[0].equals(sum_table_test))
+        sum_table, _ = small_cube.calculate_table_summary(strata='group')
+        for statistic in ['Mean (SD)', 'Min ; Max', 'Missing']:
+            self.assertTrue(sum_table.loc[('age', statistic)].equals(sum_table_test.loc[('age', statistic)]))
+        with self.assertRaises(Exception):
+            small_cube.calculate_table_summary(numerical_functions={'Mean': lambda x, rounding: x.mean()})
+
 if __name__ == '__main__':
 
     import sys